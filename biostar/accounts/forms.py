@@ -1,6 +1,5 @@
 
 import logging
-import mistune
 from django import forms
 
 from django.contrib import messages
@@ -9,6 +8,7 @@ from snowpenguin.django.recaptcha2.widgets import ReCaptchaWidget
 from django.contrib.auth.models import User
 from django.conf import settings
 from pagedown.widgets import PagedownWidget
+from biostar.utils import markup
 from .models import Profile
 from . import auth
 
@@ -151,7 +151,7 @@ class EditProfile(forms.Form):
                                                       my_tags=self.cleaned_data["my_tags"],
                                                       digest_prefs=self.cleaned_data["digest_prefs"],
                                                       message_prefs=self.cleaned_data["message_prefs"],
-                                                      html=mistune.markdown(self.cleaned_data["text"]),
+                                                      html=markup.render(self.cleaned_data["text"]),
                                                       email_verified=email_verified)
         return self.user
 
@@ -0,0 +1,23 @@
+# Generated by Django 2.0.13 on 2026-10-19 08:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='data_size',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='job_size',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
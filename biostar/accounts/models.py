@@ -1,5 +1,4 @@
 import uuid
-import mistune
 
 from django.contrib.auth.models import User
 
@@ -7,6 +6,7 @@ from django.db.models.signals import post_save
 from django.dispatch import receiver
 from django.db import models
 from biostar import settings
+from biostar.utils import markup
 
 
 MAX_UID_LEN = 32
@@ -52,6 +52,11 @@ class Profile(models.Model):
     # Maximum amount of uploaded files a user is allowed to aggregate, in mega-bytes.
     max_upload_size = models.IntegerField(default=0)
 
+    # Storage used by the uploaded data and the job outputs of the user, in bytes.
+    # Maintained by the engine, rebuilt with the usage command.
+    data_size = models.BigIntegerField(default=0)
+    job_size = models.BigIntegerField(default=0)
+
     role = models.IntegerField(default=NORMAL, choices=ROLE_CHOICES)
     last_login = models.DateTimeField(null=True, db_index=True)
 
@@ -98,16 +103,34 @@ class Profile(models.Model):
 
     objects = Manager()
 
+    # Fields that are only changed with atomic updates.
+    COUNTERS = ("data_size", "job_size")
+
     def __str__(self):
         return self.user.email
 
     def save(self, *args, **kwargs):
         self.uid = self.uid or generate_uuid(8)
-        self.html = self.html or mistune.markdown(self.text)
+        self.html = self.html or markup.render(self.text)
         self.max_upload_size = self.max_upload_size or settings.MAX_UPLOAD_SIZE
         self.name = self.name or self.user.first_name or self.user.email.split("@")[0]
+
+        # Stale counters in memory must not overwrite the stored values.
+        if not self._state.adding and not kwargs.get("update_fields") and not kwargs.get("force_insert"):
+            kwargs["update_fields"] = [f.name for f in self._meta.concrete_fields
+                                       if f.name not in self.COUNTERS and not f.primary_key]
+
         super(Profile, self).save(*args, **kwargs)
 
+    def storage_used(self):
+        """
+        The storage that counts towards the upload limit, in bytes.
+        """
+        used = self.data_size
+        if settings.UPLOAD_LIMIT_INCLUDES_JOBS:
+            used += self.job_size
+        return used
+
     def can_moderate(self, source):
         "Check if the source user can moderate the target( self.user)"
 
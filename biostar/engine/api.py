@@ -1,63 +1,128 @@
 
+import hashlib
+import os
+from functools import lru_cache
+from urllib.parse import quote
+
 import hjson
 
 from django.conf import settings
-from django.http import HttpResponse
+from django.db.models import Max, Count
+from django.http import HttpResponse, StreamingHttpResponse
+from django.views.decorators.http import condition
 from rest_framework import status
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 
-from biostar.engine.models import Analysis, Project
+from biostar.engine import paging, bundle, auth, forms, util, archive
+from biostar.engine.models import Analysis, Project, Data, Job
 from biostar.utils.shortcuts import reverse
-from biostar.engine.decorators import require_api_key
+from biostar.engine.decorators import require_api_key, require_project_api_key, require_api_key_always
 
+# The API lists are sorted by creation, new items are added to the last page.
+API_ORDER = ("id",)
 
-@api_view(['GET'])
-def project_api_list(request):
 
-    projects = Project.objects.get_all()
-    api_key = request.GET.get("k", "")
+def has_api_key(request):
+    return settings.API_KEY == request.GET.get("k", "")
 
-    # Only show public projects when api key is not correct or provided.
-    if settings.API_KEY != api_key:
+
+def api_projects(request):
+    """
+    The projects listed by the API, only public projects without a valid api key.
+    """
+    projects = Project.objects.get_all()
+    if not has_api_key(request):
         projects = projects.filter(privacy=Project.PUBLIC)
+    return projects
 
-    payload = dict()
-    for project in projects:
-        payload.setdefault(project.uid, dict()).update(
-                            name=project.name,
-                            recipes={recipe.uid:
-                                     dict(name=recipe.name,
-                                          json=reverse("recipe_api_json", kwargs=dict(uid=recipe.uid)),
-                                          template=reverse("recipe_api_template", kwargs=dict(uid=recipe.uid)))
-                                     for recipe in project.analysis_set.all()
-                                     },
-                            privacy=dict(Project.PRIVACY_CHOICES)[project.privacy],
-                            )
 
-    return Response(data=payload, status=status.HTTP_200_OK)
+def api_recipes(request):
+    """
+    The recipes listed by the API, only public recipes without a valid api key.
+    """
+    recipes = Analysis.objects.get_all()
+    if not has_api_key(request):
+        recipes = recipes.filter(project__privacy=Project.PUBLIC)
+    return recipes
+
+
+def list_etag(request, *querysets):
+    """
+    An entity tag that changes whenever an object in the querysets is edited, added or removed.
+    """
+    state = [request.GET.urlencode()]
+    for queryset in querysets:
+        stats = queryset.order_by().aggregate(latest=Max("lastedit_date"), count=Count("id"))
+        state.append(f"{stats['latest']}:{stats['count']}")
+    return hashlib.md5("|".join(state).encode("utf-8")).hexdigest()
+
+
+def project_list_etag(request):
+    projects = api_projects(request)
+    return list_etag(request, projects, Analysis.objects.get_all(project__in=projects))
+
+
+def recipe_list_etag(request):
+    return list_etag(request, api_recipes(request))
+
+
+@lru_cache()
+def url_pattern(name):
+    """
+    Reverses a recipe url once, with a placeholder for the uid.
+    """
+    return reverse(name, kwargs=dict(uid="0")).replace("/0/", "/{uid}/")
 
 
+def recipe_urls(recipe):
+    return dict(json=url_pattern("recipe_api_json").format(uid=recipe.uid),
+                template=url_pattern("recipe_api_template").format(uid=recipe.uid))
+
+
+def api_page(request, queryset):
+    """
+    Returns the page selected by the request and the absolute url of the next page.
+    """
+    page = paging.get_page(queryset, cursor=request.GET.get("after", ""), size=settings.API_ITEMS_PER_PAGE,
+                           order=API_ORDER)
+    next_url = paging.next_url(request, page)
+    return page, request.build_absolute_uri(next_url) if next_url else None
+
+
+@condition(etag_func=project_list_etag)
 @api_view(['GET'])
-def recipe_api_list(request):
+def project_api_list(request):
+    """
+    Returns a page of projects with their recipes.
+    """
+    projects = api_projects(request).prefetch_related("analysis_set")
+    page, next_url = api_page(request, projects)
 
-    recipes = Analysis.objects.get_all()
-    api_key = request.GET.get("k", "")
+    privacy = dict(Project.PRIVACY_CHOICES)
+    results = dict()
+    for project in page:
+        recipes = {recipe.uid: dict(name=recipe.name, **recipe_urls(recipe)) for recipe in project.analysis_set.all()}
+        results[project.uid] = dict(name=project.name, recipes=recipes, privacy=privacy[project.privacy])
 
-    # Only show public recipes when api key is not correct or provided.
-    if settings.API_KEY != api_key:
-        recipes = recipes.filter(project__privacy=Project.PUBLIC)
+    return Response(data=dict(results=results, next=next_url), status=status.HTTP_200_OK)
 
-    payload = dict()
-    for recipe in recipes:
-        payload.setdefault(recipe.uid, dict()).update(
-                            name=recipe.name,
-                            json=reverse("recipe_api_json", kwargs=dict(uid=recipe.uid)),
-                            template=reverse("recipe_api_template", kwargs=dict(uid=recipe.uid)),
-                            privacy=dict(Project.PRIVACY_CHOICES)[recipe.project.privacy],
-                            )
 
-    return Response(data=payload, status=status.HTTP_200_OK)
+@condition(etag_func=recipe_list_etag)
+@api_view(['GET'])
+def recipe_api_list(request):
+    """
+    Returns a page of recipes.
+    """
+    recipes = api_recipes(request).select_related("project")
+    page, next_url = api_page(request, recipes)
+
+    privacy = dict(Project.PRIVACY_CHOICES)
+    results = dict()
+    for recipe in page:
+        results[recipe.uid] = dict(name=recipe.name, privacy=privacy[recipe.project.privacy], **recipe_urls(recipe))
+
+    return Response(data=dict(results=results, next=next_url), status=status.HTTP_200_OK)
 
 
 @api_view(['GET', 'PUT'])
@@ -104,3 +169,141 @@ def recipe_template(request, uid):
     return HttpResponse(content=payload, content_type="text/plain")
 
 
+@api_view(['GET', 'PUT'])
+@require_project_api_key
+def project_recipes(request, uid):
+    """
+    GET request: Returns the recipes of a project as one archive.
+    PUT request: Updates and creates the recipes of a project from an archive.
+    """
+    project = Project.objects.get_all(uid=uid).first()
+
+    # API key is always checked by @require_project_api_key decorator.
+    if request.method == "PUT":
+        file_object = request.data.get("file", "")
+        if not file_object:
+            return Response(data=dict(error="An archive is required."), status=status.HTTP_400_BAD_REQUEST)
+        try:
+            created, updated = bundle.import_archive(project=project, stream=file_object)
+        except ValueError as exc:
+            return Response(data=dict(error=f"{exc}"), status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(data=dict(created=created, updated=updated), status=status.HTTP_200_OK)
+
+    recipes = Analysis.objects.filter(project=project).order_by("id")
+    chunks = bundle.stream_archive(project.uid, ((recipe.uid, bundle.recipe_files(recipe)) for recipe in recipes))
+
+    response = StreamingHttpResponse(chunks, content_type="application/gzip")
+    response["Content-Disposition"] = f'attachment; filename="{project.uid}-recipes.tar.gz"'
+
+    return response
+
+
+def job_payload(job):
+    """
+    The description of a job returned by the API.
+    """
+    return dict(uid=job.uid, name=job.name, state=job.get_state_display(), finished=job.is_finished(),
+                url=job.url(), files=reverse("job_api_files", kwargs=dict(uid=job.uid)))
+
+
+def recipe_params(recipe, data):
+    """
+    Returns the parameters of a run request as form data.
+    Data parameters may be given by uid instead of id.
+    """
+    params = {key: data.get(key) for key in data if key != "k"}
+
+    for field, item in recipe.json_data.items():
+        value = params.get(field)
+        if item.get("source") == "PROJECT" and value is not None and not str(value).isdigit():
+            found = Data.objects.get_all(project=recipe.project, uid=value).first()
+            params[field] = found.id if found else value
+
+    return params
+
+
+@api_view(['POST'])
+@require_api_key
+def recipe_run(request, uid):
+    """
+    POST request: Queues a job of the recipe with the parameters in the request.
+    """
+    recipe = Analysis.objects.get_all(uid=uid).first()
+
+    # API key is always checked by @require_api_key decorator.
+    # The job runs on behalf of the project owner.
+    params = recipe_params(recipe, request.data)
+    form = forms.RecipeInterface(request=request, analysis=recipe, json_data=recipe.json_data, data=params,
+                                 user=recipe.project.owner)
+
+    if not form.is_valid():
+        return Response(data=dict(error=form.errors), status=status.HTTP_400_BAD_REQUEST)
+
+    job = auth.create_job(analysis=recipe, json_data=form.fill_json_data())
+    auth.spool_job(job)
+
+    return Response(data=job_payload(job), status=status.HTTP_201_CREATED)
+
+
+@api_view(['GET', 'POST'])
+@require_api_key_always
+def job_status(request):
+    """
+    Returns the state of many jobs in one query.
+    The job uids are comma separated in GET requests or a list in POST requests.
+    """
+    uids = request.data.get("uids", []) if request.method == "POST" else request.GET.get("uids", "")
+    uids = uids.split(",") if isinstance(uids, str) else uids
+    uids = list(dict.fromkeys(uid.strip() for uid in uids if uid.strip()))
+
+    if len(uids) > settings.API_JOB_STATUS_LIMIT:
+        msg = dict(error=f"At most {settings.API_JOB_STATUS_LIMIT} jobs may be requested at once.")
+        return Response(data=msg, status=status.HTTP_400_BAD_REQUEST)
+
+    states = dict(Job.STATE_CHOICES)
+    finished = (Job.COMPLETED, Job.ERROR)
+    rows = Job.objects.filter(uid__in=uids, deleted=False).values_list("uid", "state", "start_date", "end_date")
+
+    jobs = {uid: dict(state=states[state], finished=state in finished, start_date=start, end_date=end)
+            for uid, state, start, end in rows}
+    missing = [uid for uid in uids if uid not in jobs]
+
+    return Response(data=dict(jobs=jobs, missing=missing), status=status.HTTP_200_OK)
+
+
+def job_manifest(job):
+    """
+    Returns the (path, size) of each output file of a job.
+    """
+    if job.is_purged():
+        return []
+
+    if job.is_archived():
+        index = archive.get_index(job.get_archive_path())
+        return [(name, info.file_size) for name, info in sorted(index.items())]
+
+    root = job.get_data_dir()
+    paths = util.walkfiles(root)
+    return [(os.path.relpath(path, root), os.path.getsize(path)) for path in paths]
+
+
+@api_view(['GET'])
+@require_api_key_always
+def job_files(request, uid):
+    """
+    Returns the output files of a job with their sizes and download urls.
+    """
+    job = Job.objects.get_all(uid=uid, deleted=False).first()
+    if not job:
+        return Response(data=dict(error="Job does not exist."), status=status.HTTP_404_NOT_FOUND)
+
+    # Reverse once, the file path is appended.
+    prefix = reverse("job_serve", kwargs=dict(uid=job.uid, path="0"))[:-1]
+    files = [dict(path=path, size=size, url=prefix + quote(path)) for path, size in job_manifest(job)]
+
+    payload = job_payload(job)
+    payload.update(storage=job.get_storage_display(), size=sum(item["size"] for item in files), files=files)
+
+    return Response(data=payload, status=status.HTTP_200_OK)
+
@@ -0,0 +1,286 @@
+"""
+Cold storage for job directories.
+
+Completed job directories are packed into compressed zip archives. The central
+directory of the zip file is the index used to read single files straight out
+of the archive without unpacking it.
+"""
+import functools
+import logging
+import os
+import shutil
+import stat
+import time
+import zipfile
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from biostar.engine import util
+from biostar.engine.models import Job
+
+logger = logging.getLogger("engine")
+
+# The size of the chunks read from archive members.
+CHUNK = 1024 * 1024
+
+# The number of archive indices kept in memory.
+INDEX_CACHE_SIZE = 128
+
+
+def is_link(info):
+    """
+    True when an archive member is a symbolic link.
+    """
+    return stat.S_ISLNK(info.external_attr >> 16)
+
+
+def write_link(zf, path, arcname):
+    """
+    Stores a symbolic link as a link member holding the resolved target.
+    """
+    info = zipfile.ZipInfo(arcname, time.localtime(os.lstat(path).st_mtime)[:6])
+    info.external_attr = (stat.S_IFLNK | 0o777) << 16
+    zf.writestr(info, os.path.realpath(path))
+
+
+def pack(source, dest):
+    """
+    Packs the files in a directory into a zip archive and returns its size.
+    Symbolic links to data stored elsewhere are kept as links, the data is not copied.
+    """
+    tmp = f"{dest}.tmp"
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    inside = os.path.join(os.path.realpath(source), "")
+
+    with zipfile.ZipFile(tmp, mode='w', compression=zipfile.ZIP_DEFLATED, allowZip64=True) as zf:
+        for dirpath, dirnames, fnames in os.walk(source):
+            dirnames.sort()
+            for name in sorted(fnames) + dirnames:
+                path = os.path.join(dirpath, name)
+                arcname = os.path.relpath(path, source)
+                if not os.path.islink(path):
+                    if os.path.isfile(path):
+                        zf.write(path, arcname=arcname)
+                    continue
+
+                # Links within the job directory would dangle once it is removed.
+                if os.path.realpath(path).startswith(inside):
+                    if os.path.isfile(path):
+                        zf.write(path, arcname=arcname)
+                    continue
+
+                write_link(zf, path=path, arcname=arcname)
+
+    # Only complete archives are visible under the final name.
+    os.replace(tmp, dest)
+
+    return os.path.getsize(dest)
+
+
+@functools.lru_cache(maxsize=INDEX_CACHE_SIZE)
+def load_index(fname, mtime, size):
+    """
+    Reads the central directory of an archive into a name to ZipInfo mapping.
+    The modification time and size invalidate the cache when the file changes.
+    """
+    index = {}
+    with zipfile.ZipFile(fname) as zf:
+        for info in zf.infolist():
+            if info.is_dir():
+                continue
+            if is_link(info):
+                index.update(link_members(info.filename, target=zf.read(info).decode()))
+            else:
+                index[info.filename] = info
+    return index
+
+
+def link_members(name, target):
+    """
+    Generates the files behind a link member as members of the archive.
+    The comment of a generated member is the path of the file it stands for.
+    """
+    if os.path.isdir(target):
+        paths = ((os.path.join(name, os.path.relpath(path, target)), path) for path in util.walkfiles(target))
+    else:
+        paths = [(name, target)] if os.path.isfile(target) else []
+
+    for member, path in paths:
+        st = os.stat(path)
+        info = zipfile.ZipInfo(member, time.localtime(st.st_mtime)[:6])
+        info.file_size = st.st_size
+        info.external_attr = (stat.S_IFLNK | 0o777) << 16
+        info.comment = path.encode()
+        yield member, info
+
+
+def get_index(fname):
+    """
+    Returns the index of an archive, or an empty index for missing archives.
+    """
+    try:
+        st = os.stat(fname)
+    except FileNotFoundError:
+        return {}
+    return load_index(fname, st.st_mtime_ns, st.st_size)
+
+
+def member_info(fname, name):
+    """
+    Returns the ZipInfo of an archive member or None.
+    """
+    return get_index(fname).get(name.strip("/"))
+
+
+def is_dir(fname, name):
+    """
+    True when the name is a directory inside the archive.
+    """
+    prefix = name.strip("/")
+    if not prefix:
+        return os.path.isfile(fname)
+    prefix += "/"
+    return any(key.startswith(prefix) for key in get_index(fname))
+
+
+def listdir(fname, name=''):
+    """
+    Returns the sorted names directly under a directory of the archive.
+    """
+    prefix = name.strip("/")
+    prefix = f"{prefix}/" if prefix else ""
+    names = {key[len(prefix):].split("/")[0] for key in get_index(fname) if key.startswith(prefix)}
+    return sorted(names)
+
+
+def member_mtime(info):
+    """
+    Returns the modification time of a member in seconds since the epoch.
+    """
+    return time.mktime(info.date_time + (0, 0, -1))
+
+
+def member_stat(info):
+    """
+    Returns an os.stat_result for an archive member.
+    """
+    mtime = int(member_mtime(info))
+    return os.stat_result((stat.S_IFREG | 0o444, 0, 0, 1, 0, 0, info.file_size, mtime, mtime, mtime))
+
+
+def dir_stat(fname):
+    """
+    Returns an os.stat_result for a directory inside the archive.
+    """
+    st = os.stat(fname)
+    mtime = int(st.st_mtime)
+    return os.stat_result((stat.S_IFDIR | 0o555, st.st_ino, st.st_dev, 1, 0, 0, 0, mtime, mtime, mtime))
+
+
+def open_member(fname, name):
+    """
+    Opens an archive member for reading. The archive stays open
+    until the returned file object is closed.
+    """
+    # Linked members are read from the data they point to.
+    info = member_info(fname, name)
+    if info and is_link(info):
+        return open(info.comment.decode(), 'rb')
+
+    with zipfile.ZipFile(fname) as zf:
+        return zf.open(name.strip("/"))
+
+
+def read_member(fname, name):
+    """
+    Generates the content of an archive member in chunks.
+    """
+    with open_member(fname, name) as fp:
+        while True:
+            chunk = fp.read(CHUNK)
+            if not chunk:
+                break
+            yield chunk
+
+
+def archive_job(job):
+    """
+    Moves a job directory into cold storage.
+    """
+    source = job.get_data_dir()
+    dest = job.get_archive_path()
+
+    size = pack(source=source, dest=dest)
+
+    # Record the new location before removing the files.
+    Job.objects.get_all(pk=job.pk).update(storage=Job.ARCHIVED)
+    job.storage = Job.ARCHIVED
+    job.set_size(size)
+
+    shutil.rmtree(source)
+    logger.info(f"Archived job id={job.id} into {dest}")
+
+
+def purge_job(job):
+    """
+    Removes the outputs of a job, keeping the job metadata.
+    """
+    Job.objects.get_all(pk=job.pk).update(storage=Job.PURGED)
+    job.storage = Job.PURGED
+    job.set_size(0)
+
+    shutil.rmtree(job.get_data_dir(), ignore_errors=True)
+    archive = job.get_archive_path()
+    if os.path.isfile(archive):
+        os.remove(archive)
+
+    logger.info(f"Purged the outputs of job id={job.id}")
+
+
+def select_jobs(queryset, days):
+    """
+    Returns the jobs that ended more than a number of days ago.
+    """
+    cutoff = timezone.now() - timedelta(days=days)
+    ended = queryset.filter(end_date__isnull=False, end_date__lt=cutoff)
+    never = queryset.filter(end_date__isnull=True, date__lt=cutoff)
+
+    return (ended | never).exclude(state__in=(Job.QUEUED, Job.RUNNING, Job.SPOOLED))
+
+
+def apply_policy(archive_days=None, purge_days=None, dry=False):
+    """
+    Applies the storage policies, returns the number of archived and purged jobs.
+    """
+    archive_days = settings.JOB_ARCHIVE_DAYS if archive_days is None else archive_days
+    purge_days = settings.JOB_PURGE_DAYS if purge_days is None else purge_days
+
+    archived = purged = 0
+
+    # Retention drops the outputs of the oldest jobs entirely.
+    if purge_days:
+        query = Job.objects.exclude(storage=Job.PURGED)
+        for job in select_jobs(query, days=purge_days):
+            purged += 1
+            if dry:
+                logger.info(f"Would purge job id={job.id}")
+                continue
+            purge_job(job)
+
+    if archive_days:
+        query = Job.objects.filter(storage=Job.PRIMARY, state=Job.COMPLETED)
+        for job in select_jobs(query, days=archive_days):
+            if not os.path.isdir(job.get_data_dir()):
+                continue
+            archived += 1
+            if dry:
+                logger.info(f"Would archive job id={job.id}")
+                continue
+            try:
+                archive_job(job)
+            except Exception as exc:
+                logger.error(f"Unable to archive job id={job.id}: {exc}")
+
+    return archived, purged
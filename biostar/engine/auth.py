@@ -2,6 +2,7 @@ import difflib
 import logging
 import uuid, copy
 import os
+import time
 from mimetypes import guess_type
 
 import hjson
@@ -16,12 +17,19 @@ from django.utils.safestring import mark_safe
 from django.utils.timezone import now
 
 from . import models
-from . import util
+from . import util, fulltext, codesearch
+from . import tasks
 from .const import *
 from .models import Data, Analysis, Job, Project, Access
 
 logger = logging.getLogger("engine")
 
+# The request attribute that holds the access map of the user.
+ACCESS_ATTR = "_access_map"
+
+# The session key that holds a copy of the access map.
+ACCESS_SESSION_KEY = "access_map"
+
 
 def get_uuid(limit=32):
     return str(uuid.uuid4())[:limit]
@@ -191,23 +199,23 @@ def get_project_list(user, include_public=True, include_deleted=False):
     """
     Return projects visible to a user.
     """
-    privacy = None
-    if include_public:
-        privacy = Project.PUBLIC
-
     if user.is_anonymous:
         # Unauthenticated users see public projects.
-        cond = Q(privacy=Project.PUBLIC)
-    else:
+        cond = Q(user=None)
+    elif include_public:
         # Authenticated users see public projects and private projects with access rights.
-        cond = Q(owner=user, privacy=Project.PRIVATE) | Q(privacy=privacy) | Q(access__user=user,
-                                                                               access__access__in=[Access.READ_ACCESS,
-                                                                                                   Access.WRITE_ACCESS])
+        cond = Q(user=None) | Q(user=user)
+    else:
+        cond = Q(user=user)
+
+    # The visibility table holds one row per user and visible project.
+    visible = models.Visibility.objects.filter(cond).values("project_id")
+
     # Generate the query.
     if include_deleted:
-        query = Project.objects.get_all().filter(cond).distinct()
+        query = Project.objects.get_all(id__in=visible)
     else:
-        query = Project.objects.filter(cond).distinct()
+        query = Project.objects.filter(id__in=visible)
 
     return query
 
@@ -230,8 +238,9 @@ def create_project(user, name, uid=None, summary='', text='', stream=None,
         current = project.first()
         text = text or current.text
         name = name or current.name
-        project.update(text=text, name=name)
+        project.update(text=text, name=name, lastedit_date=now())
         project = project.first()
+        fulltext.update_entry(project)
         logger.info(f"Updated project: {project.name} uid: {project.uid}")
     else:
         # Create a new project.
@@ -261,8 +270,10 @@ def create_analysis(project, json_text, template, uid=None, user=None, summary='
         name = name or current.name
         template = template or current.template
         json_text = json_text or current.json_text
-        analysis.update(text=text, name=name, template=template, json_text=json_text)
+        analysis.update(text=text, name=name, template=template, json_text=json_text, lastedit_date=now())
         analysis = analysis.first()
+        fulltext.update_entry(analysis)
+        codesearch.update_entry(analysis)
         logger.info(f"Updated analysis: uid={analysis.uid} name={analysis.name}")
     else:
         # Create a new analysis
@@ -286,6 +297,18 @@ def create_analysis(project, json_text, template, uid=None, user=None, summary='
     return analysis
 
 
+def spool_job(job):
+    """
+    Spools a job right away if UWSGI exists, the job runner picks up queued jobs otherwise.
+    """
+    if tasks.HAS_UWSGI:
+        # Update the job state.
+        models.set_job_state(Job.objects.get_all(id=job.id), Job.SPOOLED)
+
+        # Spool via UWSGI.
+        tasks.execute_job.spool(job_id=job.id)
+
+
 def make_job_title(recipe, data):
     """
     Creates informative job title that shows job parameters.
@@ -354,7 +377,77 @@ def delete_object(obj, request):
     return obj.deleted
 
 
-def has_write_access(user, project):
+def load_access_map(user, session=None):
+    """
+    Loads the access levels of a user, reusing a recent copy kept in the session.
+    """
+    timeout = settings.ACCESS_CACHE_SECONDS if session is not None else 0
+    version = models.access_version(user.id)
+
+    if timeout:
+        stored = session.get(ACCESS_SESSION_KEY) or {}
+        fresh = stored.get("stamp", 0) + timeout > time.time()
+        if fresh and stored.get("user") == user.id and stored.get("version") == version:
+            return {int(key): value for key, value in stored["map"].items()}
+
+    access_map = dict(Access.objects.filter(user=user).values_list("project_id", "access"))
+
+    if timeout:
+        # Sessions are stored as JSON, the keys must be strings.
+        session[ACCESS_SESSION_KEY] = dict(user=user.id, version=version, stamp=time.time(),
+                                           map={str(key): value for key, value in access_map.items()})
+
+    return access_map
+
+
+def get_access_map(user, request=None):
+    """
+    Returns a dictionary of project ids to the access levels of a user.
+    The map is loaded once per request.
+    """
+    if user.is_anonymous:
+        return {}
+
+    cached = getattr(request, ACCESS_ATTR, None)
+    if cached and cached[0] == user.id:
+        return cached[1]
+
+    access_map = load_access_map(user=user, session=getattr(request, "session", None))
+
+    if request is not None:
+        setattr(request, ACCESS_ATTR, (user.id, access_map))
+
+    return access_map
+
+
+def get_access_level(user, project, request=None):
+    """
+    Returns the access level of a user to a project.
+    """
+    return get_access_map(user=user, request=request).get(project.id, Access.NO_ACCESS)
+
+
+def has_read_access(user, project, request=None):
+    """
+    Returns True if a user may read a project.
+    """
+    # Anyone may read public projects.
+    if project.is_public:
+        return True
+
+    if user.is_anonymous:
+        return False
+
+    # Project owners may read their project.
+    if project.owner_id == user.id:
+        return True
+
+    access = get_access_level(user=user, project=project, request=request)
+
+    return access in (Access.READ_ACCESS, Access.WRITE_ACCESS)
+
+
+def has_write_access(user, project, request=None):
     """
     Returns True if a user has write access to an instance
     """
@@ -364,16 +457,13 @@ def has_write_access(user, project):
         return False
 
     # Users that may access a project.
-    cond1 = (user == project.owner) or user.is_staff
+    if project.owner_id == user.id or user.is_staff:
+        return True
 
     # User has been given write access to the project
-    cond2 = models.Access.objects.filter(user=user, project=project,
-                                         access=models.Access.WRITE_ACCESS).first()
+    access = get_access_level(user=user, project=project, request=request)
 
-    # One of the conditions has to be true.
-    access = cond1 or cond2
-
-    return access
+    return access == Access.WRITE_ACCESS
 
 
 def guess_mimetype(fname):
@@ -516,4 +606,18 @@ def create_data(project, user=None, stream=None, path='', name='',
     # Set log for data creation.
     logger.info(f"Added data type={data.type} name={data.name} pk={data.pk}")
 
+    # Compute the file statistics.
+    update_stats(data=data)
+
     return data
+
+
+def update_stats(data):
+    """
+    Computes the data statistics in the spooler if possible.
+    Without a spooler only small data is processed in the request.
+    """
+    if tasks.HAS_UWSGI:
+        tasks.async_data_stats.spool(data_id=data.id)
+    elif data.size <= settings.STATS_SYNC_MAX_MB * 1024 * 1024:
+        tasks.data_stats(data_id=data.id)
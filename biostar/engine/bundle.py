@@ -0,0 +1,193 @@
+"""
+Recipe archives.
+
+The recipes of a project are transferred as a single gzipped tar archive
+with one directory per recipe, the same layout that api_import writes and
+api_export reads:
+
+    <project uid>/<recipe uid>/json.hjson
+    <project uid>/<recipe uid>/template.sh
+    <project uid>/<recipe uid>/image.png
+
+Archives are written while they are sent, one recipe at a time.
+"""
+import logging
+import os
+import re
+import tarfile
+import time
+from io import BytesIO
+
+import hjson
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from django.core.files.base import ContentFile
+from django.db import transaction
+
+from biostar.engine import auth
+from biostar.engine.models import Analysis
+
+logger = logging.getLogger("engine")
+
+JSON_NAME, TEMPLATE_NAME, IMAGE_NAME = "json.hjson", "template.sh", "image"
+
+# Attempts to resend an idempotent request over a dropped connection.
+RETRIES = 3
+
+# The uids that archives may contain, the same as in the urls.
+UID_PATTERN = re.compile(r"[-\w]+")
+
+
+class Chunks(object):
+    """
+    A write only file that hands out what was written so far.
+    """
+
+    def __init__(self):
+        self.parts = []
+
+    def write(self, data):
+        self.parts.append(data)
+        return len(data)
+
+    def drain(self):
+        data = b"".join(self.parts)
+        self.parts = []
+        return data
+
+
+def is_uid(text):
+    return UID_PATTERN.fullmatch(text) is not None
+
+
+def is_recipe_file(name):
+    return name in (JSON_NAME, TEMPLATE_NAME) or os.path.splitext(name)[0] == IMAGE_NAME
+
+
+def recipe_files(recipe):
+    """
+    Returns the archived files of a recipe as a dictionary of contents.
+    """
+    files = {JSON_NAME: (recipe.json_text or "").encode("utf-8"),
+             TEMPLATE_NAME: (recipe.template or "").encode("utf-8")}
+
+    if recipe.image:
+        try:
+            with recipe.image.open("rb") as stream:
+                files[IMAGE_NAME + os.path.splitext(recipe.image.name)[1]] = stream.read()
+        except OSError as exc:
+            logger.error(f"Image of recipe {recipe.uid} not archived: {exc}")
+
+    return files
+
+
+def directory_files(path):
+    """
+    Returns the archived files in a recipe directory.
+    """
+    files = {}
+    for entry in os.scandir(path):
+        if entry.is_file() and is_recipe_file(entry.name):
+            with open(entry.path, "rb") as stream:
+                files[entry.name] = stream.read()
+    return files
+
+
+def stream_archive(project_uid, recipes):
+    """
+    Generates the chunks of an archive from (recipe uid, files) pairs.
+    """
+    buffer = Chunks()
+    with tarfile.open(fileobj=buffer, mode="w|gz") as tar:
+        for recipe_uid, files in recipes:
+            for name, content in sorted(files.items()):
+                info = tarfile.TarInfo(name=f"{project_uid}/{recipe_uid}/{name}")
+                info.size = len(content)
+                info.mtime = time.time()
+                tar.addfile(info, BytesIO(content))
+            yield buffer.drain()
+    yield buffer.drain()
+
+
+def read_archive(stream):
+    """
+    Returns the files of each recipe in an archive keyed by the recipe uid.
+    Only the known recipe files of members with valid uids are read.
+    """
+    recipes = {}
+    try:
+        with tarfile.open(fileobj=stream, mode="r|*") as tar:
+            for member in tar:
+                parts = member.name.strip("/").split("/")
+                if not member.isfile() or len(parts) != 3 or not is_recipe_file(parts[2]):
+                    continue
+                project_uid, recipe_uid, name = parts
+                if not (is_uid(project_uid) and is_uid(recipe_uid)):
+                    logger.error(f"Invalid uids in archive member {member.name}, skipped.")
+                    continue
+                recipes.setdefault(recipe_uid, {})[name] = tar.extractfile(member).read()
+    except tarfile.TarError as exc:
+        raise ValueError(f"Invalid recipe archive: {exc}")
+
+    return recipes
+
+
+def import_archive(project, stream, user=None):
+    """
+    Updates the recipes of a project from an archive, missing recipes are created.
+    Returns the uids of the created and of the updated recipes.
+    Recipes that belong to another project are not changed.
+    """
+    created, updated = [], []
+
+    with transaction.atomic():
+        for uid, files in read_archive(stream).items():
+
+            json_text = files.get(JSON_NAME)
+            template = files.get(TEMPLATE_NAME)
+            images = [name for name in files if name.startswith(IMAGE_NAME + ".")]
+
+            try:
+                json_text = hjson.dumps(hjson.loads(json_text.decode("utf-8"))) if json_text else None
+                template = template.decode("utf-8") if template is not None else None
+            except (ValueError, UnicodeDecodeError) as exc:
+                raise ValueError(f"Invalid files for recipe {uid}: {exc}")
+
+            recipe = Analysis.objects.get_all(uid=uid).first()
+
+            if recipe and recipe.project_id != project.id:
+                logger.error(f"Recipe {uid} belongs to another project, skipped.")
+                continue
+
+            if recipe:
+                recipe.json_text = recipe.json_text if json_text is None else json_text
+                recipe.template = recipe.template if template is None else template
+                recipe.save()
+                updated.append(uid)
+            else:
+                json_text = json_text or "{}"
+                json_data = hjson.loads(json_text)
+                name = json_data.get("settings", {}).get("name", "") if isinstance(json_data, dict) else ""
+                recipe = auth.create_analysis(project=project, json_text=json_text, template=template or "",
+                                              uid=uid, name=name, user=user)
+                created.append(uid)
+
+            for name in images[:1]:
+                recipe.image.save(name, ContentFile(files[name]), save=True)
+
+    return created, updated
+
+
+def api_session():
+    """
+    A client session that reuses the connections to a server.
+    Pooled connections may have been closed by the server in the meantime,
+    idempotent requests are retried on a new connection.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(max_retries=Retry(total=RETRIES, backoff_factor=0.1))
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
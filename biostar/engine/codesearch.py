@@ -0,0 +1,233 @@
+"""
+Code search over recipe templates and JSON specifications.
+
+The template and the JSON text of each recipe are kept in a trigram index
+that is updated when the recipe is saved. SQLite databases use an FTS5
+virtual table with the trigram tokenizer, PostgreSQL databases a table with
+pg_trgm GIN indices. Substring queries are answered from the index alone.
+Regular expressions are narrowed down by the literal parts they require and
+the candidates are then matched against the expression.
+"""
+import logging
+import re
+import sre_constants
+import sre_parse
+
+from django.db import connection, transaction
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+logger = logging.getLogger("engine")
+
+TABLE = "engine_codesearch"
+
+# Trigram indices need at least this many characters.
+MIN_LITERAL = 3
+
+# The number of matching lines shown for each recipe.
+MAX_LINES = 5
+
+# The longest line shown in the results.
+MAX_LINE_LEN = 200
+
+
+def is_postgres(conn=None):
+    return (conn or connection).vendor == "postgresql"
+
+
+def create_index(conn=None):
+    """
+    Creates the index table.
+    """
+    conn = conn or connection
+    with conn.cursor() as cursor:
+        if is_postgres(conn):
+            cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+            cursor.execute(f"CREATE TABLE {TABLE} (id integer PRIMARY KEY, project_id integer NOT NULL, "
+                           f"template text NOT NULL, json_text text NOT NULL)")
+            for column in ("template", "json_text"):
+                cursor.execute(f"CREATE INDEX {TABLE}_{column} ON {TABLE} USING GIN ({column} gin_trgm_ops)")
+        else:
+            cursor.execute(f"CREATE VIRTUAL TABLE {TABLE} USING fts5(template, json_text, project_id UNINDEXED, "
+                           f"tokenize='trigram')")
+
+
+def drop_index(conn=None):
+    """
+    Removes the index table.
+    """
+    conn = conn or connection
+    with conn.cursor() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {TABLE}")
+
+
+def key_column(conn=None):
+    return "id" if is_postgres(conn) else "rowid"
+
+
+def update_entry(recipe):
+    """
+    Replaces the index entry of a recipe. Deleted recipes are removed.
+    """
+    key = key_column()
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {TABLE} WHERE {key} = %s", [recipe.id])
+        if recipe.deleted:
+            return
+        cursor.execute(f"INSERT INTO {TABLE} ({key}, project_id, template, json_text) VALUES (%s, %s, %s, %s)",
+                       [recipe.id, recipe.project_id, recipe.template or "", recipe.json_text or ""])
+
+
+def remove_entry(recipe):
+    """
+    Removes the index entry of a recipe.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {TABLE} WHERE {key_column()} = %s", [recipe.id])
+
+
+def rebuild(conn=None):
+    """
+    Rebuilds the index from the recipes in the database.
+    """
+    conn = conn or connection
+    with conn.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {TABLE}")
+        cursor.execute(f"INSERT INTO {TABLE} ({key_column(conn)}, project_id, template, json_text) "
+                       f"SELECT id, project_id, COALESCE(template, ''), COALESCE(json_text, '') "
+                       f"FROM engine_analysis WHERE deleted = %s", [False])
+
+
+def literals(pattern):
+    """
+    Returns the literal strings that every match of a regular expression contains.
+    Raises ValueError for invalid expressions.
+    """
+    try:
+        parsed = sre_parse.parse(pattern)
+    except (sre_constants.error, RecursionError) as exc:
+        raise ValueError(f"Invalid regular expression: {exc}")
+
+    found = []
+
+    def walk(items):
+        run = []
+        for op, arg in items:
+            if op == sre_constants.LITERAL:
+                run.append(chr(arg))
+                continue
+            found.append("".join(run))
+            run = []
+            # Groups are required when the group itself is.
+            if op == sre_constants.SUBPATTERN:
+                walk(arg[-1])
+        found.append("".join(run))
+
+    walk(parsed)
+
+    return [text for text in found if len(text) >= MIN_LITERAL]
+
+
+def check_regex(pattern):
+    """
+    Returns the literals of a regular expression that the index can use.
+    Raises ValueError for invalid expressions and for expressions that would
+    have to be matched against every recipe.
+    """
+    parts = literals(pattern)
+    if not parts:
+        raise ValueError(f"Regular expressions need a literal part of at least {MIN_LITERAL} characters.")
+    return parts
+
+
+def phrase(text):
+    # An FTS5 string, a quoted trigram sequence matches substrings.
+    return '"' + text.replace('"', '""') + '"'
+
+
+def like(text):
+    text = text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{text}%"
+
+
+def condition(text, regex):
+    """
+    Returns the SQL condition and the parameters that select the matching recipes.
+    """
+    if is_postgres():
+        if regex:
+            return "(template ~ %s OR json_text ~ %s)", [text, text]
+        return "(template ILIKE %s OR json_text ILIKE %s)", [like(text), like(text)]
+
+    if not regex:
+        return f"{TABLE} MATCH %s", [phrase(text)]
+
+    # The index narrows the candidates down to recipes with the required literals.
+    parts = check_regex(text)
+    cond = f"{TABLE} MATCH %s AND (template REGEXP %s OR json_text REGEXP %s)"
+    params = [" AND ".join(phrase(part) for part in parts), text, text]
+
+    return cond, params
+
+
+def query(text, projects, limit, regex=False):
+    """
+    Returns the ids of the recipes within a queryset of projects whose
+    template or JSON text contains a string or matches a regular expression.
+    The most recent recipes come first.
+    """
+    if regex:
+        # Invalid and unindexed expressions are rejected before reaching the database.
+        check_regex(text)
+    elif len(text) < MIN_LITERAL:
+        return []
+
+    cond, params = condition(text, regex=regex)
+    visible, visible_params = projects.order_by().values("id").query.sql_with_params()
+    key = key_column()
+
+    sql = (f"SELECT {key} FROM {TABLE} WHERE {cond} AND project_id IN ({visible}) "
+           f"ORDER BY {key} DESC LIMIT %s")
+
+    # Expressions the database does not accept only roll back this query.
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(sql, params + list(visible_params) + [limit])
+        return [row[0] for row in cursor.fetchall()]
+
+
+def matcher(text, regex=False):
+    """
+    Returns a function that finds the (start, end) spans of the matches in a line.
+    """
+    pattern = re.compile(text if regex else re.escape(text), flags=0 if regex else re.IGNORECASE)
+    return lambda line: [m.span() for m in pattern.finditer(line) if m.end() > m.start()]
+
+
+def mark(line, spans):
+    """
+    Escapes a line and highlights the spans.
+    """
+    parts, last = [], 0
+    for start, end in spans:
+        parts.append(escape(line[last:start]))
+        parts.append(f'<span class="match">{escape(line[start:end])}</span>')
+        last = end
+    parts.append(escape(line[last:]))
+    return mark_safe("".join(parts))
+
+
+def matching_lines(recipe, text, regex=False, size=MAX_LINES):
+    """
+    Returns the first (source, line number, highlighted line) tuples that match.
+    """
+    find = matcher(text, regex=regex)
+    lines = []
+    for source, content in (("template", recipe.template), ("json", recipe.json_text)):
+        for number, line in enumerate((content or "").splitlines(), start=1):
+            line = line[:MAX_LINE_LEN]
+            spans = find(line)
+            if spans:
+                lines.append((source, number, mark(line, spans)))
+                if len(lines) >= size:
+                    return lines
+    return lines
@@ -4,6 +4,7 @@ from django.contrib import messages
 from django.shortcuts import redirect
 from django.utils.decorators import available_attrs
 from django.conf import settings
+from rest_framework import status
 from rest_framework.response import Response
 
 from biostar.utils.shortcuts import reverse
@@ -44,8 +45,8 @@ class read_access:
             # Get project for the instance.
             project = instance.project
 
-            # Allow read access to public projects
-            if project.is_public:
+            # Public projects, owners and users with READ or WRITE access.
+            if auth.has_read_access(user=user, project=project, request=request):
                 return function(request, *args, **kwargs)
 
             # Anonymous users may not access non public projects.
@@ -53,14 +54,6 @@ class read_access:
                 messages.error(request, f"You must be logged in to access object id {uid}")
                 return redirect(self.fallback_url)
 
-            # Check the presence of READ or WRITE access
-            read_or_write = [models.Access.READ_ACCESS, models.Access.WRITE_ACCESS]
-            access = models.Access.objects.filter(user=user, project=project, access__in=read_or_write).first()
-
-            # Project owners may read their project.
-            if access or project.owner == user:
-                return function(request, *args, **kwargs)
-
             # Deny access by default.
             msg = auth.access_denied_message(user=user, needed_access=models.Access.READ_ACCESS)
             messages.error(request, msg)
@@ -106,7 +99,7 @@ class write_access:
             project = instance.project
 
             # Check write to an object.
-            access = auth.has_write_access(user=user, project=project)
+            access = auth.has_write_access(user=user, project=project, request=request)
 
             # Project owners may write their project.
             if access:
@@ -122,7 +115,7 @@ class write_access:
 def parse_api_key(request):
 
     empty = ""
-    if request.method == "PUT":
+    if request.method in ("PUT", "POST"):
         return request.data.get("k", empty)
     elif request.method == "GET":
         return request.GET.get("k", empty)
@@ -130,6 +123,23 @@ def parse_api_key(request):
     return empty
 
 
+def api_key_error(request, project):
+    """
+    Returns the reason an API request may not access a project, None when it may.
+    """
+    api_key = parse_api_key(request=request)
+
+    # All PUT and POST requests will require an API key.
+    if request.method in ("PUT", "POST") and settings.API_KEY != api_key:
+        return "API key is required for all PUT and POST requests."
+
+    # API key required when asking for GET requests of private recipes.
+    if request.method == "GET" and settings.API_KEY != api_key and project.is_private:
+        return "Private recipes can not be accessed without an API key param (?k=)."
+
+    return None
+
+
 def require_api_key(func):
     """
     Requires an API key for PUT requests.
@@ -139,8 +149,6 @@ def require_api_key(func):
     @wraps(func, assigned=available_attrs(func))
     def _api_view(request, *args, **kwargs):
 
-        api_key = parse_api_key(request=request)
-
         # Get the Recipe uid
         uid = kwargs.get("uid")
         recipe = models.Analysis.objects.get_all(uid=uid).first()
@@ -149,16 +157,51 @@ def require_api_key(func):
             msg = dict(error="Recipe does not exist.")
             return Response(data=msg)
 
-        # All PUT requests will require an API key.
-        if request.method == "PUT" and settings.API_KEY != api_key:
-            msg = dict(error="API key is required for all PUT requests.")
-            return Response(data=msg)
+        error = api_key_error(request=request, project=recipe.project)
+        if error:
+            return Response(data=dict(error=error))
+
+        return func(request, *args, **kwargs)
+
+    return _api_view
+
+
+def require_project_api_key(func):
+    """
+    Requires an API key for PUT requests and for private projects.
+    """
+
+    @wraps(func, assigned=available_attrs(func))
+    def _api_view(request, *args, **kwargs):
+
+        uid = kwargs.get("uid")
+        project = models.Project.objects.get_all(uid=uid).first()
 
-        # API key required when asking for GET requests of private recipes.
-        elif request.method == "GET" and settings.API_KEY != api_key and recipe.project.is_private:
-            msg = dict(error="Private recipes can not be accessed without an API key param (?k=).")
+        if not project:
+            msg = dict(error="Project does not exist.")
             return Response(data=msg)
 
+        error = api_key_error(request=request, project=project)
+        if error:
+            return Response(data=dict(error=error))
+
+        return func(request, *args, **kwargs)
+
+    return _api_view
+
+
+def require_api_key_always(func):
+    """
+    Requires an API key for every request.
+    """
+
+    @wraps(func, assigned=available_attrs(func))
+    def _api_view(request, *args, **kwargs):
+
+        if settings.API_KEY != parse_api_key(request=request):
+            msg = dict(error="API key is required (k=).")
+            return Response(data=msg, status=status.HTTP_403_FORBIDDEN)
+
         return func(request, *args, **kwargs)
 
     return _api_view
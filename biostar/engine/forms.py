@@ -6,7 +6,6 @@ import re
 
 from django import forms
 from django.template import Template, Context
-from django.db.models import Sum
 from django.utils.safestring import mark_safe
 from django.utils.timezone import now
 from django.contrib import messages
@@ -48,11 +47,8 @@ def check_upload_limit(file, user):
     Checks if the file pushes user over their upload limit."
     """
 
-    # Existing data.
-    data = Data.objects.filter(owner=user, method=Data.UPLOAD)
-
     # The current cumulative size of the current data.
-    current_size = data.aggregate(Sum("size"))["size__sum"] or 0
+    current_size = user.profile.storage_used()
 
     # The projected size in MB.
     projected_size = file.size + current_size
@@ -396,6 +392,9 @@ class ChangeUserAccess(forms.Form):
 
         if current:
             current.update(access=self.cleaned_data.get("access", current.first().access))
+            # Bulk updates do not send signals.
+            models.expire_access(user.id)
+            models.update_visibility(project_id=project.id, user_id=user.id)
             return user, current.first()
         new_access = Access(user=user, project=project,
                             access=self.cleaned_data.get("access", Access.NO_ACCESS))
@@ -431,7 +430,7 @@ class RecipeInterface(forms.Form):
     # The name of results when running the recipe.
     # name = forms.CharField(max_length=256, label="Name", help_text="This is how you can identify the run.")
 
-    def __init__(self, request, analysis, json_data, *args, **kwargs):
+    def __init__(self, request, analysis, json_data, user=None, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
         # The json data determines what fields does the form have.
@@ -441,9 +440,10 @@ class RecipeInterface(forms.Form):
         self.analysis = analysis
         self.project = analysis.project
 
-        # Get request specific information
+        # Get request specific information.
+        # An explicit user has been authenticated by the caller, for example with the API key.
         self.request = request
-        self.user = self.request.user
+        self.user = user or self.request.user
 
         # Create the dynamic field from each key in the data.
         for name, data in self.json_data.items():
@@ -453,7 +453,8 @@ class RecipeInterface(forms.Form):
             if field:
                 self.fields[name] = field
 
-        add_captcha_field(request=request, fields=self.fields)
+        if not user:
+            add_captcha_field(request=request, fields=self.fields)
 
     def clean(self):
 
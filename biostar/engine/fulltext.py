@@ -0,0 +1,253 @@
+"""
+Full text search index.
+
+Projects, data, recipes and results share one index table that is updated
+when an object is saved. SQLite databases use an FTS5 virtual table,
+PostgreSQL databases a table with a weighted tsvector column and a GIN index.
+
+The row id of an index entry is computed from the object id and its kind,
+so that entries are replaced and removed by primary key.
+"""
+import logging
+import re
+
+from django.db import connection
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+logger = logging.getLogger("engine")
+
+TABLE = "engine_search"
+
+# The index entry kinds, the position is part of the row id.
+KINDS = ("project", "data", "analysis", "job")
+
+# The source tables of each kind.
+SOURCES = dict(project="engine_project", data="engine_data", analysis="engine_analysis", job="engine_job")
+
+# Markers that delimit the matches in titles and snippets.
+MARK_START, MARK_END = "\x02", "\x03"
+
+# The number of words in a snippet.
+SNIPPET_WORDS = 24
+
+# Text search configuration of PostgreSQL.
+PG_CONFIG = "english"
+
+
+def row_id(kind, obj_id):
+    return obj_id * len(KINDS) + KINDS.index(kind)
+
+
+def split_id(rowid):
+    """
+    Returns the kind and the object id of a row id.
+    """
+    obj_id, pos = divmod(rowid, len(KINDS))
+    return KINDS[pos], obj_id
+
+
+def clean(text):
+    # The markers may not appear in the indexed content.
+    return (text or "").replace(MARK_START, "").replace(MARK_END, "")
+
+
+def is_postgres(conn=None):
+    return (conn or connection).vendor == "postgresql"
+
+
+def create_index(conn=None):
+    """
+    Creates the index table.
+    """
+    conn = conn or connection
+    with conn.cursor() as cursor:
+        if is_postgres(conn):
+            cursor.execute(f"""
+                CREATE TABLE {TABLE} (
+                    id bigint PRIMARY KEY, project_id integer NOT NULL,
+                    name text NOT NULL, text text NOT NULL, owner text NOT NULL,
+                    document tsvector NOT NULL)""")
+            cursor.execute(f"CREATE INDEX {TABLE}_document ON {TABLE} USING GIN (document)")
+        else:
+            cursor.execute(f"CREATE VIRTUAL TABLE {TABLE} USING fts5(name, text, owner, project_id UNINDEXED, "
+                           f"tokenize='unicode61 remove_diacritics 2')")
+
+
+def drop_index(conn=None):
+    """
+    Removes the index table.
+    """
+    conn = conn or connection
+    with conn.cursor() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {TABLE}")
+
+
+def document_sql(name, text, owner):
+    """
+    The PostgreSQL expression of a weighted document.
+    """
+    return (f"setweight(to_tsvector('{PG_CONFIG}', {name}), 'A') || "
+            f"setweight(to_tsvector('{PG_CONFIG}', {text}), 'B') || "
+            f"setweight(to_tsvector('simple', {owner}), 'C')")
+
+
+def insert_sql():
+    if is_postgres():
+        return (f"INSERT INTO {TABLE} (id, project_id, name, text, owner, document) "
+                f"VALUES (%s, %s, %s, %s, %s, {document_sql('%s', '%s', '%s')})")
+    return f"INSERT INTO {TABLE} (rowid, project_id, name, text, owner) VALUES (%s, %s, %s, %s, %s)"
+
+
+def delete_sql():
+    key = "id" if is_postgres() else "rowid"
+    return f"DELETE FROM {TABLE} WHERE {key} = %s"
+
+
+def owner_text(user):
+    """
+    The searchable description of the owner of an object.
+    """
+    if not user:
+        return ""
+    profile = getattr(user, "profile", None)
+    name = profile.name if profile else ""
+    return f"{user.email} {name}"
+
+
+def update_entry(obj):
+    """
+    Replaces the index entry of a project, data, recipe or result.
+    Deleted objects are removed from the index.
+    """
+    kind = obj._meta.model_name
+    rowid = row_id(kind, obj.id)
+
+    with connection.cursor() as cursor:
+        cursor.execute(delete_sql(), [rowid])
+
+        if obj.deleted:
+            return
+
+        project_id = obj.id if kind == "project" else obj.project_id
+        name, text, owner = clean(obj.name), clean(obj.text), clean(owner_text(obj.owner))
+        params = [rowid, project_id, name, text, owner]
+        if is_postgres():
+            params += [name, text, owner]
+        cursor.execute(insert_sql(), params)
+
+
+def remove_entry(obj):
+    """
+    Removes the index entry of an object.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(delete_sql(), [row_id(obj._meta.model_name, obj.id)])
+
+
+def clean_sql(column):
+    """
+    The SQL expression of a column without the markers.
+    """
+    return f"REPLACE(REPLACE(COALESCE({column}, ''), %s, ''), %s, '')"
+
+
+def fill_sql(kind, postgres=False):
+    """
+    Selects the index entries of all live objects of a kind.
+    PostgreSQL entries also carry their document.
+    """
+    table = SOURCES[kind]
+    project = "obj.id" if kind == "project" else "obj.project_id"
+    owner = "COALESCE(u.email, '') || ' ' || COALESCE(p.name, '')"
+    sql = (f"SELECT obj.id * {len(KINDS)} + {KINDS.index(kind)} AS id, {project} AS project_id, "
+           f"{clean_sql('obj.name')} AS name, {clean_sql('obj.text')} AS text, {clean_sql(owner)} AS owner "
+           f"FROM {table} obj "
+           f"LEFT JOIN auth_user u ON u.id = obj.owner_id "
+           f"LEFT JOIN accounts_profile p ON p.user_id = u.id "
+           f"WHERE obj.deleted = %s")
+    if postgres:
+        sql = (f"SELECT id, project_id, name, text, owner, {document_sql('name', 'text', 'owner')} "
+               f"FROM ({sql}) entries")
+    return sql
+
+
+def fill_params():
+    return [MARK_START, MARK_END] * 3 + [False]
+
+
+def rebuild(conn=None):
+    """
+    Rebuilds the index from the content of the database.
+    """
+    conn = conn or connection
+    postgres = is_postgres(conn)
+    columns = "id, project_id, name, text, owner, document" if postgres else "rowid, project_id, name, text, owner"
+
+    with conn.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {TABLE}")
+        for kind in KINDS:
+            cursor.execute(f"INSERT INTO {TABLE} ({columns}) {fill_sql(kind, postgres=postgres)}", fill_params())
+
+
+def terms(query):
+    """
+    Returns the words of a query.
+    """
+    return re.findall(r"\w+", query, flags=re.UNICODE)
+
+
+def match_sql(words):
+    """
+    Returns the match condition and the parameters for a list of words.
+    Every word has to be present, the last word may be incomplete.
+    """
+    if is_postgres():
+        expr = " & ".join(f"{word}:*" if i == len(words) - 1 else word for i, word in enumerate(words))
+        return f"document @@ to_tsquery('{PG_CONFIG}', %s)", [expr]
+
+    expr = " ".join(f'"{word}"*' if i == len(words) - 1 else f'"{word}"' for i, word in enumerate(words))
+    return f"{TABLE} MATCH %s", [expr]
+
+
+def query(words, projects, limit):
+    """
+    Returns the best matching (kind, id, title, snippet) tuples
+    within a queryset of projects, in the order of relevance.
+    """
+    if not words:
+        return []
+
+    cond, params = match_sql(words)
+    visible, visible_params = projects.order_by().values("id").query.sql_with_params()
+
+    if is_postgres():
+        options = f"StartSel={MARK_START}, StopSel={MARK_END}"
+        tsquery = f"to_tsquery('{PG_CONFIG}', %s)"
+        sql = (f"SELECT id, ts_headline('{PG_CONFIG}', name, {tsquery}, %s), "
+               f"ts_headline('{PG_CONFIG}', text, {tsquery}, %s) "
+               f"FROM {TABLE} WHERE {cond} AND project_id IN ({visible}) "
+               f"ORDER BY ts_rank(document, {tsquery}) DESC, id LIMIT %s")
+        args = [params[0], options + ", HighlightAll=true", params[0], f"{options}, MaxWords={SNIPPET_WORDS}"]
+        args += params + list(visible_params) + [params[0], limit]
+    else:
+        sql = (f"SELECT rowid, highlight({TABLE}, 0, %s, %s), snippet({TABLE}, 1, %s, %s, '...', %s) "
+               f"FROM {TABLE} WHERE {cond} AND project_id IN ({visible}) "
+               f"ORDER BY bm25({TABLE}, 10.0, 1.0, 2.0) LIMIT %s")
+        args = [MARK_START, MARK_END, MARK_START, MARK_END, SNIPPET_WORDS]
+        args += params + list(visible_params) + [limit]
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, args)
+        rows = cursor.fetchall()
+
+    return [split_id(rowid) + (marked(title), marked(snippet)) for rowid, title, snippet in rows]
+
+
+def marked(text):
+    """
+    Escapes the text and turns the markers into highlighted spans.
+    """
+    text = escape(text or "")
+    text = text.replace(MARK_START, '<span class="match">').replace(MARK_END, "</span>")
+    return mark_safe(text)
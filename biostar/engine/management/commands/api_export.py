@@ -1,13 +1,18 @@
 import os
-import requests
+import logging
+from io import BytesIO
+from itertools import groupby
 from urllib.parse import urljoin
 from functools import partial
 
 from django.conf import settings
 from django.core.management.base import BaseCommand
 
+from biostar.engine import bundle
 from biostar.utils.shortcuts import reverse
 
+logger = logging.getLogger('engine')
+
 
 def get_base_url():
     return f"{settings.PROTOCOL}://{settings.SITE_DOMAIN}{settings.HTTP_PORT}"
@@ -28,27 +33,51 @@ def get_recipe_dirs(base_dir):
     return (inner for outter in recipe_dirs for inner in outter)
 
 
-def export_recipes(recipe_dirs, base_url, api_key=""):
+def export_recipes(recipe_dirs, base_url, session, api_key=""):
+    """
+    Export json and template data from list of recipe_dirs to base_url,
+    with one archive for the recipes of each project.
+    """
+    # The parent of each recipe directory is named after the project uid.
+    project_of = lambda path: os.path.basename(os.path.dirname(path))
+    recipe_dirs = sorted(map(os.path.abspath, recipe_dirs), key=project_of)
+
+    for project_uid, paths in groupby(recipe_dirs, key=project_of):
+        recipes = ((os.path.basename(path), bundle.directory_files(path)) for path in paths)
+        archive = BytesIO(b"".join(bundle.stream_archive(project_uid, recipes)))
+
+        # Build full api url given the view
+        full_url = urljoin(base_url, reverse("project_api_recipes", kwargs=dict(uid=project_uid)))
+        # Send a PUT request with the api_key.
+        response = session.put(url=full_url, files=dict(file=archive), data=dict(k=api_key))
+        if response.ok:
+            logger.info(f"Exported project {project_uid}: {response.text}")
+        else:
+            logger.error(f"Error exporting project {project_uid}: {response.text}")
+
+    return
+
+
+def export_recipe(recipe_dir, base_url, session, api_key=""):
     """
-    Export json and template data from list of recipe_dirs to base_url.
+    Export the json and the template of a single existing recipe,
+    the recipe directory may be anywhere.
     """
+    recipe_uid = os.path.basename(os.path.abspath(recipe_dir))
 
-    def upload(uid, view, source_name):
+    for view, name in (("recipe_api_json", bundle.JSON_NAME), ("recipe_api_template", bundle.TEMPLATE_NAME)):
+        path = os.path.join(recipe_dir, name)
+        if not os.path.isfile(path):
+            continue
 
         # Build full api url given the view
-        full_url = urljoin(base_url, reverse(view, kwargs=dict(uid=uid)))
-        # Get the intended file to upload.
-        upload_file = dict(file=open(os.path.join(recipe, source_name), "r"))
-        # Prepare the payload with the api_key
-        payload = dict(k=api_key)
-        # Send a PUT request.
-        response = requests.put(url=full_url, files=upload_file, data=payload)
-        return response
-
-    for recipe in recipe_dirs:
-        recipe_uid = os.path.basename(recipe)
-        upload(uid=recipe_uid, view="recipe_api_json", source_name="json.hjson")
-        upload(uid=recipe_uid, view="recipe_api_template", source_name="template.sh")
+        full_url = urljoin(base_url, reverse(view, kwargs=dict(uid=recipe_uid)))
+        with open(path, "rb") as stream:
+            response = session.put(url=full_url, files=dict(file=stream), data=dict(k=api_key))
+        if response.ok:
+            logger.info(f"Exported {name} of recipe {recipe_uid}")
+        else:
+            logger.error(f"Error exporting {name} of recipe {recipe_uid}: {response.text}")
 
     return
 
@@ -82,22 +111,20 @@ class Command(BaseCommand):
         project_dir = options["project"]
         recipe_dir = options["recipe"]
 
-        upload_recipes = partial(export_recipes, base_url=base_url, api_key=api_key)
-
-        # Upload recipes found in multiple projects
-        if base_dir:
-            recipe_dirs = get_recipe_dirs(base_dir=base_dir)
-            upload_recipes(recipe_dirs=recipe_dirs)
-
-        # Upload recipes found in a single project
-        if project_dir:
-            recipe_dirs = [r.path for r in os.scandir(project_dir)]
-            upload_recipes(recipe_dirs=recipe_dirs)
-
-        # Upload a single recipe
-        if recipe_dir:
-            upload_recipes(recipe_dirs=[os.path.abspath(recipe_dir)])
-
+        # The session reuses the connections to the server.
+        with bundle.api_session() as session:
+            upload_recipes = partial(export_recipes, base_url=base_url, session=session, api_key=api_key)
 
+            # Upload recipes found in multiple projects
+            if base_dir:
+                recipe_dirs = get_recipe_dirs(base_dir=base_dir)
+                upload_recipes(recipe_dirs=recipe_dirs)
 
+            # Upload recipes found in a single project
+            if project_dir:
+                recipe_dirs = [r.path for r in os.scandir(project_dir)]
+                upload_recipes(recipe_dirs=recipe_dirs)
 
+            # Upload a single recipe, its directory is not named after the project.
+            if recipe_dir:
+                export_recipe(recipe_dir=recipe_dir, base_url=base_url, session=session, api_key=api_key)
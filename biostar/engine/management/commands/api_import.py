@@ -1,41 +1,41 @@
-
-import hjson
-from functools import partial
+import os
 from urllib.parse import urljoin
-from urllib.request import urlopen
+
 from django.core.management.base import BaseCommand
 from django.conf import settings
 
+from biostar.engine import bundle
 from biostar.utils.shortcuts import reverse
-import os
 
 
 def get_base_url():
     return f"{settings.PROTOCOL}://{settings.SITE_DOMAIN}{settings.HTTP_PORT}"
 
 
-def import_recipes(project_uid, recipe_dict, base_url, base_dir, api_key=""):
+def import_recipes(session, project_uid, base_url, base_dir, api_key=""):
     """
-    Downloads json and template from API and puts them in project folder.
+    Downloads the recipe archive of a project and puts the recipes in the project folder.
     """
+    if not bundle.is_uid(project_uid):
+        return
+
+    url = urljoin(base_url, reverse("project_api_recipes", kwargs=dict(uid=project_uid)))
 
-    def download(url, uid, outfile="recipe", is_json=False):
+    with session.get(url, params=dict(k=api_key), stream=True) as response:
+        response.raise_for_status()
+        response.raw.decode_content = True
+        recipes = bundle.read_archive(response.raw)
 
+    for recipe_uid, files in recipes.items():
+        # The uids become directory names.
+        if not bundle.is_uid(recipe_uid):
+            continue
         # Make the recipe directory
-        dir = os.path.join(base_dir, project_uid, uid)
+        dir = os.path.join(base_dir, project_uid, recipe_uid)
         os.makedirs(dir, exist_ok=True)
-        # Get full url and read content
-        fullurl = urljoin(base_url, url) + f"?k={api_key}"
-        data = urlopen(url=fullurl).read().decode()
-        # Format data and dump content into file
-        data = hjson.dumps(hjson.loads(data)) if is_json else data
-        outfile = os.path.join(dir, outfile)
-        open(outfile, "w").write(data)
-
-    for recipe_uid in recipe_dict:
-        create_file = partial(download, uid=recipe_uid)
-        create_file(outfile="json.hjson", url=recipe_dict[recipe_uid]["json"], is_json=True)
-        create_file(outfile="template.sh", url=recipe_dict[recipe_uid]["template"])
+        for name, content in files.items():
+            with open(os.path.join(dir, name), "wb") as stream:
+                stream.write(content)
 
     return
 
@@ -62,19 +62,18 @@ class Command(BaseCommand):
         # Join the base url with a given api_view and key.
         api_url = urljoin(base_url, api_view) + f"?k={api_key}"
 
-        # Get the json data
-        project_json = urlopen(url=api_url).read().decode()
-        json_data = hjson.loads(project_json)
-
-        create_files = partial(import_recipes, base_url=base_url, base_dir=base_dir, api_key=api_key)
-
-        # Each key('pid') in json data is a project uid.
-        for pid in json_data:
-            create_files(project_uid=pid, recipe_dict=json_data[pid]["recipes"])
-
-
-
-
+        # The session reuses the connections to the server.
+        with bundle.api_session() as session:
 
+            # The list is paginated, each page links to the next one.
+            while api_url:
+                response = session.get(api_url)
+                response.raise_for_status()
+                json_data = response.json()
 
+                # Each key('pid') in the results is a project uid.
+                for pid in json_data["results"]:
+                    import_recipes(session=session, project_uid=pid, base_url=base_url, base_dir=base_dir,
+                                   api_key=api_key)
 
+                api_url = json_data.get("next")
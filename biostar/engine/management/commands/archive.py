@@ -0,0 +1,29 @@
+import logging
+
+from django.core.management.base import BaseCommand
+
+from biostar.engine import archive
+
+logger = logging.getLogger('engine')
+
+
+class Command(BaseCommand):
+    help = 'Moves old job directories into cold storage and applies the retention policy'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None,
+                            help="Archive completed jobs older than this many days (default: JOB_ARCHIVE_DAYS)")
+        parser.add_argument('--purge_days', type=int, default=None,
+                            help="Remove the outputs of jobs older than this many days (default: JOB_PURGE_DAYS)")
+        parser.add_argument('--dry', action='store_true', default=False,
+                            help="Only report the jobs that would be changed")
+
+    def handle(self, *args, **options):
+        days = options['days']
+        purge_days = options['purge_days']
+        dry = options['dry']
+
+        archived, purged = archive.apply_policy(archive_days=days, purge_days=purge_days, dry=dry)
+
+        logger.info(f"Jobs archived: {archived}")
+        logger.info(f"Jobs purged: {purged}")
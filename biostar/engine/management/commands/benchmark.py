@@ -0,0 +1,252 @@
+import logging
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+from io import BytesIO
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, connections
+from django.test import Client
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import reverse
+
+from biostar import settings as biostar_settings
+from biostar.engine import auth
+from biostar.engine.models import Project, Data, Job
+from biostar.forum import auth as forum_auth
+from biostar.forum.models import Post
+from biostar.utils.queries import record_queries
+
+logger = logging.getLogger('engine')
+
+# The words used to fill names and texts.
+WORDS = ("sample reads genome alignment variant coverage quality assembly "
+         "barcode expression transcript mapping contig primer adapter").split()
+
+# The storage locations that are moved to a temporary directory.
+STORAGE = ("MEDIA_ROOT", "TOC_ROOT", "JOB_ARCHIVE_ROOT")
+
+
+def sentence(rand, size=6):
+    return " ".join(rand.choice(WORDS) for _ in range(size)).capitalize()
+
+
+def make_users(rand, count):
+    users = []
+    for step in range(count):
+        user = User.objects.create(username=f"bench{step}", email=f"bench{step}@example.org")
+        users.append(user)
+    return users
+
+
+def make_project(rand, owner, data, recipes, jobs):
+    """
+    Creates a public project with data, recipes and results.
+    """
+    project = auth.create_project(user=owner, name=sentence(rand, 3), text=sentence(rand, 30),
+                                  privacy=Project.PUBLIC)
+
+    for step in range(data):
+        stream = BytesIO(sentence(rand, 100).encode())
+        stream.name = f"data-{step}.txt"
+        auth.create_data(project=project, user=owner, stream=stream, text=sentence(rand, 20))
+
+    analyses = [auth.create_analysis(project=project, json_text='{}', template="echo {{runtime.work_dir}}",
+                                     name=sentence(rand, 3), text=sentence(rand, 20))
+                for _ in range(recipes)]
+
+    for _ in range(jobs if analyses else 0):
+        state = rand.choice((Job.COMPLETED, Job.ERROR, Job.QUEUED))
+        auth.create_job(analysis=rand.choice(analyses), state=state)
+
+    return project
+
+
+def make_posts(rand, users, count):
+    """
+    Creates questions and answers them.
+    """
+    questions = []
+    for step in range(count):
+        author = rand.choice(users)
+        if questions and step % 3:
+            root = rand.choice(questions)
+            forum_auth.create_post(title=root.title, author=author, content=sentence(rand, 40),
+                                   post_type=Post.ANSWER, parent=root, root=root)
+        else:
+            question = forum_auth.create_post(title=sentence(rand, 5), author=author, content=sentence(rand, 60),
+                                              post_type=Post.QUESTION, tag_val=rand.choice(WORDS))
+            questions.append(question)
+
+
+def seed(users=10, projects=10, data=10, recipes=5, jobs=10, posts=100, seed=0):
+    """
+    Fills the database with synthetic content.
+    """
+    rand = random.Random(seed)
+    people = make_users(rand, max(users, 1))
+    for _ in range(projects):
+        make_project(rand, owner=rand.choice(people), data=data, recipes=recipes, jobs=jobs)
+    make_posts(rand, people, posts)
+    return people
+
+
+def targets():
+    """
+    Returns the values and the url builder of each benchmarked view.
+    """
+    project_uids = list(Project.objects.get_all().values_list("uid", flat=True))
+    data_uids = list(Data.objects.get_all().values_list("uid", flat=True))
+    job_uids = list(Job.objects.get_all().values_list("uid", flat=True))
+    post_uids = list(Post.objects.filter(type=Post.QUESTION).values_list("uid", flat=True))
+
+    views = dict(
+        project_view=(project_uids, lambda uid: reverse("project_view", kwargs=dict(uid=uid))),
+        data_view=(data_uids, lambda uid: reverse("data_view", kwargs=dict(uid=uid))),
+        job_view=(job_uids, lambda uid: reverse("job_view", kwargs=dict(uid=uid))),
+        search_bar=(WORDS, lambda word: reverse("search") + f"?q={word}"),
+        post_view=(post_uids, lambda uid: reverse("post_view", kwargs=dict(uid=uid))),
+        list_view=([None], lambda value: reverse("post_list")),
+    )
+
+    # Views without content are skipped.
+    return {name: value for name, value in views.items() if value[0]}
+
+
+def percentile(values, percent):
+    """
+    The nearest rank percentile of a list of values.
+    """
+    values = sorted(values)
+    index = max(0, int(round(percent / 100 * len(values))) - 1)
+    return values[min(index, len(values) - 1)]
+
+
+def run(users, views, requests=20, threads=4, seed=0):
+    """
+    Visits the views with logged in clients and
+    returns the (elapsed time, query count, status code) of each request by view.
+    """
+    results = {name: [] for name in views}
+    lock = threading.Lock()
+
+    def worker(number):
+        rand = random.Random(seed + number)
+        client = Client()
+        client.force_login(rand.choice(users))
+        try:
+            for name, (values, make_url) in views.items():
+                for _ in range(requests):
+                    url = make_url(rand.choice(values))
+                    start = time.perf_counter()
+                    with record_queries() as recorder:
+                        response = client.get(url)
+                    elapsed = time.perf_counter() - start
+                    with lock:
+                        results[name].append((elapsed, recorder.count, response.status_code))
+        finally:
+            if threads > 1:
+                connections.close_all()
+
+    # A single client shares the connection of the caller.
+    if threads == 1:
+        worker(0)
+        return results
+
+    pool = [threading.Thread(target=worker, args=(number,)) for number in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+
+    return results
+
+
+def summarize(results):
+    """
+    Returns a row of statistics for each view.
+    """
+    rows = []
+    for name, values in results.items():
+        if not values:
+            continue
+        times = [elapsed * 1000 for elapsed, count, code in values]
+        counts = [count for elapsed, count, code in values]
+        errors = sum(1 for elapsed, count, code in values if code != 200)
+        rows.append(dict(view=name, requests=len(values), errors=errors,
+                         mean=statistics.mean(times), p50=percentile(times, 50),
+                         p90=percentile(times, 90), p99=percentile(times, 99), max=max(times),
+                         queries=statistics.mean(counts), max_queries=max(counts)))
+    return rows
+
+
+class Command(BaseCommand):
+    help = 'Measures the latency and the queries of the main views on synthetic content'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=20, help="The number of users")
+        parser.add_argument('--projects', type=int, default=20, help="The number of projects")
+        parser.add_argument('--data', type=int, default=20, help="The number of data per project")
+        parser.add_argument('--recipes', type=int, default=5, help="The number of recipes per project")
+        parser.add_argument('--jobs', type=int, default=20, help="The number of results per project")
+        parser.add_argument('--posts', type=int, default=200, help="The number of forum posts")
+        parser.add_argument('--requests', type=int, default=20, help="The number of requests per view and thread")
+        parser.add_argument('--threads', type=int, default=4, help="The number of concurrent clients")
+        parser.add_argument('--views', nargs='+', default=[], help="Only benchmark these views")
+        parser.add_argument('--seed', type=int, default=0, help="The random seed")
+
+    def handle(self, *args, **options):
+
+        # The content goes into a temporary database and storage.
+        root = tempfile.mkdtemp()
+        paths = {name: os.path.join(root, name.lower()) for name in STORAGE}
+        for name, path in paths.items():
+            os.makedirs(path)
+            setattr(settings, name, path)
+            setattr(biostar_settings, name, path)
+
+        if connection.vendor == "sqlite":
+            # Concurrent clients need a database file.
+            connection.settings_dict.setdefault("TEST", {})["NAME"] = os.path.join(root, "benchmark.sqlite3")
+
+        setup_test_environment(debug=False)
+        old_name = connection.settings_dict["NAME"]
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+
+        try:
+            self.benchmark(options)
+        finally:
+            connections.close_all()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+            shutil.rmtree(root, ignore_errors=True)
+
+    def benchmark(self, options):
+
+        start = time.time()
+        users = seed(users=options['users'], projects=options['projects'], data=options['data'],
+                     recipes=options['recipes'], jobs=options['jobs'], posts=options['posts'],
+                     seed=options['seed'])
+        logger.info(f"Seeded the database in {time.time() - start:.1f} seconds")
+
+        views = targets()
+        if options['views']:
+            views = {name: value for name, value in views.items() if name in options['views']}
+
+        results = run(users, views, requests=options['requests'], threads=options['threads'],
+                      seed=options['seed'])
+
+        header = f"{'view':<14}{'requests':>9}{'errors':>7}{'mean':>9}{'p50':>9}{'p90':>9}{'p99':>9}" \
+                 f"{'max':>9}{'queries':>9}{'max':>5}"
+        self.stdout.write(header)
+        for row in summarize(results):
+            self.stdout.write(f"{row['view']:<14}{row['requests']:>9}{row['errors']:>7}"
+                              f"{row['mean']:>9.1f}{row['p50']:>9.1f}{row['p90']:>9.1f}{row['p99']:>9.1f}"
+                              f"{row['max']:>9.1f}{row['queries']:>9.1f}{row['max_queries']:>5}")
+        self.stdout.write("Times are in milliseconds.")
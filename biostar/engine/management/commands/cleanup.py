@@ -1,55 +1,183 @@
-import logging, os, csv
+import logging
+import os
 import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
 
+from django.conf import settings
 from django.core.management.base import BaseCommand
-from biostar.engine.models import Data, Job
+from django.db import transaction
+
+from biostar.engine.models import Project, Data, Job
 
 logger = logging.getLogger('engine')
 
-__CURR_DIR = os.path.dirname(os.path.realpath(__file__))
+# Project directory entries that do not belong to data.
+PROJECT_RESERVED = {"images"}
+
+TOC_PREFIX, TOC_SUFFIX = "toc-", ".txt"
+
+
+def batched(values, size):
+    """
+    Splits a list into batches of a given size.
+    """
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def delete_rows(queryset, batch, dry=False):
+    """
+    Deletes the rows of a queryset in batches, each batch in one transaction.
+    Returns the number of rows.
+    """
+    ids = list(queryset.order_by().values_list("id", flat=True))
+
+    if dry:
+        return len(ids)
+
+    model = queryset.model
+    for chunk in batched(ids, size=batch):
+        with transaction.atomic():
+            model.objects.get_all(id__in=chunk).delete()
 
+    return len(ids)
 
-def delete(queryset):
 
-    for obj in queryset:
-        basedir = obj.get_data_dir()
-        files = os.listdir(basedir)
+def is_stale(path, grace):
+    """
+    True for paths not modified in the grace period. New objects may have
+    their directory created before the database row is committed.
+    """
+    try:
+        return os.lstat(path).st_mtime < time.time() - grace
+    except FileNotFoundError:
+        return False
 
-        files = list(map(os.path.join, [basedir] * len(files), files))
-        linked_files = list(filter(lambda p: os.path.islink(p), files))
 
-        # Delete the object
-        obj.delete()
+def scan(location):
+    """
+    Returns the entries in a directory, or nothing if it does not exist.
+    """
+    try:
+        return list(os.scandir(location))
+    except FileNotFoundError:
+        return []
 
-        # Leave linked files alone
-        if linked_files:
+
+def orphan_paths(grace):
+    """
+    Generates the files and directories on disk that have no live database row.
+    """
+    projects = set(Project.objects.get_all().values_list("uid", flat=True))
+    data = set(Data.objects.values_list("uid", flat=True))
+    jobs = set(Job.objects.filter(storage=Job.PRIMARY).values_list("uid", flat=True))
+    archives = set(Job.objects.filter(storage=Job.ARCHIVED).values_list("uid", flat=True))
+
+    candidates = []
+
+    for entry in scan(os.path.join(settings.MEDIA_ROOT, "projects")):
+        if entry.name not in projects:
+            candidates.append(entry.path)
             continue
+        for sub in scan(entry.path):
+            if sub.is_dir(follow_symlinks=False) and sub.name not in PROJECT_RESERVED and sub.name not in data:
+                candidates.append(sub.path)
+
+    for entry in scan(os.path.join(settings.MEDIA_ROOT, "jobs")):
+        if entry.name not in jobs:
+            candidates.append(entry.path)
+
+    for entry in scan(settings.JOB_ARCHIVE_ROOT):
+        uid, ext = os.path.splitext(entry.name)
+        if ext == ".zip" and uid not in archives:
+            candidates.append(entry.path)
+
+    for entry in scan(settings.TOC_ROOT):
+        name = entry.name
+        if name.startswith(TOC_PREFIX) and name.endswith(TOC_SUFFIX):
+            if name[len(TOC_PREFIX):-len(TOC_SUFFIX)] not in data:
+                candidates.append(entry.path)
+
+    return [path for path in candidates if is_stale(path, grace=grace)]
+
+
+def missing_rows():
+    """
+    Returns the live rows whose files are missing from the disk.
+    """
+    data = [obj for obj in Data.objects.filter(state=Data.READY) if not os.path.isdir(obj.get_data_dir())]
+
+    finished = Job.objects.filter(storage=Job.PRIMARY, state__in=(Job.COMPLETED, Job.ERROR))
+    jobs = [obj for obj in finished if not os.path.isdir(obj.get_data_dir())]
+
+    return data + jobs
+
+
+def remove(path):
+    """
+    Removes a file or a directory tree. Paths that are already gone are fine.
+    Symbolic links are removed, never followed.
+    """
+    try:
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+    except FileNotFoundError:
+        pass
+    except OSError as exc:
+        logger.error(f"Unable to remove {path}: {exc}")
+        return False
 
-        # Delete the root dir of the object
-        shutil.rmtree(basedir)
+    return True
 
-        print(basedir, "deleted")
+
+def remove_all(paths, workers):
+    """
+    Removes the paths concurrently with a bounded pool of threads.
+    Returns the number of paths removed.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return sum(pool.map(remove, paths))
 
 
 class Command(BaseCommand):
-    help = 'Adds access to a project'
+    help = 'Removes deleted objects and files on disk that have no database row'
 
     def add_arguments(self, parser):
-        pass
+        parser.add_argument('--dry', action='store_true', default=False,
+                            help="Only report what would be removed")
+        parser.add_argument('--batch', type=int, default=500,
+                            help="Number of rows deleted in one transaction")
+        parser.add_argument('--workers', type=int, default=8,
+                            help="Number of directories removed in parallel")
+        parser.add_argument('--grace', type=int, default=3600,
+                            help="Leave files modified in the last number of seconds alone")
 
     def handle(self, *args, **options):
+        dry = options['dry']
+        batch = max(options['batch'], 1)
+        workers = max(options['workers'], 1)
+        grace = options['grace']
+
+        # Deleting the rows turns their files into orphans.
+        jobs = delete_rows(Job.objects.get_deleted(), batch=batch, dry=dry)
+        data = delete_rows(Data.objects.get_deleted(), batch=batch, dry=dry)
 
-        data = Data.objects.get_deleted()
-        jobs = Job.objects.get_deleted()
+        logger.info(f"Deleted jobs: {jobs}")
+        logger.info(f"Deleted data: {data}")
 
-        job_paths = list(jobs.values_list('path', flat=True))
+        paths = orphan_paths(grace=grace)
 
-        # Delete jobs
-        jobs.delete()
+        for obj in missing_rows():
+            logger.info(f"Missing files for {obj.__class__.__name__} id={obj.id}: {obj.get_data_dir()}")
 
-        # Delete files associated with jobs
-        for job_path in job_paths:
-            shutil.rmtree(job_path)
+        if dry:
+            for path in paths:
+                logger.info(f"Would remove {path}")
+            logger.info(f"Orphan paths: {len(paths)}")
+            return
 
-        # Delete the data next
-        delete(data)
\ No newline at end of file
+        count = remove_all(paths, workers=workers)
+        logger.info(f"Removed orphan paths: {count}")
@@ -0,0 +1,38 @@
+import logging
+
+from django.core.management.base import BaseCommand
+
+from biostar.engine import tasks
+from biostar.engine.models import Data
+
+logger = logging.getLogger('engine')
+
+
+class Command(BaseCommand):
+    help = 'Computes file statistics for data'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--id', type=int, default=0, help="Select data by primary id")
+        parser.add_argument('--uid', default='', help="Select data by unique id")
+        parser.add_argument('--missing', action='store_true', default=False,
+                            help="Compute statistics for all data without statistics")
+
+    def handle(self, *args, **options):
+
+        id = options['id']
+        uid = options['uid']
+        missing = options['missing']
+
+        if not (id or uid or missing):
+            logger.error(f"Must specify 'id', 'uid' or 'missing' parameters.")
+            return
+
+        if missing:
+            query = Data.objects.filter(stats="")
+        elif id:
+            query = Data.objects.filter(id=id)
+        else:
+            query = Data.objects.filter(uid=uid)
+
+        for data_id in query.values_list("id", flat=True):
+            tasks.data_stats(data_id=data_id)
@@ -6,8 +6,8 @@ from django.core.management.base import BaseCommand
 from django.template import Template, Context
 from django.utils.encoding import force_text
 
-from biostar.engine.models import Job
-from biostar.engine import auth
+from biostar.engine.models import Job, set_job_state
+from biostar.engine import auth, util
 from django.utils import timezone
 from biostar.emailer.auth import notify
 
@@ -158,9 +158,9 @@ def run(job, options={}):
             raise Exception(f"Job security error: {job.get_security_display()}")
 
         # Switch the job state to RUNNING and save the script field.
-        Job.objects.filter(pk=job.pk).update(state=Job.RUNNING,
-                                             start_date=timezone.now(),
-                                             script=script)
+        set_job_state(Job.objects.filter(pk=job.pk), Job.RUNNING,
+                      start_date=timezone.now(),
+                      script=script)
         # Run the command.
         proc = subprocess.run(command, cwd=work_dir, shell=True,
                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
@@ -170,11 +170,11 @@ def run(job, options={}):
 
         # If we made it this far the job has finished.
         logger.info(f"uid={job.uid}, name={job.name}")
-        Job.objects.filter(pk=job.pk).update(state=Job.COMPLETED)
+        set_job_state(Job.objects.filter(pk=job.pk), Job.COMPLETED)
 
     except Exception as exc:
         # Handle all errors here.
-        Job.objects.filter(pk=job.pk).update(state=Job.ERROR)
+        set_job_state(Job.objects.filter(pk=job.pk), Job.ERROR)
         stderr_log.append(f'{exc}')
         logger.error(f'job id={job.pk} error {exc}')
 
@@ -199,6 +199,9 @@ def run(job, options={}):
     with open(stderr_fname, 'wt') as fp:
         fp.write(job.stderr_log)
 
+    # Track the storage used by the job outputs.
+    job.set_size(util.dirsize(work_dir))
+
     # Log job status.
     logger.info(f'Job id={job.id} finished, status={job.get_state_display()}')
 
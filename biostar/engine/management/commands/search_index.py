@@ -0,0 +1,18 @@
+import logging
+
+from django.core.management.base import BaseCommand
+
+from biostar.engine import fulltext, codesearch
+
+logger = logging.getLogger('engine')
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the full text and the code search indices from the database'
+
+    def handle(self, *args, **options):
+        fulltext.rebuild()
+        logger.info("Rebuilt the search index")
+
+        codesearch.rebuild()
+        logger.info("Rebuilt the code search index")
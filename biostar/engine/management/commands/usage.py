@@ -0,0 +1,102 @@
+import logging
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Sum, Count
+
+from biostar.accounts.models import Profile
+from biostar.engine import util
+from biostar.engine.models import Project, Data, Analysis, Job
+from biostar.forum.models import Post
+
+logger = logging.getLogger('engine')
+
+
+def totals(queryset, field, value=None):
+    """
+    Returns a dictionary with the cumulative size grouped by a field.
+    """
+    value = Sum("size") if value is None else value
+    query = queryset.order_by().values_list(field).annotate(total=value)
+    return dict(query)
+
+
+def reconcile(queryset, key, expected, dry=False):
+    """
+    Sets the counters of each object to the expected values.
+    Returns the number of objects that were out of date.
+    """
+    changed = 0
+    for obj in queryset:
+        values = {name: expected[name].get(getattr(obj, key), 0) or 0 for name in expected}
+        stale = {name: value for name, value in values.items() if getattr(obj, name) != value}
+        if stale:
+            changed += 1
+            logger.info(f"{obj}: {stale}")
+            if not dry:
+                type(obj).objects.filter(pk=obj.pk).update(**stale)
+    return changed
+
+
+def measure_jobs(queryset, dry=False):
+    """
+    Sets the size of each job to the size of its directory on disk.
+    """
+    for job in queryset:
+        path = os.path.join(settings.MEDIA_ROOT, "jobs", job.uid)
+        size = util.dirsize(path) if os.path.isdir(path) else 0
+        if size != job.size and not dry:
+            type(job).objects.filter(pk=job.pk).update(size=size)
+
+
+def usage_totals(data, jobs, key):
+    """
+    Returns the expected storage counters grouped by a key.
+    """
+    return dict(data_size=totals(data, key), job_size=totals(jobs, key))
+
+
+def count_totals(data, recipes, jobs, posts):
+    """
+    Returns the expected object counters of the projects.
+    """
+    return dict(
+        data_count=totals(data, "project_id", value=Count("id")),
+        recipe_count=totals(recipes, "project_id", value=Count("id")),
+        job_count=totals(jobs, "project_id", value=Count("id")),
+        discussion_count=totals(posts, "project_id", value=Count("id")),
+    )
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the storage usage and the object counters of projects and users'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scan', action='store_true', default=False,
+                            help="Measure the job output sizes on disk first")
+        parser.add_argument('--dry', action='store_true', default=False,
+                            help="Only report the counters that are out of date")
+
+    def handle(self, *args, **options):
+        scan = options['scan']
+        dry = options['dry']
+
+        if scan:
+            measure_jobs(Job.objects.get_all(), dry=dry)
+
+        # Open discussions in projects.
+        posts = Post.objects.get_discussions(type__in=Post.TOP_LEVEL).exclude(status=Post.DELETED)
+
+        # Deleted objects are excluded by the default managers.
+        projects = usage_totals(Data.objects.all(), Job.objects.all(), key="project_id")
+        projects.update(count_totals(Data.objects.all(), Analysis.objects.all(), Job.objects.all(), posts))
+
+        # Linked data does not count towards users.
+        users = usage_totals(Data.objects.exclude(method=Data.LINK), Job.objects.all(), key="owner_id")
+
+        count = reconcile(Project.objects.get_all(), key="id", expected=projects, dry=dry)
+        logger.info(f"Projects out of date: {count}")
+
+        count = reconcile(Profile.objects.all(), key="user_id", expected=users, dry=dry)
+        logger.info(f"Users out of date: {count}")
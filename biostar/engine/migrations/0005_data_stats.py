@@ -0,0 +1,18 @@
+# Generated by Django 2.0.13 on 2026-10-19 08:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('engine', '0004_lastedit'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='data',
+            name='stats',
+            field=models.TextField(blank=True, default=''),
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 2.0.13 on 2026-10-19 08:05
+
+from django.db import migrations, models
+from django.db.models import Sum
+
+# Value of Data.LINK, linked data does not count towards users.
+LINK = 1
+
+
+def totals(queryset, field):
+    """
+    Returns a dictionary with the cumulative size grouped by a field.
+    """
+    query = queryset.order_by().values_list(field).annotate(total=Sum("size"))
+    return dict(query)
+
+
+def fill_usage(apps, schema_editor):
+    """
+    Sets the data storage counters of the projects and users from the existing content.
+    Job sizes are measured on disk afterwards with: manage.py usage --scan
+    """
+    Project = apps.get_model('engine', 'Project')
+    Data = apps.get_model('engine', 'Data')
+    Profile = apps.get_model('accounts', 'Profile')
+
+    data = Data.objects.filter(deleted=False)
+
+    for pk, total in totals(data, "project_id").items():
+        Project.objects.filter(pk=pk).update(data_size=total or 0)
+
+    for pk, total in totals(data.exclude(method=LINK), "owner_id").items():
+        Profile.objects.filter(user_id=pk).update(data_size=total or 0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('engine', '0005_data_stats'),
+        ('accounts', '0002_usage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='size',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='project',
+            name='data_size',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='project',
+            name='job_size',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.RunPython(fill_usage, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.0.13 on 2026-10-19 08:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('engine', '0006_usage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='storage',
+            field=models.IntegerField(choices=[(1, 'Primary'), (2, 'Archived'), (3, 'Purged')], default=1),
+        ),
+    ]
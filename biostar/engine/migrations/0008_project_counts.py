@@ -0,0 +1,73 @@
+# Generated by Django 2.0.13 on 2026-10-19 08:13
+
+from django.db import migrations, models
+from django.db.models import Count
+
+# Values of Post.DELETED and of the Post.TOP_LEVEL types.
+DELETED = 3
+TOP_LEVEL = {0, 2, 3, 4, 5, 7, 8, 9, 10, 11}
+
+
+def counts(queryset):
+    """
+    Returns a dictionary with the number of objects in each project.
+    """
+    query = queryset.order_by().values_list("project_id").annotate(total=Count("id"))
+    return dict(query)
+
+
+def fill_counts(apps, schema_editor):
+    """
+    Sets the object counters of the projects from the existing content.
+    """
+    Project = apps.get_model('engine', 'Project')
+    Data = apps.get_model('engine', 'Data')
+    Analysis = apps.get_model('engine', 'Analysis')
+    Job = apps.get_model('engine', 'Job')
+    Post = apps.get_model('forum', 'Post')
+
+    # Open discussions in projects.
+    posts = Post.objects.filter(type__in=TOP_LEVEL).exclude(status=DELETED).exclude(project=None)
+
+    expected = dict(
+        data_count=counts(Data.objects.filter(deleted=False)),
+        recipe_count=counts(Analysis.objects.filter(deleted=False)),
+        job_count=counts(Job.objects.filter(deleted=False)),
+        discussion_count=counts(posts),
+    )
+
+    for name, values in expected.items():
+        for pk, total in values.items():
+            Project.objects.filter(pk=pk).update(**{name: total})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('engine', '0007_job_storage'),
+        ('forum', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='project',
+            name='data_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='project',
+            name='discussion_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='project',
+            name='job_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='project',
+            name='recipe_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(fill_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 2.0.13 on 2026-10-19 08:16
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+# Values of Project.PUBLIC and of Access.READ_ACCESS, Access.WRITE_ACCESS.
+PUBLIC, READ_ACCESS, WRITE_ACCESS = 1, 2, 3
+
+
+def fill_visibility(apps, schema_editor):
+    """
+    Builds the visibility rows from the projects and the access rights.
+    """
+    Project = apps.get_model('engine', 'Project')
+    Access = apps.get_model('engine', 'Access')
+    Visibility = apps.get_model('engine', 'Visibility')
+
+    rows = set(Access.objects.filter(access__in=(READ_ACCESS, WRITE_ACCESS)).values_list("user_id", "project_id"))
+    rows.update(Project.objects.values_list("owner_id", "id"))
+    rows.update((None, pid) for pid in Project.objects.filter(privacy=PUBLIC).values_list("id", flat=True))
+
+    objs = [Visibility(user_id=user_id, project_id=project_id) for user_id, project_id in rows]
+    Visibility.objects.bulk_create(objs, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('engine', '0008_project_counts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Visibility',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='engine.Project')),
+                ('user', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='visibility',
+            unique_together={('user', 'project')},
+        ),
+        migrations.RunPython(fill_visibility, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 2.0.13 on 2026-10-19 08:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('engine', '0009_visibility'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='analysis',
+            index=models.Index(fields=['project', 'sticky', 'date', 'id'], name='engine_anal_project_7fa74e_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='data',
+            index=models.Index(fields=['project', 'sticky', 'date', 'id'], name='engine_data_project_347b43_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='job',
+            index=models.Index(fields=['project', 'sticky', 'date', 'id'], name='engine_job_project_db97c4_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='project',
+            index=models.Index(fields=['sticky', 'date', 'id'], name='engine_proj_sticky_04731f_idx'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+from django.db import migrations
+
+from biostar.engine import fulltext
+
+
+def create_index(apps, schema_editor):
+    """
+    Creates the search index and fills it with the existing content.
+    """
+    fulltext.create_index(schema_editor.connection)
+    fulltext.rebuild(schema_editor.connection)
+
+
+def drop_index(apps, schema_editor):
+    fulltext.drop_index(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('engine', '0010_list_indexes'),
+        ('accounts', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
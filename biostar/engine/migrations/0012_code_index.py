@@ -0,0 +1,26 @@
+from django.db import migrations
+
+from biostar.engine import codesearch
+
+
+def create_index(apps, schema_editor):
+    """
+    Creates the code search index and fills it with the existing recipes.
+    """
+    codesearch.create_index(schema_editor.connection)
+    codesearch.rebuild(schema_editor.connection)
+
+
+def drop_index(apps, schema_editor):
+    codesearch.drop_index(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('engine', '0011_search_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
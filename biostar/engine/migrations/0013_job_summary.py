@@ -0,0 +1,51 @@
+# Generated by Django 2.0.13 on 2026-10-19 08:26
+
+import logging
+
+import hjson
+from django.db import migrations, models
+from django.template import loader
+
+logger = logging.getLogger("engine")
+
+
+def render_summary(json_text):
+    """
+    Renders the parameters of a job.
+    """
+    try:
+        data = hjson.loads(json_text)
+    except Exception as exc:
+        logger.error(f"Invalid job parameters: {exc}")
+        data = {}
+
+    template = loader.get_template("widgets/job_summary.html")
+    return template.render(dict(data=data))
+
+
+def fill_summary(apps, schema_editor):
+    """
+    Stores the rendered parameters of the existing jobs.
+    Jobs with the same parameters are rendered and updated together.
+    """
+    Job = apps.get_model('engine', 'Job')
+
+    jobs = Job.objects.filter(summary_html='')
+    for json_text in jobs.order_by().values_list("json_text", flat=True).distinct():
+        jobs.filter(json_text=json_text).update(summary_html=render_summary(json_text))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('engine', '0012_code_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='summary_html',
+            field=models.TextField(default=''),
+        ),
+        migrations.RunPython(fill_summary, migrations.RunPython.noop),
+    ]
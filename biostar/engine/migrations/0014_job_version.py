@@ -0,0 +1,27 @@
+# Generated by Django 2.0.13 on 2026-10-19 08:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('engine', '0013_job_summary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='version',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='project',
+            name='job_version',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='job',
+            index=models.Index(fields=['project', 'version'], name='engine_job_project_9df16c_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.0.13 on 2026-10-19 08:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('engine', '0014_job_version'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='job',
+            name='uid',
+            field=models.CharField(db_index=True, max_length=32),
+        ),
+    ]
@@ -1,17 +1,20 @@
+import functools
 import logging
 
 import hjson
-import mistune
-from django.db import models
-from django.db.models.signals import post_save
+from django.core.cache import cache
+from django.db import models, transaction
+from django.db.models import F
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from django.template import loader
 from django.urls import reverse
 from django.utils import timezone
 
 from biostar import settings
-from biostar.accounts.models import User
-from . import util
+from biostar.accounts.models import User, Profile
+from biostar.utils import markup
+from . import util, stats, fulltext, codesearch
 from .const import *
 
 logger = logging.getLogger("engine")
@@ -27,7 +30,7 @@ class Bunch(object):
 
 
 def make_html(text):
-    html = mistune.markdown(text, escape=False)
+    html = markup.render(text, escape=False)
     return html
 
 def image_path(instance, filename):
@@ -63,6 +66,107 @@ class Manager(models.Manager):
         return super().get_queryset().filter(**kwargs).select_related("owner", "owner__profile",  "lastedit_user",
                                                                       "lastedit_user__profile")
 
+def save_counters(obj, counters, args, kwargs):
+    """
+    Excludes counter fields from a full save of an existing row so that
+    stale values in memory do not overwrite the atomic updates.
+    """
+    if not obj._state.adding and not kwargs.get("update_fields") and not kwargs.get("force_insert"):
+        kwargs["update_fields"] = [f.name for f in obj._meta.concrete_fields
+                                   if f.name not in counters and not f.primary_key]
+    return args, kwargs
+
+
+def update_usage(obj, counted=None):
+    """
+    Applies the change in the counted size of a Data or a Job
+    to the storage counters of its project and its owner.
+    """
+    # The counted size is unknown for deferred fields.
+    if obj._counted is None:
+        return
+
+    counted = obj.counted_size() if counted is None else counted
+    project_delta = counted[0] - obj._counted[0]
+    owner_delta = counted[1] - obj._counted[1]
+    obj._counted = counted
+
+    field = "job_size" if isinstance(obj, Job) else "data_size"
+
+    if project_delta:
+        Project.objects.get_all(pk=obj.project_id).update(**{field: F(field) + project_delta})
+
+    if owner_delta and obj.owner_id:
+        Profile.objects.filter(user_id=obj.owner_id).update(**{field: F(field) + owner_delta})
+
+
+def listed(obj):
+    """
+    Returns the listed state of an object, None when it is not known.
+    """
+    return None if "deleted" in obj.get_deferred_fields() else not obj.deleted
+
+
+def update_count(obj, listed=None):
+    """
+    Applies a change in the listed state of a Data, Analysis or Job
+    to the matching object counter of its project.
+    """
+    # The state is unknown for deferred fields.
+    if obj._listed is None:
+        return
+
+    listed = (not obj.deleted) if listed is None else listed
+    delta = int(listed) - int(obj._listed)
+    obj._listed = listed
+
+    if delta:
+        field = obj.COUNT_FIELD
+        Project.objects.get_all(pk=obj.project_id).update(**{field: F(field) + delta})
+
+
+def searched(obj):
+    """
+    Returns the searchable content of an object, None when it is not known.
+    """
+    if obj.get_deferred_fields() & {"name", "text", "deleted", "owner_id"}:
+        return None
+    return obj.name, obj.text, obj.deleted, obj.owner_id
+
+
+def update_search(obj):
+    """
+    Updates the search index entry of an object when its content changed.
+    """
+    content = searched(obj)
+    if content is not None and content == obj._searched:
+        return
+
+    obj._searched = content
+    fulltext.update_entry(obj)
+
+
+def coded(obj):
+    """
+    Returns the code of a recipe, None when it is not known.
+    """
+    if obj.get_deferred_fields() & {"template", "json_text", "deleted"}:
+        return None
+    return obj.template, obj.json_text, obj.deleted
+
+
+def update_code(obj):
+    """
+    Updates the code search entry of a recipe when its code changed.
+    """
+    content = coded(obj)
+    if content is not None and content == obj._coded:
+        return
+
+    obj._coded = content
+    codesearch.update_entry(obj)
+
+
 class Project(models.Model):
     PUBLIC, SHAREABLE, PRIVATE = 1, 2, 3
     PRIVACY_CHOICES = [(PRIVATE, "Private"), (SHAREABLE, "Shareable Link"), (PUBLIC, "Public")]
@@ -88,8 +192,33 @@ class Project(models.Model):
     date = models.DateTimeField(auto_now_add=True)
     uid = models.CharField(max_length=32, unique=True)
 
+    # Storage used by the data and the job outputs of the project, in bytes.
+    data_size = models.BigIntegerField(default=0)
+    job_size = models.BigIntegerField(default=0)
+
+    # The number of objects that are not deleted in the project.
+    data_count = models.IntegerField(default=0)
+    recipe_count = models.IntegerField(default=0)
+    job_count = models.IntegerField(default=0)
+    discussion_count = models.IntegerField(default=0)
+
+    # Increases with every job state change in the project.
+    job_version = models.IntegerField(default=0)
+
     objects = Manager()
 
+    class Meta:
+        # Lists are paged in this order.
+        indexes = [models.Index(fields=["sticky", "date", "id"])]
+
+    # Fields that are only changed with atomic updates.
+    COUNTERS = ("data_size", "job_size", "data_count", "recipe_count", "job_count", "discussion_count",
+                "job_version")
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._searched = searched(self)
+
     def save(self, *args, **kwargs):
         now = timezone.now()
         self.date = self.date or now
@@ -102,7 +231,15 @@ class Project(models.Model):
         if not os.path.isdir(self.get_project_dir()):
             os.makedirs(self.get_project_dir())
 
-        super(Project, self).save(*args, **kwargs)
+        args, kwargs = save_counters(self, self.COUNTERS, args, kwargs)
+
+        # New rows are not in the search index.
+        if self._state.adding:
+            self._searched = None
+
+        with transaction.atomic():
+            super(Project, self).save(*args, **kwargs)
+            update_search(self)
 
     def __str__(self):
         return self.name
@@ -110,6 +247,13 @@ class Project(models.Model):
     def uid_is_set(self):
         assert bool(self.uid.strip()), "Sanity check. UID should always be set."
 
+    def get_counts(self):
+        """
+        The object counts displayed on the project pages.
+        """
+        return dict(data_count=self.data_count, recipe_count=self.recipe_count,
+                    result_count=self.job_count, discussion_count=self.discussion_count)
+
     def url(self):
         self.uid_is_set()
         return reverse("project_view", kwargs=dict(uid=self.uid))
@@ -170,6 +314,80 @@ class Access(models.Model):
         super(Access, self).save(*args, **kwargs)
 
 
+def access_version(user_id):
+    """
+    The version of the access rights of a user, changes when any of them change.
+    """
+    return cache.get(f"access-version-{user_id}", 0)
+
+
+def expire_access(user_id):
+    """
+    Invalidates the access maps of a user kept in sessions.
+    """
+    key = f"access-version-{user_id}"
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, None)
+
+
+class Visibility(models.Model):
+    """
+    Materialized project visibility. There is a row for each user that may see
+    a project and a row without a user for each public project.
+    """
+    user = models.ForeignKey(User, null=True, on_delete=models.CASCADE)
+    project = models.ForeignKey(Project, on_delete=models.CASCADE)
+
+    class Meta:
+        unique_together = ("user", "project")
+
+    def __str__(self):
+        return f"{self.user or 'Everyone'} sees {self.project_id}"
+
+
+def set_visible(project_id, user_id, visible):
+    """
+    Adds or removes a single visibility row.
+    """
+    query = Visibility.objects.filter(project_id=project_id, user_id=user_id)
+    if not visible:
+        query.delete()
+    elif not query.exists():
+        Visibility.objects.create(project_id=project_id, user_id=user_id)
+
+
+def update_visibility(project_id, user_id):
+    """
+    Matches the visibility of a project to a user with the access rights.
+    Project owners always see their projects.
+    """
+    owner_id = Project.objects.get_all(pk=project_id).values_list("owner_id", flat=True).first()
+    access = Access.objects.filter(project_id=project_id, user_id=user_id).values_list("access", flat=True).first()
+    visible = (owner_id == user_id) or access in (Access.READ_ACCESS, Access.WRITE_ACCESS)
+    set_visible(project_id=project_id, user_id=user_id, visible=visible)
+
+
+@receiver(post_save, sender=Access)
+@receiver(post_delete, sender=Access)
+def change_access(sender, instance, **kwargs):
+    expire_access(instance.user_id)
+
+
+@receiver(post_save, sender=Access)
+def save_visibility(sender, instance, **kwargs):
+    update_visibility(project_id=instance.project_id, user_id=instance.user_id)
+
+
+@receiver(post_delete, sender=Access)
+def delete_visibility(sender, instance, **kwargs):
+    # Only removes rows, projects being deleted must not gain new rows.
+    owner_id = Project.objects.get_all(pk=instance.project_id).values_list("owner_id", flat=True).first()
+    if owner_id != instance.user_id:
+        set_visible(project_id=instance.project_id, user_id=instance.user_id, visible=False)
+
+
 @receiver(post_save, sender=Project)
 def update_access(sender, instance, created, raw, update_fields, **kwargs):
     # Give the owner WRITE ACCESS if they do not have it.
@@ -177,6 +395,10 @@ def update_access(sender, instance, created, raw, update_fields, **kwargs):
     if entry.first() is None:
         entry = Access.objects.create(user=instance.owner, project=instance, access=Access.WRITE_ACCESS)
 
+    # Public projects are visible to everyone.
+    set_visible(project_id=instance.id, user_id=None, visible=instance.is_public)
+    set_visible(project_id=instance.id, user_id=instance.owner_id, visible=True)
+
 
 class Data(models.Model):
     PENDING, READY, ERROR, = 1, 2, 3
@@ -208,12 +430,33 @@ class Data(models.Model):
     # FilePathField points to an existing file
     file = models.FilePathField(max_length=MAX_FIELD_LEN)
 
+    # Statistics computed for the known file types, stored as JSON.
+    stats = models.TextField(default="", blank=True)
+
     uid = models.CharField(max_length=32, unique=True)
 
     objects = Manager()
 
+    class Meta:
+        # Lists are paged in this order.
+        indexes = [models.Index(fields=["project", "sticky", "date", "id"])]
+
+    # The project counter of the object.
+    COUNT_FIELD = "data_count"
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        self._counted = None if self.get_deferred_fields() else self.counted_size()
+        self._listed = listed(self)
+        self._searched = searched(self)
+
+    def counted_size(self):
+        """
+        The size counted towards the project and the owner storage.
+        Linked data does not count towards the owner.
+        """
+        size = 0 if self.deleted else self.size
+        return size, (0 if self.method == self.LINK else size)
 
     def save(self, *args, **kwargs):
         now = timezone.now()
@@ -239,7 +482,17 @@ class Data(models.Model):
             with open(self.file, 'wt') as fp:
                 pass
 
-        super(Data, self).save(*args, **kwargs)
+        # New rows did not count before.
+        if self._state.adding:
+            self._counted = (0, 0)
+            self._listed = False
+            self._searched = None
+
+        with transaction.atomic():
+            super(Data, self).save(*args, **kwargs)
+            update_usage(self)
+            update_count(self)
+            update_search(self)
 
     def peek(self):
         """
@@ -296,8 +549,28 @@ class Data(models.Model):
 
         return tocname
 
+    def make_stats(self):
+        """
+        Computes the statistics for each file in the table of contents.
+        """
+        data_dir = self.get_data_dir()
+        collect = dict()
+        for path in self.get_files():
+            result = stats.compute_stats(path)
+            if result:
+                collect[os.path.relpath(path, data_dir)] = result
+
+        self.stats = hjson.dumpsJSON(collect) if collect else ""
+
+        return collect
+
+    @property
+    def stats_data(self):
+        "Returns the stats as parsed json_data"
+        return hjson.loads(self.stats) if self.stats else {}
+
     def can_unpack(self):
-        cond = str(self.get_path()).endswith("tar.gz")
+        cond = any(util.is_tar_gz(path) for path in self.get_files())
         return cond
 
     def get_files(self):
@@ -375,6 +648,19 @@ class Analysis(models.Model):
 
     objects = Manager()
 
+    class Meta:
+        # Lists are paged in this order.
+        indexes = [models.Index(fields=["project", "sticky", "date", "id"])]
+
+    # The project counter of the object.
+    COUNT_FIELD = "recipe_count"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._listed = listed(self)
+        self._searched = searched(self)
+        self._coded = coded(self)
+
     def __str__(self):
         return self.name
 
@@ -401,7 +687,17 @@ class Analysis(models.Model):
         if self.security == self.AUTHORIZED:
             self.last_valid = self.template
 
-        super(Analysis, self).save(*args, **kwargs)
+        # New rows were not listed before.
+        if self._state.adding:
+            self._listed = False
+            self._searched = None
+            self._coded = None
+
+        with transaction.atomic():
+            super(Analysis, self).save(*args, **kwargs)
+            update_count(self)
+            update_search(self)
+            update_code(self)
 
     def get_project_dir(self):
         return self.project.get_project_dir()
@@ -428,6 +724,44 @@ class Analysis(models.Model):
         return first
 
 
+def next_job_version(project_id):
+    """
+    Increments and returns the job version of a project.
+    Must be called in the transaction that changes the job states.
+    """
+    query = Project.objects.get_all(pk=project_id)
+    query.update(job_version=F("job_version") + 1)
+    return query.values_list("job_version", flat=True).first()
+
+
+def set_job_state(jobs, state, **fields):
+    """
+    Changes the state of the jobs in a queryset with bulk updates.
+    """
+    with transaction.atomic():
+        for project_id in set(jobs.values_list("project_id", flat=True)):
+            version = next_job_version(project_id)
+            jobs.filter(project_id=project_id).update(state=state, version=version, **fields)
+
+
+@functools.lru_cache(maxsize=1024)
+def job_summary(json_text):
+    """
+    Renders the parameters of a job. Jobs of the same recipe
+    often share the parameters, the renders are reused.
+    """
+    try:
+        data = hjson.loads(json_text)
+    except Exception as exc:
+        logger.error(f"Invalid job parameters: {exc}")
+        data = {}
+
+    summary_template = "widgets/job_summary.html"
+    context = dict(data=data)
+    template = loader.get_template(summary_template)
+    return template.render(context)
+
+
 class Job(models.Model):
     AUTHORIZED, UNDER_REVIEW = 1, 2
     AUTH_CHOICES = [(AUTHORIZED, "Authorized"), (UNDER_REVIEW, "Authorization Required")]
@@ -439,6 +773,12 @@ class Job(models.Model):
 
     state = models.IntegerField(default=QUEUED, choices=STATE_CHOICES)
 
+    PRIMARY, ARCHIVED, PURGED = 1, 2, 3
+    STORAGE_CHOICES = [(PRIMARY, "Primary"), (ARCHIVED, "Archived"), (PURGED, "Purged")]
+
+    # Where the job outputs are stored.
+    storage = models.IntegerField(default=PRIMARY, choices=STORAGE_CHOICES)
+
     deleted = models.BooleanField(default=False)
     name = models.CharField(max_length=MAX_NAME_LEN, default="New results")
     image = models.ImageField(default=None, blank=True, upload_to=image_path, max_length=MAX_FIELD_LEN)
@@ -463,7 +803,7 @@ class Job(models.Model):
     project = models.ForeignKey(Project, on_delete=models.CASCADE)
     json_text = models.TextField(default="commands")
 
-    uid = models.CharField(max_length=32)
+    uid = models.CharField(max_length=32, db_index=True)
     template = models.TextField(default="makefile")
 
     # Set the security level.
@@ -483,8 +823,48 @@ class Job(models.Model):
 
     path = models.FilePathField(default="")
 
+    # The size of the job outputs.
+    size = models.BigIntegerField(default=0)
+
+    # The rendered job parameters, computed when the parameters change.
+    summary_html = models.TextField(default="")
+
+    # The project job version of the last state change.
+    version = models.IntegerField(default=0)
+
     objects = Manager()
 
+    class Meta:
+        # Lists are paged in this order, state changes are selected by version.
+        indexes = [models.Index(fields=["project", "sticky", "date", "id"]),
+                   models.Index(fields=["project", "version"])]
+
+    # The project counter of the object.
+    COUNT_FIELD = "job_count"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._counted = None if self.get_deferred_fields() else self.counted_size()
+        self._listed = listed(self)
+        self._searched = searched(self)
+        self._json_text = None if "json_text" in self.get_deferred_fields() else self.json_text
+        self._job_state = None if "state" in self.get_deferred_fields() else self.state
+
+    def counted_size(self):
+        """
+        The size counted towards the project and the owner storage.
+        """
+        size = 0 if self.deleted else self.size
+        return size, size
+
+    def set_size(self, size):
+        """
+        Updates the size of the job outputs and the storage counters.
+        """
+        self.size = size
+        Job.objects.get_all(pk=self.pk).update(size=size)
+        update_usage(self)
+
     def is_running(self):
         return self.state == Job.RUNNING
 
@@ -508,6 +888,18 @@ class Job(models.Model):
         path = join(settings.MEDIA_ROOT, "jobs", self.uid)
         return path
 
+    def get_archive_path(self):
+        """
+        The archive that holds the job outputs in cold storage.
+        """
+        return join(settings.JOB_ARCHIVE_ROOT, f"{self.uid}.zip")
+
+    def is_archived(self):
+        return self.storage == Job.ARCHIVED
+
+    def is_purged(self):
+        return self.storage == Job.PURGED
+
 
     @property
     def json_data(self):
@@ -533,6 +925,9 @@ class Job(models.Model):
     def done(self):
         return self.state == Job.COMPLETED
 
+    def is_finished(self):
+        return self.state in (Job.COMPLETED, Job.ERROR)
+
     def make_path(self):
         path = join(settings.MEDIA_ROOT, "jobs", f"{self.uid}")
         return path
@@ -552,19 +947,64 @@ class Job(models.Model):
         self.lastedit_user = self.lastedit_user or self.owner or self.project.owner
         self.lastedit_date = now
 
-        if not os.path.isdir(self.path):
+        # Archived and purged jobs no longer have a directory.
+        if self.storage == Job.PRIMARY and not os.path.isdir(self.path):
             os.makedirs(self.path)
 
-        super(Job, self).save(*args, **kwargs)
+        # Render the parameters once, not on every display.
+        if not self.summary_html or self.json_text != self._json_text:
+            self.summary_html = job_summary(self.json_text)
+            self._json_text = self.json_text
+
+        # New rows did not count before.
+        if self._state.adding:
+            self._counted = (0, 0)
+            self._listed = False
+            self._searched = None
+
+        with transaction.atomic():
+            # State changes are published to the job status channel.
+            if self._state.adding or self.state != self._job_state:
+                self.version = next_job_version(self.project_id)
+                self._job_state = self.state
+
+            super(Job, self).save(*args, **kwargs)
+            update_usage(self)
+            update_count(self)
+            update_search(self)
 
     @property
     def summary(self):
         """
-        Creates informative job summary that shows job parameters.
+        Informative job summary that shows job parameters.
         """
-        summary_template = "widgets/job_summary.html"
-        context = dict(data=self.json_data)
-        template = loader.get_template(summary_template)
-        result = template.render(context)
+        return self.summary_html
+
+
+@receiver(post_delete, sender=Data)
+@receiver(post_delete, sender=Job)
+def delete_usage(sender, instance, **kwargs):
+    # Deleted rows no longer count towards the storage.
+    update_usage(instance, counted=(0, 0))
+
+
+@receiver(post_delete, sender=Data)
+@receiver(post_delete, sender=Analysis)
+@receiver(post_delete, sender=Job)
+def delete_count(sender, instance, **kwargs):
+    # Deleted rows are no longer listed in the project.
+    update_count(instance, listed=False)
+
+
+@receiver(post_delete, sender=Project)
+@receiver(post_delete, sender=Data)
+@receiver(post_delete, sender=Analysis)
+@receiver(post_delete, sender=Job)
+def delete_search(sender, instance, **kwargs):
+    # Deleted rows can no longer be found.
+    fulltext.remove_entry(instance)
+
 
-        return result
+@receiver(post_delete, sender=Analysis)
+def delete_code(sender, instance, **kwargs):
+    codesearch.remove_entry(instance)
@@ -0,0 +1,109 @@
+"""
+Keyset pagination.
+
+A page is selected by the sort key of the last item on the previous page, so
+the cost of a page stays the same no matter how deep into the list it is.
+The cursor is the URL safe encoding of that sort key.
+"""
+import base64
+import json
+
+from django.db.models import Q
+
+# The sort order of project lists and project content, sticky items first.
+STICKY_ORDER = ("-sticky", "-date", "-id")
+
+
+class Page(object):
+    """
+    The items of a page and the cursor of the next page.
+    """
+
+    def __init__(self, items, cursor=None):
+        self.items = items
+        self.cursor = cursor
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __bool__(self):
+        return bool(self.items)
+
+    @property
+    def has_next(self):
+        return self.cursor is not None
+
+
+def sort_fields(order):
+    """
+    Splits an ordering into (field name, descending) tuples.
+    """
+    return [(name.lstrip("-"), name.startswith("-")) for name in order]
+
+
+def encode_cursor(obj, order):
+    """
+    Encodes the sort key of an object as an opaque string.
+    """
+    values = [obj._meta.get_field(name).value_to_string(obj) for name, desc in sort_fields(order)]
+    text = json.dumps(values, separators=(",", ":"))
+    return base64.urlsafe_b64encode(text.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(model, cursor, order):
+    """
+    Decodes a cursor into the sort key values, returns None for invalid cursors.
+    """
+    try:
+        text = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode("utf-8")
+        values = json.loads(text)
+        fields = sort_fields(order)
+        if len(values) != len(fields):
+            return None
+        return [model._meta.get_field(name).to_python(value) for (name, desc), value in zip(fields, values)]
+    except Exception:
+        return None
+
+
+def after(order, values):
+    """
+    Returns the condition that selects the rows after a sort key.
+    """
+    cond = Q()
+    equal = {}
+    for (name, desc), value in zip(sort_fields(order), values):
+        lookup = "lt" if desc else "gt"
+        cond |= Q(**equal, **{f"{name}__{lookup}": value})
+        equal[name] = value
+    return cond
+
+
+def get_page(queryset, cursor='', size=50, order=STICKY_ORDER):
+    """
+    Returns the page of a queryset that follows a cursor.
+    """
+    queryset = queryset.order_by(*order)
+
+    values = decode_cursor(queryset.model, cursor, order) if cursor else None
+    if values:
+        queryset = queryset.filter(after(order, values))
+
+    # One extra item tells whether there is a next page.
+    items = list(queryset[:size + 1])
+    next_cursor = encode_cursor(items[size - 1], order) if len(items) > size else None
+
+    return Page(items=items[:size], cursor=next_cursor)
+
+
+def next_url(request, page, param="after"):
+    """
+    The url of the page that follows, keeping the other query parameters.
+    """
+    if not page.has_next:
+        return ""
+    params = request.GET.copy()
+    params[param] = page.cursor
+    return f"{request.path}?{params.urlencode()}"
@@ -1,113 +1,112 @@
 
 import logging
-from functools import reduce
-from django.db.models import Q
-from django.utils.text import smart_split
 from django.conf import settings
 from django import forms
 
+from biostar.engine import fulltext, codesearch
 from biostar.engine.auth import get_project_list
-from biostar.engine.models import Job, Analysis, Data
+from biostar.engine.models import Job, Analysis, Data, Project, Bunch
 from biostar.engine.const import *
 
 logger = logging.getLogger('engine')
 
+# The model and the label of each kind of search result.
+MODELS = dict(project=Project, data=Data, analysis=Analysis, job=Job)
+LABELS = dict(project="Project", data="Data", analysis="Recipe", job="Job")
+
 
 def search(request):
+    """
+    Returns the search results visible to the user in the order of relevance.
+    """
+
+    search_form = SearchForm(data=request.GET or {})
 
-    results = dict(analysis=[], project=[], data=[], job=[])
+    if not search_form.is_valid():
+        return []
 
-    # Search each model type by title, text, owner email/name.
-    search_fields = ['name', 'text', 'owner__email', 'owner__profile__name']
+    words = split_text_query(search_form.cleaned_data['q'])
 
     # Get the objects the user can access
     projects = get_project_list(user=request.user)
 
-    model_map = {"job": Job.objects.filter(project__in=projects),
-                 "analysis": Analysis.objects.filter(project__in=projects),
-                 "data": Data.objects.filter(project__in=projects),
-                 "project": projects}
+    hits = fulltext.query(words, projects=projects, limit=settings.SEARCH_LIMIT)
 
-    # Create a search form for each model type.
-    for mtype in results:
+    # Load the objects of each kind at once.
+    found = {}
+    for kind, model in MODELS.items():
+        ids = [obj_id for name, obj_id, title, snippet in hits if name == kind]
+        found[kind] = model.objects.in_bulk(ids) if ids else {}
 
-        queryset = model_map[mtype]
-        # Load query from GET request.
-        search_form = SearchForm(queryset=queryset, search_fields=search_fields,
-                                 data=request.GET or {})
-
-        # Add search results to dict
-        if search_form.is_valid():
-            results[mtype] = search_form.get_queryset()
+    results = []
+    for kind, obj_id, title, snippet in hits:
+        obj = found[kind].get(obj_id)
+        if obj:
+            results.append(Bunch(obj=obj, label=LABELS[kind], title=title, snippet=snippet))
 
     return results
 
 
-class SearchForm(forms.Form):
-    #TODO: will be moved to engine.forms
+def code_search(request, form):
+    """
+    Returns the recipes visible to the user whose code matches the query,
+    with the matching lines.
+    """
+    text, regex = form.cleaned_data['q'], form.cleaned_data['regex']
 
-    def __init__(self, queryset=None, search_fields=None, *args, **kwargs):
-        self.queryset = queryset
-        self.search_fields = search_fields
-        super(SearchForm, self).__init__(*args, **kwargs)
+    # Get the objects the user can access
+    projects = get_project_list(user=request.user)
 
-    q = forms.CharField(label='Search', required=False)
+    ids = codesearch.query(text, projects=projects, limit=settings.SEARCH_LIMIT, regex=regex)
+    recipes = Analysis.objects.select_related("project").in_bulk(ids)
 
-    def clean_q(self):
-        query = self.cleaned_data['q'].strip()
+    results = []
+    for recipe in filter(None, map(recipes.get, ids)):
+        lines = codesearch.matching_lines(recipe, text, regex=regex)
+        results.append(Bunch(recipe=recipe, lines=lines))
 
-        if len(query) <= settings.SEARCH_CHAR_MIN:
-            raise forms.ValidationError("Enter more than 3 characters.")
-
-        return query
+    return results
 
-    def get_queryset(self):
-        qs = self.queryset
-        query = self.cleaned_data.get('q')
 
-        if query:
-            qs = qs.filter(search_filter(self.search_fields, query))
+class CodeSearchForm(forms.Form):
 
-        return qs
+    q = forms.CharField(label='Code', required=True, max_length=256,
+                        help_text="Text or regular expression to look for in recipe templates and JSON specifications.")
+    regex = forms.BooleanField(label='Regular expression', required=False)
 
+    def clean(self):
+        cleaned_data = super(CodeSearchForm, self).clean()
+        query = cleaned_data.get('q', '')
 
-def search_filter(search_fields, query_string):
-    """search_fields example: ['name', 'category__name', '@description', '=id']
-    """
+        if cleaned_data.get('regex'):
+            try:
+                codesearch.check_regex(query)
+            except ValueError as exc:
+                raise forms.ValidationError(f"{exc}")
+        elif query and len(query) < codesearch.MIN_LITERAL:
+            raise forms.ValidationError(f"Enter at least {codesearch.MIN_LITERAL} characters.")
 
-    query_string = query_string.strip()
+        return cleaned_data
 
-    filters = []
-    first = True
 
-    for bit in split_text_query(query_string):
+class SearchForm(forms.Form):
+    #TODO: will be moved to engine.forms
 
-        queries = [Q(**{search_param(field_name, first): bit})
-                   for field_name in search_fields]
-        filters.append(reduce(Q.__or__, queries))
-        first = False
+    q = forms.CharField(label='Search', required=False)
 
-    return reduce(Q.__and__, filters) if len(filters) else Q(pk=None)
+    def clean_q(self):
+        query = self.cleaned_data['q'].strip()
 
+        if len(query) <= settings.SEARCH_CHAR_MIN:
+            raise forms.ValidationError("Enter more than 3 characters.")
 
-def search_param(field_name, is_first_word):
-    if field_name.startswith('^') and is_first_word:
-        return "%s__istartswith" % field_name[1:]
-    elif field_name.startswith('@'):
-        return "%s__search" % field_name[1:]
-    elif field_name.startswith('='):
-        return "%s__iexact" % field_name[1:]
-    else:
-        return "%s__icontains" % field_name
+        return query
 
 
 def split_text_query(query):
     """Filter out stopwords but only if there are useful words"""
 
-    split_query = list(smart_split(query))
-    filtered_query = [bit for bit in split_query if bit not in STOPWORDS]
+    split_query = fulltext.terms(query)
+    filtered_query = [bit for bit in split_query if bit.lower() not in STOPWORDS]
 
     return filtered_query if len(filtered_query) else split_query
-
-
-
@@ -155,8 +155,97 @@ function add_comment(elem) {
 };
 
 
+function load_more(link) {
+
+    // Only one request per link.
+    if (link.hasClass('loading')) {
+        return;
+    }
+    link.addClass('loading');
+
+    var target = link.attr('data-target');
+    var segment = link.closest('.load-more');
+
+    $.ajax(link.attr('href'), {
+            type: 'GET',
+            dataType: 'html',
+            success: function (data) {
+                var page = $('<div>').append($.parseHTML(data));
+                $(target).append(page.find(target).children('.item'));
+                segment.replaceWith(page.find('.load-more'));
+                watch_more();
+            },
+            error: function () {
+                link.removeClass('loading');
+            }
+            });
+}
+
+function watch_more() {
+
+    // Loads the next page when the link scrolls into view.
+    $('.load-more > a').each(function () {
+        var link = $(this);
+        if (!('IntersectionObserver' in window)) {
+            return;
+        }
+        var observer = new IntersectionObserver(function (entries) {
+            if (entries[0].isIntersecting) {
+                observer.disconnect();
+                load_more(link);
+            }
+        });
+        observer.observe(this);
+    });
+}
+
+
+function poll_jobs(channel, delay) {
+
+    // Only pages showing unfinished jobs ask for changes.
+    if ($('.job-status[data-finished="0"]').length === 0) {
+        return;
+    }
+
+    setTimeout(function () {
+        check_jobs(channel);
+    }, delay);
+}
+
+
+function check_jobs(channel) {
+
+    $.ajax(channel.attr('data-url'), {
+            type: 'GET',
+            dataType: 'json',
+            data: {since: channel.attr('data-version')},
+            success: function (data) {
+                channel.attr('data-version', data.version);
+                $.each(data.jobs, function (index, job) {
+                    $('.job-status[data-uid="' + job.uid + '"]').replaceWith(job.html);
+                });
+                poll_jobs(channel, data.interval * 1000);
+            },
+            error: function () {
+                poll_jobs(channel, 10000);
+            }
+            });
+}
+
+
 $(document).ready(function () {
 
+    watch_more();
+
+    $('#job-status').each(function () {
+        poll_jobs($(this), 0);
+    });
+
+    $(document).on('click', '.load-more > a', function (event) {
+        event.preventDefault();
+        load_more($(this));
+    });
+
 
      $('select')
         .dropdown()
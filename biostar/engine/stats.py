@@ -0,0 +1,338 @@
+"""
+Streaming statistics for bioinformatics files.
+
+Each file is read once in large byte buffers that are processed with numpy.
+Gzip compressed files are decompressed transparently while streaming.
+"""
+import gzip
+import logging
+import os
+from collections import Counter
+
+import numpy as np
+
+logger = logging.getLogger("engine")
+
+# The size of the byte buffers that are processed at once.
+BUFFER_SIZE = 16 * 1024 * 1024
+
+# Byte values used when scanning buffers.
+NEWLINE, CR, HEADER, COMMENT = ord("\n"), ord("\r"), ord(">"), ord("#")
+
+# Bases counted towards the GC content.
+GC_BYTES = [ord(c) for c in "GCgcSs"]
+
+# Phred quality offset in FASTQ files.
+PHRED_OFFSET = 33
+
+# Maps a file extension to a statistics format.
+EXT_TO_FORMAT = dict(
+    fa="FASTA", fasta="FASTA", fna="FASTA", fas="FASTA",
+    fq="FASTQ", fastq="FASTQ",
+    bed="BED",
+    vcf="VCF",
+)
+
+# The number of bins in the stored length histogram.
+HISTOGRAM_BINS = 10
+
+
+def guess_format(fname):
+    """
+    Returns the statistics format for a file name or None.
+    """
+    name = fname[:-3] if fname.endswith(".gz") else fname
+    ext = os.path.splitext(name)[1].lstrip(".").lower()
+    return EXT_TO_FORMAT.get(ext)
+
+
+def open_stream(fname):
+    """
+    Opens a binary stream, transparently decompressing gzip files.
+    """
+    with open(fname, 'rb') as fp:
+        magic = fp.read(2)
+
+    if magic == b'\x1f\x8b':
+        return gzip.open(fname, 'rb')
+
+    return open(fname, 'rb')
+
+
+def read_lines(fname, size=None):
+    """
+    Generates (buffer, starts, ends) tuples for batches of complete lines.
+    The buffer is a numpy uint8 array; starts and ends index each line in it
+    with line endings removed.
+    """
+    size = size or BUFFER_SIZE
+    leftover = b''
+    with open_stream(fname) as stream:
+        while True:
+            chunk = stream.read(size)
+
+            # Process what is left at the end of the stream.
+            if not chunk:
+                if leftover:
+                    leftover += b'\n'
+                    chunk, leftover = leftover, b''
+                else:
+                    break
+            else:
+                chunk = leftover + chunk
+                last = chunk.rfind(b'\n')
+                if last < 0:
+                    leftover = chunk
+                    continue
+                chunk, leftover = chunk[:last + 1], chunk[last + 1:]
+
+            buffer = np.frombuffer(chunk, dtype=np.uint8)
+            ends = np.flatnonzero(buffer == NEWLINE)
+            starts = np.empty_like(ends)
+            starts[0] = 0
+            starts[1:] = ends[:-1] + 1
+
+            # Remove the carriage returns of Windows line endings.
+            has_cr = ends > starts
+            has_cr[has_cr] = buffer[ends[has_cr] - 1] == CR
+            ends = ends - has_cr
+
+            yield buffer, starts, ends
+
+
+def byte_sums(buffer, starts, ends, values):
+    """
+    Returns the sum of values over the [start, end) interval of each line.
+    """
+    total = np.zeros(len(values) + 1, dtype=np.int64)
+    np.cumsum(values, out=total[1:])
+    return total[ends] - total[starts]
+
+
+class Collector(object):
+    """
+    Accumulates record counts, lengths and base composition.
+    """
+
+    def __init__(self, format):
+        self.format = format
+        self.count = 0
+        self.bases = 0
+        self.gc = 0
+        self.qual_sum = 0
+        self.qual_bases = 0
+        self.lengths = Counter()
+        self.extra = Counter()
+
+    def add_lengths(self, lengths):
+        if not len(lengths):
+            return
+        values, counts = np.unique(lengths, return_counts=True)
+        self.lengths.update(dict(zip(values.tolist(), counts.tolist())))
+        self.count += int(len(lengths))
+        self.bases += int(lengths.sum())
+
+    def summary(self):
+        """
+        Returns a dictionary with the summary statistics.
+        """
+        result = dict(format=self.format, count=self.count)
+
+        if self.lengths:
+            keys = np.array(sorted(self.lengths), dtype=np.int64)
+            counts = np.array([self.lengths[k] for k in keys], dtype=np.int64)
+            result.update(
+                bases=self.bases,
+                min_len=int(keys[0]),
+                max_len=int(keys[-1]),
+                mean_len=round(self.bases / self.count, 2),
+                n50=n50(keys=keys, counts=counts),
+                histogram=histogram(keys=keys, counts=counts),
+            )
+
+        if self.format in ("FASTA", "FASTQ") and self.bases:
+            result['gc'] = round(100.0 * self.gc / self.bases, 2)
+
+        if self.qual_bases:
+            result['mean_qual'] = round(self.qual_sum / self.qual_bases - PHRED_OFFSET, 2)
+
+        result.update(self.extra)
+
+        return result
+
+
+def n50(keys, counts):
+    """
+    The length at which half of all bases are in records of that length or longer.
+    """
+    weights = (keys * counts)[::-1]
+    half = weights.sum() / 2.0
+    idx = np.searchsorted(np.cumsum(weights), half)
+    return int(keys[::-1][idx])
+
+
+def histogram(keys, counts, bins=HISTOGRAM_BINS):
+    """
+    Returns the length distribution as a list of (start, end, count) bins.
+    """
+    low, high = int(keys[0]), int(keys[-1])
+    if low == high:
+        return [(low, high, int(counts.sum()))]
+
+    edges = np.linspace(low, high + 1, bins + 1).astype(np.int64)
+    edges = np.unique(edges)
+    idx = np.searchsorted(edges, keys, side='right') - 1
+    binned = np.bincount(idx, weights=counts, minlength=len(edges) - 1)
+    return [(int(edges[i]), int(edges[i + 1]) - 1, int(binned[i])) for i in range(len(edges) - 1)]
+
+
+def is_gc(buffer):
+    return np.isin(buffer, GC_BYTES).view(np.uint8)
+
+
+def fastq_stats(fname):
+    """
+    Statistics for FASTQ files, four lines per record.
+    """
+    coll = Collector("FASTQ")
+    line_no = 0
+
+    for buffer, starts, ends in read_lines(fname):
+
+        # Position of each line within its record.
+        phase = (np.arange(len(starts)) + line_no) % 4
+        line_no += len(starts)
+
+        seq = phase == 1
+        qual = phase == 3
+
+        lengths = (ends - starts)[seq]
+        coll.add_lengths(lengths)
+
+        coll.gc += int(byte_sums(buffer, starts[seq], ends[seq], is_gc(buffer)).sum())
+
+        quals = byte_sums(buffer, starts[qual], ends[qual], buffer)
+        coll.qual_sum += int(quals.sum())
+        coll.qual_bases += int((ends - starts)[qual].sum())
+
+    return coll.summary()
+
+
+def fasta_stats(fname):
+    """
+    Statistics for FASTA files, records may span multiple lines.
+    """
+    coll = Collector("FASTA")
+
+    # The length of the record that continues from the previous buffer.
+    carry = None
+
+    for buffer, starts, ends in read_lines(fname):
+
+        sizes = ends - starts
+        header = np.zeros(len(starts), dtype=bool)
+        nonempty = sizes > 0
+        header[nonempty] = buffer[starts[nonempty]] == HEADER
+
+        # Record index of each line relative to this buffer.
+        record = np.cumsum(header)
+        seq_sizes = np.where(header, 0, sizes)
+        lengths = np.bincount(record, weights=seq_sizes).astype(np.int64)
+
+        # Index 0 holds the lines before the first header in this buffer.
+        if carry is not None:
+            lengths[0] += carry
+            complete = lengths[:-1]
+        else:
+            complete = lengths[1:-1]
+
+        if len(lengths) > 1 or carry is not None:
+            carry = int(lengths[-1])
+
+        coll.add_lengths(complete)
+
+        seq = ~header
+        coll.gc += int(byte_sums(buffer, starts[seq], ends[seq], is_gc(buffer)).sum())
+
+    if carry is not None:
+        coll.add_lengths(np.array([carry], dtype=np.int64))
+
+    return coll.summary()
+
+
+def data_lines(buffer, starts, ends):
+    """
+    Returns the non-empty, non-comment lines of a buffer as a list of bytes.
+    """
+    sizes = ends - starts
+    keep = sizes > 0
+    keep[keep] = buffer[starts[keep]] != COMMENT
+    raw = buffer.tobytes()
+    return [raw[s:e] for s, e in zip(starts[keep].tolist(), ends[keep].tolist())]
+
+
+def bed_stats(fname):
+    """
+    Statistics for BED files, the interval lengths form the distribution.
+    """
+    coll = Collector("BED")
+    chroms = set()
+
+    for buffer, starts, ends in read_lines(fname):
+        lines = data_lines(buffer, starts, ends)
+        lines = [line for line in lines if not line.startswith((b'track', b'browser'))]
+        fields = [line.split(b'\t', 3) for line in lines]
+        fields = [f for f in fields if len(f) >= 3]
+        if not fields:
+            continue
+        chroms.update(f[0] for f in fields)
+        begin = np.array([f[1] for f in fields], dtype=np.int64)
+        end = np.array([f[2] for f in fields], dtype=np.int64)
+        coll.add_lengths(end - begin)
+
+    coll.extra['chroms'] = len(chroms)
+    return coll.summary()
+
+
+def vcf_stats(fname):
+    """
+    Statistics for VCF files, counts variants by type.
+    """
+    coll = Collector("VCF")
+    chroms = set()
+
+    for buffer, starts, ends in read_lines(fname):
+        lines = data_lines(buffer, starts, ends)
+        fields = [line.split(b'\t', 5) for line in lines]
+        fields = [f for f in fields if len(f) >= 5]
+        if not fields:
+            continue
+        chroms.update(f[0] for f in fields)
+        ref = np.array([len(f[3]) for f in fields], dtype=np.int64)
+        alt = np.array([len(f[4].split(b',')[0]) for f in fields], dtype=np.int64)
+        snps = int(((ref == 1) & (alt == 1)).sum())
+        coll.count += len(fields)
+        coll.extra['snps'] += snps
+        coll.extra['indels'] += len(fields) - snps
+
+    coll.extra['chroms'] = len(chroms)
+    return coll.summary()
+
+
+FORMAT_FUNCS = dict(FASTA=fasta_stats, FASTQ=fastq_stats, BED=bed_stats, VCF=vcf_stats)
+
+
+def compute_stats(fname):
+    """
+    Returns the statistics for a file or None for unknown formats.
+    """
+    format = guess_format(fname)
+    func = FORMAT_FUNCS.get(format)
+    if not func or not os.path.isfile(fname):
+        return None
+
+    try:
+        return func(fname)
+    except Exception as exc:
+        logger.error(f"Statistics error for {fname}: {exc}")
+        return dict(format=format, error=f"{exc}")
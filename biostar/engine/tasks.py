@@ -2,7 +2,7 @@
 This is active only when deployed via UWSGI
 '''
 
-import logging, time, shutil, subprocess
+import logging, time, shutil, subprocess, os
 from django.core import management
 from django.utils.encoding import force_text
 
@@ -35,7 +35,7 @@ try:
 
     @timer(30)
     def scheduler(args):
-        from biostar.engine.models import Job
+        from biostar.engine.models import Job, set_job_state
 
         # Check for queued jobs.
         jobs = Job.objects.filter(state=Job.QUEUED)
@@ -44,7 +44,7 @@ try:
             for job in jobs:
                 logger.info(f"Spooling job id={job.id}")
                 execute_job.spool(job_id=job.id)
-            jobs.update(state=Job.SPOOLED)
+            set_job_state(jobs, Job.SPOOLED)
 
     #@timer(10)
     def spool_demo(args):
@@ -76,12 +76,98 @@ try:
         logger.info(f"Executing spooled job id={job_id}")
         management.call_command('job', id=job_id)
 
+    @spool(pass_arguments=True)
+    def async_data_stats(data_id):
+        """
+        Computes the data statistics in spooler.
+        """
+        return data_stats(data_id=data_id)
+
+    @spool(pass_arguments=True)
+    def async_unpack_data(data_id):
+        """
+        Extracts the archives of a data in spooler.
+        """
+        return unpack_data(data_id=data_id)
+
 except ModuleNotFoundError as exc:
     pass
 
+
+def data_stats(data_id):
+    """
+    Computes and stores the file statistics for a data.
+    """
+    from biostar.engine.models import Data
+
+    data = Data.objects.get_all(id=data_id).first()
+    if not data:
+        logger.error(f"Data id={data_id} does not exist")
+        return
+
+    data.make_stats()
+    Data.objects.get_all(id=data_id).update(stats=data.stats)
+    logger.info(f"Computed statistics for data id={data_id}")
+
+
 def execute(command, workdir="."):
     proc = subprocess.run(command, cwd=workdir, shell=True,
                           stdout=subprocess.PIPE, stderr=subprocess.PIPE)
     stdout, stderr = force_text(proc.stdout), force_text(proc.stderr)
     return stdout, stderr
 
+
+
+# How many extracted files between progress updates.
+UNPACK_UPDATE_EVERY = 100
+
+
+def unpack_data(data_id):
+    """
+    Streams the tar.gz files of a data into its data directory.
+    The table of contents and the size grow as the files are extracted.
+    """
+    from biostar.engine.models import Data
+    from biostar.engine import util, models
+
+    data = Data.objects.get_all(id=data_id).first()
+    if not data:
+        logger.error(f"Data id={data_id} does not exist")
+        return
+
+    query = Data.objects.get_all(id=data_id)
+    archives = [path for path in data.get_files() if util.is_tar_gz(path)]
+    total = sum(os.path.getsize(path) for path in archives) or 1
+
+    query.update(state=Data.PENDING)
+
+    state, count, size, offset = Data.READY, 0, data.size, 0
+    try:
+        with open(data.get_path(), 'at') as toc:
+            for archive in archives:
+                for path, pos in util.stream_extract(fname=archive, dest=data.get_data_dir()):
+                    toc.write(f"\n{path}")
+                    count += 1
+                    size += os.path.getsize(path)
+
+                    # Report the progress.
+                    if count % UNPACK_UPDATE_EVERY == 0:
+                        toc.flush()
+                        query.update(size=size)
+                        percent = 100 * (offset + pos) / total
+                        logger.info(f"Unpacking data id={data_id}: {count} files, {percent:.0f}%")
+
+                offset += os.path.getsize(archive)
+
+    except Exception as exc:
+        state = Data.ERROR
+        logger.error(f"Unpacking data id={data_id} error: {exc}")
+
+    # Rebuild the sorted table of contents.
+    data.make_toc()
+    query.update(state=state, size=data.size, file=data.file)
+    models.update_usage(data)
+    logger.info(f"Unpacked data id={data_id}: {count} files")
+
+    # The new files may have statistics.
+    data_stats(data_id=data_id)
@@ -12,7 +12,7 @@ from django.core.paginator import Paginator
 from django.template import defaultfilters
 from django.utils.safestring import mark_safe
 
-from biostar.engine import auth, util, const
+from biostar.engine import auth, util, const, archive
 from biostar.engine.models import Job, make_html, Project, Data, Analysis, Access
 from biostar.utils.shortcuts import reverse
 
@@ -82,20 +82,6 @@ def file_list(context, path, files, obj, form=None):
     return dict(path=path, files=files, obj=obj, form=form, back=back, view_url=view_url, serve_url=serve_url)
 
 
-@register.filter
-def highlight(source, target):
-
-    # Look for case insensitive matches in the source
-    highlighting = re.search(f"(?i){target}", source)
-
-    target = highlighting.group() if highlighting else target
-
-    # Highlight the target
-    highlighted = mark_safe(f"<div class='match'>{target}</div>")
-
-    return source.replace(target, highlighted)
-
-
 @register.simple_tag
 def get_qiime2view_link(file_serve_url):
     site = f"{settings.PROTOCOL}://{settings.SITE_DOMAIN}{settings.HTTP_PORT}"
@@ -115,6 +101,15 @@ def list_view(context, projects=None, data_list=None, recipe_list=None, job_list
                 job_list=job_list, request=request)
 
 
+@register.inclusion_tag('widgets/load_more.html')
+def load_more(next_url, target):
+    """
+    Link to the next page of a list. The items of that page
+    are appended to the target element as the link scrolls into view.
+    """
+    return dict(next_url=next_url, target=target)
+
+
 @register.inclusion_tag('widgets/recipe_moderate.html')
 def recipes_moderate(cutoff=0):
     recipes = Analysis.objects.filter(security=Analysis.UNDER_REVIEW,
@@ -201,14 +196,12 @@ def data_color(data):
     return DATA_COLORS.get(data.state, "")
 
 
-@register.simple_tag
-def access_color(user, project):
-    if user.is_authenticated:
-        access = Access.objects.filter(user=user, project=project).first()
-    else:
-        access = None
+@register.simple_tag(takes_context=True)
+def access_color(context, user, project):
+    request = context.get("request")
+    access = auth.get_access_level(user=user, project=project, request=request)
 
-    if access and access.access == Access.WRITE_ACCESS:
+    if access == Access.WRITE_ACCESS:
         return "green"
     else:
         return ""
@@ -299,6 +292,14 @@ def size_label(data):
     return mark_safe(f"<span class='ui mini label'>{size}</span>")
 
 
+@register.inclusion_tag('widgets/data_stats.html')
+def data_stats(data):
+    """
+    Renders the file statistics of a data.
+    """
+    return dict(stats=data.stats_data)
+
+
 @register.inclusion_tag('widgets/directory_list.html', takes_context=True)
 def directory_list(context, obj):
     """
@@ -312,6 +313,9 @@ def directory_list(context, obj):
     serve_url = "job_serve" if isinstance(obj, Job) else "data_serve"
     copy_url = "job_file_copy" if isinstance(obj, Job) else "data_file_copy"
 
+    # Files in archived jobs are listed from the archive index.
+    archived = isinstance(obj, Job) and obj.is_archived()
+
     # This will collet the valid filepaths.
     paths = []
     try:
@@ -326,6 +330,9 @@ def directory_list(context, obj):
             tstamp = os.stat(path).st_mtime
             size = os.stat(path).st_size
             rel_path = os.path.relpath(path, root)
+            return describe(rel_path, tstamp, size)
+
+        def describe(rel_path, tstamp, size):
             elems = os.path.split(rel_path)
             dir_names = elems[:-1]
             if dir_names[0] == '':
@@ -337,6 +344,10 @@ def directory_list(context, obj):
         # Transform the paths.
         paths = map(transform, paths)
 
+        if archived:
+            index = archive.get_index(obj.get_archive_path())
+            paths = [describe(info.filename, archive.member_mtime(info), info.file_size) for info in index.values()]
+
         # Sort by the tuple fields..
         paths = sorted(paths)
 
@@ -344,7 +355,8 @@ def directory_list(context, obj):
         logging.error(exc)
         paths = []
 
-    return dict(paths=paths, obj=obj, serve_url=serve_url, copy_url=copy_url, user=context["request"].user)
+    return dict(paths=paths, obj=obj, serve_url=serve_url, copy_url=copy_url, can_copy=not archived,
+                user=context["request"].user)
 
 
 @register.inclusion_tag('widgets/form_errors.html')
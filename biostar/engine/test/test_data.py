@@ -1,11 +1,14 @@
 import logging
 import os
+import shutil
+import tempfile
 from unittest.mock import patch, MagicMock
 
 from django.test import TestCase, override_settings
 from django.urls import reverse
 
-from biostar.engine import models, views, auth, const
+from biostar.engine import models, views, auth, const, stats
+from biostar.engine.util import stream_extract, parse_range
 from . import util
 from django.conf import settings
 
@@ -103,6 +106,121 @@ class DataViewTest(TestCase):
         self.process_response(response=response, data={})
         self.process_response(response=clear_response, data={})
 
+    def test_data_unpack(self):
+        "Test streaming extraction of a tar.gz data"
+
+        path = auth.join(__file__, "..", "data", "test.tar.gz")
+        data = auth.create_data(project=self.project, path=path, name="archive")
+
+        self.assertTrue(data.can_unpack(), "tar.gz data should be unpackable")
+
+        url = reverse('data_unpack', kwargs=dict(uid=data.uid))
+        request = util.fake_request(url=url, data={}, method="GET", user=self.owner)
+        response = views.data_unpack(request=request, uid=data.uid)
+
+        self.process_response(response=response, data={})
+
+        data = models.Data.objects.get(pk=data.pk)
+        names = [os.path.relpath(p, data.get_data_dir()) for p in data.get_files()]
+
+        self.assertTrue("test/testfile" in names, f"Extracted file not in table of contents: {names}")
+        self.assertEqual(data.state, models.Data.READY)
+
+    def test_unpack_links(self):
+        "Test extraction replaces linked files and skips linked directories"
+        import tarfile
+        from io import BytesIO
+
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        dest, outside = os.path.join(root, "dest"), os.path.join(root, "outside")
+        os.makedirs(dest)
+        os.makedirs(outside)
+
+        external = os.path.join(outside, "linked.txt")
+        with open(external, "wt") as fp:
+            fp.write("external")
+        os.symlink(external, os.path.join(dest, "linked.txt"))
+        os.symlink(outside, os.path.join(dest, "folder"))
+
+        archive = os.path.join(root, "archive.tar.gz")
+        with tarfile.open(archive, "w:gz") as tar:
+            for name in ("linked.txt", "folder/new.txt"):
+                info = tarfile.TarInfo(name=name)
+                info.size = len(b"archive")
+                tar.addfile(info, BytesIO(b"archive"))
+
+        paths = [path for path, pos in stream_extract(fname=archive, dest=dest)]
+
+        self.assertEqual(paths, [os.path.join(dest, "linked.txt")])
+        self.assertFalse(os.path.islink(paths[0]))
+        self.assertEqual(open(external).read(), "external")
+        self.assertFalse(os.path.exists(os.path.join(outside, "new.txt")))
+
+    def test_data_serve_range(self):
+        "Test byte range and conditional requests when serving data files"
+
+        fname = os.path.basename(__file__)
+        url = reverse('data_serve', kwargs=dict(uid=self.data.uid, path=fname))
+        content = open(__file__, 'rb').read()
+
+        request = util.fake_request(url=url, data={}, method="GET", user=self.owner)
+        request.META['HTTP_RANGE'] = 'bytes=10-19'
+        response = views.data_serve(request=request, uid=self.data.uid, path=fname)
+
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b"".join(response.streaming_content), content[10:20])
+
+        request = util.fake_request(url=url, data={}, method="GET", user=self.owner)
+        request.META['HTTP_IF_NONE_MATCH'] = response['ETag']
+        response = views.data_serve(request=request, uid=self.data.uid, path=fname)
+
+        self.assertEqual(response.status_code, 304)
+
+        # Files of sibling directories are not served.
+        sibling = self.data.get_data_dir() + "x"
+        os.makedirs(sibling, exist_ok=True)
+        self.addCleanup(shutil.rmtree, sibling)
+        shutil.copy(__file__, sibling)
+        path = f"../{os.path.basename(sibling)}/{fname}"
+        request = util.fake_request(url=url, data={}, method="GET", user=self.owner)
+        response = views.data_serve(request=request, uid=self.data.uid, path=path)
+        self.assertEqual(response.status_code, 302)
+
+        # No range of an empty file can be satisfied.
+        self.assertEqual(parse_range("bytes=-5", size=10), (5, 9))
+        for header in ("bytes=-5", "bytes=0-", "bytes=0-0"):
+            with self.assertRaises(ValueError):
+                parse_range(header, size=0)
+
+    def test_usage_counters(self):
+        "Test the storage counters follow data creation and deletion"
+        from io import BytesIO
+        from django.core import management
+
+        stream = BytesIO(b"ACGT" * 100)
+        stream.name = "upload.txt"
+        data = auth.create_data(project=self.project, user=self.owner, stream=stream)
+
+        profile = models.Profile.objects.get(user=self.owner)
+        project = models.Project.objects.get(pk=self.project.pk)
+
+        self.assertEqual(profile.data_size, 400)
+        self.assertEqual(project.data_size, self.data.size + 400)
+
+        data.deleted = True
+        data.save()
+
+        profile = models.Profile.objects.get(user=self.owner)
+        self.assertEqual(profile.data_size, 0)
+
+        # The reconcile command restores damaged counters.
+        models.Profile.objects.filter(user=self.owner).update(data_size=12345)
+        management.call_command('usage')
+
+        profile = models.Profile.objects.get(user=self.owner)
+        self.assertEqual(profile.data_size, 0)
+
     def process_response(self, response, data, save=False):
         "Check the response on POST request is redirected"
 
@@ -110,4 +228,42 @@ class DataViewTest(TestCase):
                          f"Could not redirect to project view after testing :\nresponse:{response}")
 
         if save:
-            self.assertTrue( models.Data.save.called, "save() method not called")
\ No newline at end of file
+            self.assertTrue( models.Data.save.called, "save() method not called")
+
+class DataStatsTest(TestCase):
+
+    def setUp(self):
+        logger.setLevel(logging.WARNING)
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def write(self, fname, text):
+        path = os.path.join(self.root, fname)
+        with open(path, 'wt') as fp:
+            fp.write(text)
+        return path
+
+    def test_fastq_stats(self):
+        "Test FASTQ statistics across buffer boundaries"
+
+        path = self.write("stats.fq", "@r1\nACGT\n+\nIIII\n@r2\nGGCCAA\n+\n555555\n")
+
+        with patch.object(stats, 'BUFFER_SIZE', 7):
+            result = stats.compute_stats(path)
+
+        self.assertEqual(result['count'], 2)
+        self.assertEqual(result['bases'], 10)
+        self.assertEqual(result['gc'], 60.0)
+        self.assertEqual(result['max_len'], 6)
+
+    def test_fasta_stats(self):
+        "Test FASTA statistics with multi-line records"
+
+        path = self.write("stats.fa", ">r1\nACGT\nAC\n>r2\nGG\n")
+        result = stats.compute_stats(path)
+
+        self.assertEqual(result['count'], 2)
+        self.assertEqual(result['bases'], 8)
+        self.assertEqual(result['n50'], 6)
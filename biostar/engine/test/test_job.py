@@ -1,4 +1,6 @@
 import logging,os
+import shutil
+import tempfile
 from django.test import TestCase, override_settings
 from unittest.mock import patch, MagicMock
 from django.core import management
@@ -71,6 +73,239 @@ class JobViewTest(TestCase):
         self.assertTrue(isinstance(response, FileResponse), "Response is not a file.")
 
 
+    def test_job_download(self):
+        "Test streaming the job directory as an archive."
+        import io, zipfile
+
+        import tarfile
+
+        management.call_command('job', id=self.job.id)
+
+        # Dangling links are left out of the archive.
+        os.symlink(os.path.join(self.job.get_data_dir(), "missing"), os.path.join(self.job.get_data_dir(), "broken"))
+
+        url = reverse('job_download', kwargs=dict(uid=self.job.uid))
+
+        request = util.fake_request(url=url, data={"format": "zip"}, method="GET", user=self.owner)
+
+        response = views.job_download(request=request, uid=self.job.uid)
+
+        content = b"".join(response.streaming_content)
+        names = zipfile.ZipFile(io.BytesIO(content)).namelist()
+
+        self.assertTrue("runlog/input.json" in names, f"Missing file in archive: {names}")
+        self.assertFalse("broken" in names, f"Dangling link in archive: {names}")
+
+        request = util.fake_request(url=url, data={"format": "tar"}, method="GET", user=self.owner)
+
+        response = views.job_download(request=request, uid=self.job.uid)
+
+        content = b"".join(response.streaming_content)
+        names = tarfile.open(fileobj=io.BytesIO(content)).getnames()
+
+        self.assertTrue("runlog/input.json" in names, f"Missing file in archive: {names}")
+        self.assertFalse("broken" in names, f"Dangling link in archive: {names}")
+
+    def test_job_download_path(self):
+        "Test only subdirectories of the job can be downloaded"
+
+        job = self.use_temp_storage()
+        sibling = job.get_data_dir() + "x"
+        os.makedirs(os.path.join(job.get_data_dir(), "results"))
+        os.makedirs(sibling)
+
+        url = reverse('job_download', kwargs=dict(uid=job.uid))
+
+        for path, code in (("results", 200), (f"../{job.uid}x", 302)):
+            request = util.fake_request(url=url, data={"path": path}, method="GET", user=self.owner)
+            response = views.job_download(request=request, uid=job.uid)
+            self.assertEqual(response.status_code, code, path)
+
+        # Archived results are not split.
+        models.Job.objects.filter(pk=job.pk).update(storage=models.Job.ARCHIVED)
+        request = util.fake_request(url=url, data={"path": "results"}, method="GET", user=self.owner)
+        response = views.job_download(request=request, uid=job.uid)
+        self.assertEqual(response.status_code, 302)
+
+    def use_temp_storage(self):
+        "Points the storage locations to a temporary directory."
+        root = tempfile.mkdtemp()
+        paths = dict(MEDIA_ROOT=root, TOC_ROOT=os.path.join(root, "tocs"),
+                     JOB_ARCHIVE_ROOT=os.path.join(root, "archive"))
+
+        # The models read the settings module directly.
+        for ctx in (override_settings(**paths), patch.multiple(models.settings, **paths)):
+            ctx.__enter__()
+            self.addCleanup(ctx.__exit__, None, None, None)
+
+        self.addCleanup(shutil.rmtree, root, True)
+
+        return auth.create_job(analysis=self.recipe, user=self.owner)
+
+    def test_job_summary(self):
+        "Test the job summary is rendered on save, not on display"
+
+        json_text = '{reads: {label: "Reads", value: "sample.fq"}}'
+        job = auth.create_job(analysis=self.recipe, user=self.owner, json_text=json_text)
+        self.assertIn("sample.fq", job.summary_html)
+
+        job = models.Job.objects.get(pk=job.pk)
+        with patch('biostar.engine.models.loader.get_template') as get_template:
+            self.assertIn("sample.fq", job.summary)
+            job.state = models.Job.COMPLETED
+            job.save()
+            self.assertFalse(get_template.called)
+
+        job.json_text = '{reads: {label: "Reads", value: "other.fq"}}'
+        job.save()
+        self.assertIn("other.fq", models.Job.objects.get(pk=job.pk).summary)
+
+    def test_job_status(self):
+        "Test the status channel returns the jobs changed since a version"
+        import json
+        from biostar.utils.queries import record_queries
+
+        url = reverse('job_status', kwargs=dict(uid=self.project.uid))
+        status = lambda since: json.loads(views.job_status(util.fake_request(
+            url=url, data=dict(since=since), user=self.owner, method="GET"), uid=self.project.uid).content)
+
+        version = models.Project.objects.get(pk=self.project.pk).job_version
+        self.assertEqual(status(version), dict(version=version, jobs=[], interval=settings.JOB_STATUS_INTERVAL))
+
+        # Versions ahead of the project are answered at once.
+        with record_queries() as recorder:
+            self.assertEqual(status(version + 1000)["jobs"], [])
+        self.assertLessEqual(recorder.count, 5)
+
+        models.set_job_state(models.Job.objects.filter(pk=self.job.pk), models.Job.RUNNING)
+
+        changed = status(version)
+        self.assertEqual(changed["version"], version + 1)
+        self.assertEqual([job["uid"] for job in changed["jobs"]], [self.job.uid])
+        self.assertIn("Running", changed["jobs"][0]["html"])
+
+        # Saves without a state change are not published.
+        job = models.Job.objects.get(pk=self.job.pk)
+        job.name = "Renamed"
+        job.save()
+        self.assertEqual(status(changed["version"])["jobs"], [])
+
+    def test_job_api(self):
+        "Test submitting a job, polling the state of many jobs and listing the outputs through the API"
+
+        job = self.use_temp_storage()
+        management.call_command('job', id=job.id)
+
+        url = reverse('recipe_api_run', kwargs=dict(uid=self.recipe.uid))
+        self.assertIn("error", self.client.post(url).json())
+
+        response = self.client.post(url, dict(k=settings.API_KEY))
+        self.assertEqual(response.status_code, 201)
+        submitted = response.json()
+        self.assertEqual(submitted["state"], "Queued")
+
+        url = reverse('job_api_status')
+        uids = ",".join([job.uid, submitted["uid"], "missing"])
+        with self.assertNumQueries(1):
+            response = self.client.get(url, dict(uids=uids, k=settings.API_KEY))
+        states = response.json()
+        self.assertEqual(states["jobs"][job.uid]["state"], "Completed")
+        self.assertFalse(states["jobs"][submitted["uid"]]["finished"])
+        self.assertEqual(states["missing"], ["missing"])
+
+        self.assertEqual(self.client.get(url, dict(uids=uids)).status_code, 403)
+
+        url = reverse('job_api_files', kwargs=dict(uid=job.uid))
+        manifest = self.client.get(url, dict(k=settings.API_KEY)).json()
+        paths = {item["path"]: item for item in manifest["files"]}
+        self.assertIn("runlog/input.json", paths)
+        self.assertEqual(paths["runlog/input.json"]["url"],
+                         reverse('job_serve', kwargs=dict(uid=job.uid, path="runlog/input.json")))
+
+    def test_job_archive(self):
+        "Test moving a job into cold storage and serving files from the archive."
+        from django.utils import timezone
+
+        from biostar.engine import archive, const
+
+        job = self.use_temp_storage()
+        management.call_command('job', id=job.id)
+
+        # Links to data stored elsewhere are kept in the archive.
+        external = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, external, True)
+        with open(os.path.join(external, "reads.fq"), "w") as fp:
+            fp.write("ACGT")
+        os.symlink(os.path.join(external, "reads.fq"), os.path.join(job.get_data_dir(), "reads.fq"))
+        os.symlink(external, os.path.join(job.get_data_dir(), "inputs"))
+
+        # Make the job old enough for the policy.
+        models.Job.objects.filter(id=job.id).update(end_date=timezone.now() - timezone.timedelta(days=10))
+        management.call_command('archive', days=5, purge_days=0)
+
+        job = models.Job.objects.get(id=job.id)
+        self.assertTrue(job.is_archived(), "Job was not archived")
+        self.assertFalse(os.path.isdir(job.get_data_dir()), "Job directory was not removed")
+        self.assertEqual(job.size, os.path.getsize(job.get_archive_path()))
+
+        path = "runlog/input.json"
+        url = reverse('job_serve', kwargs=dict(uid=job.uid, path=path))
+        request = util.fake_request(url=url, data={}, method="GET", user=self.owner)
+        response = views.job_serve(request=request, uid=job.uid, path=path)
+
+        content = b"".join(response.streaming_content)
+        self.assertEqual(len(content), int(response['Content-Length']))
+
+        fname = job.get_archive_path()
+        self.assertIn("reads.fq", archive.listdir(fname))
+        self.assertEqual(archive.listdir(fname, "inputs"), ["reads.fq"])
+        self.assertEqual(b"".join(archive.read_member(fname, "inputs/reads.fq")), b"ACGT")
+
+        # Archived results can not be copied into data.
+        url = reverse('job_file_copy', kwargs=dict(uid=job.uid, path=path))
+        request = util.fake_request(url=url, data={}, method="GET", user=self.owner)
+        views.job_file_copy(request=request, uid=job.uid, path=path)
+        self.assertNotIn(settings.CLIPBOARD_NAME, request.session)
+
+        url = reverse('data_paste', kwargs=dict(uid=self.project.uid))
+        request = util.fake_request(url=url, data={"board": const.RESULTS_CLIPBOARD}, method="GET", user=self.owner)
+        request.session[settings.CLIPBOARD_NAME] = {const.RESULTS_CLIPBOARD: [job.uid]}
+        count = models.Data.objects.count()
+        views.data_paste(request=request, uid=self.project.uid)
+        self.assertEqual(models.Data.objects.count(), count)
+
+        # The retention policy removes the outputs.
+        management.call_command('archive', days=0, purge_days=5)
+        job = models.Job.objects.get(id=job.id)
+        self.assertTrue(job.is_purged(), "Job was not purged")
+        self.assertFalse(os.path.isfile(job.get_archive_path()), "Archive was not removed")
+        self.assertEqual(job.size, 0)
+
+    def test_cleanup(self):
+        "Test removing deleted jobs and orphan files."
+
+        job = self.use_temp_storage()
+
+        # A table of contents without a data row.
+        os.makedirs(settings.TOC_ROOT, exist_ok=True)
+        orphan = os.path.join(settings.TOC_ROOT, "toc-orphan.txt")
+        open(orphan, 'w').close()
+
+        path = job.get_data_dir()
+        models.Job.objects.filter(id=job.id).update(deleted=True)
+
+        management.call_command('cleanup', dry=True, grace=0)
+        self.assertTrue(os.path.isdir(path), "Dry run removed files")
+
+        management.call_command('cleanup', grace=0, workers=2, batch=1)
+
+        self.assertFalse(models.Job.objects.get_all(id=job.id).exists(), "Job row was not deleted")
+        self.assertFalse(os.path.exists(path), "Job directory was not removed")
+        self.assertFalse(os.path.exists(orphan), "Orphan table of contents was not removed")
+
+        # Paths that are already gone do not stop the cleanup.
+        management.call_command('cleanup', grace=0)
+
     def process_response(self, response, data, save=False):
         "Check the response on POST request is redirected"
 
@@ -1,4 +1,6 @@
 import logging, os
+from io import BytesIO
+
 from django.test import TestCase
 from django.test import Client
 from biostar.engine import auth
@@ -7,6 +9,9 @@ from django.conf import settings
 
 from django.urls import reverse
 
+from biostar.engine.management.commands import benchmark
+from biostar.utils.queries import QueryBudgetMixin
+
 
 logger = logging.getLogger('engine')
 
@@ -96,3 +101,75 @@ class SiteNavigation(TestCase):
 
 
 
+
+
+class QueryBudget(QueryBudgetMixin, TestCase):
+
+    def setUp(self):
+        logger.setLevel(logging.WARNING)
+
+        self.owner = models.User.objects.create(username="test", email="test@test.com")
+        self.owner.set_password("testing")
+        self.owner.save()
+
+        self.project = auth.create_project(user=self.owner, name="Test project",
+                                           privacy=models.Project.PUBLIC, uid="testing")
+        self.client.login(username="test", password="testing")
+
+    def add_content(self, count):
+        "Adds projects, data, recipes and results"
+        for step in range(count):
+            project = auth.create_project(user=self.owner, name=f"Project {step}", privacy=models.Project.PUBLIC)
+            for target in (project, self.project):
+                stream = BytesIO(b"data")
+                stream.name = f"data-{step}.txt"
+                auth.create_data(project=target, stream=stream)
+                recipe = auth.create_analysis(project=target, json_text='{}', template="")
+                auth.create_job(analysis=recipe)
+
+    def page_queries(self, url):
+        with self.assertMaxQueries(settings.QUERY_BUDGET, label=url) as recorder:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, f"{url} returned {response.status_code}")
+        return recorder.count
+
+    def test_page_budgets(self):
+        "Checking that the queries of the main pages do not grow with the rows"
+
+        params = dict(uid=self.project.uid)
+        urls = [
+            reverse('project_list'),
+            reverse('data_list', kwargs=params),
+            reverse('recipe_list', kwargs=params),
+            reverse('job_list', kwargs=params),
+            reverse('project_api_list'),
+            reverse('recipe_api_list'),
+        ]
+
+        self.add_content(1)
+        before = {url: self.page_queries(url) for url in urls}
+
+        self.add_content(5)
+        after = {url: self.page_queries(url) for url in urls}
+
+        for url in urls:
+            self.assertLessEqual(after[url], before[url], f"{url} runs {after[url] - before[url]} more queries")
+
+    def test_report_headers(self):
+        "Checking the query report headers"
+
+        with self.settings(QUERY_BUDGET_REPORT=True):
+            response = self.client.get(reverse('project_list'))
+
+        self.assertTrue(int(response["X-Query-Count"]) > 0)
+        self.assertIn("X-Query-Time", response)
+        self.assertEqual(response["X-Query-Duplicates"], "0")
+
+    def test_benchmark(self):
+        "Checking the benchmark visits every view"
+        users = benchmark.seed(users=2, projects=1, data=1, recipes=1, jobs=1, posts=3)
+        results = benchmark.run(users, benchmark.targets(), requests=1, threads=1)
+        rows = benchmark.summarize(results)
+
+        self.assertEqual(len(rows), 6)
+        self.assertTrue(all(row['errors'] == 0 and row['queries'] > 0 for row in rows))
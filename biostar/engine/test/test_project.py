@@ -107,6 +107,172 @@ class ProjectViewTest(TestCase):
         # Error generating users access forms ( forms.access_forms).
         self.assertTrue(len(users) ==len(user_forms))
 
+    def test_project_counts(self):
+        "Test the object counters follow creation and deletion"
+        from io import BytesIO
+        from django.core import management
+        from biostar.forum.auth import create_post
+        from biostar.forum.models import Post
+
+        stream = BytesIO(b"ACGT")
+        stream.name = "upload.txt"
+        data = auth.create_data(project=self.project, user=self.owner, stream=stream)
+        recipe = auth.create_analysis(project=self.project, json_text="{}", template="")
+        auth.create_job(analysis=recipe, user=self.owner)
+        create_post(title="Topic", author=self.owner, content="Text", post_type=Post.FORUM, project=self.project)
+
+        counts = models.Project.objects.get(pk=self.project.pk).get_counts()
+        self.assertEqual(counts, dict(data_count=1, recipe_count=1, result_count=1, discussion_count=1))
+
+        data.deleted = True
+        data.save()
+
+        project = models.Project.objects.get(pk=self.project.pk)
+        self.assertEqual(project.data_count, 0)
+
+        # The rebuild restores damaged counters.
+        models.Project.objects.filter(pk=self.project.pk).update(recipe_count=10, discussion_count=0)
+        management.call_command('usage')
+
+        counts = models.Project.objects.get(pk=self.project.pk).get_counts()
+        self.assertEqual(counts, dict(data_count=0, recipe_count=1, result_count=1, discussion_count=1))
+
+    @override_settings(ACCESS_CACHE_SECONDS=60)
+    def test_access_resolver(self):
+        "Test the access map is loaded once per request and cached in the session"
+
+        user = models.User.objects.create_user(username="reader", email="reader@l.com")
+        models.Access.objects.create(user=user, project=self.project, access=models.Access.READ_ACCESS)
+
+        request = util.fake_request(url="/", data={}, user=user, method="GET")
+
+        with self.assertNumQueries(1):
+            self.assertTrue(auth.has_read_access(user=user, project=self.project, request=request))
+            self.assertFalse(auth.has_write_access(user=user, project=self.project, request=request))
+
+        # A new request in the same session reuses the stored copy.
+        second = util.fake_request(url="/", data={}, user=user, method="GET")
+        second.session = request.session
+        with self.assertNumQueries(0):
+            self.assertTrue(auth.has_read_access(user=user, project=self.project, request=second))
+
+        # Changing the access invalidates the stored copy.
+        access = models.Access.objects.get(user=user, project=self.project)
+        access.access = models.Access.WRITE_ACCESS
+        access.save()
+
+        third = util.fake_request(url="/", data={}, user=user, method="GET")
+        third.session = request.session
+        self.assertTrue(auth.has_write_access(user=user, project=self.project, request=third))
+
+    def test_project_visibility(self):
+        "Test the visibility table follows access and privacy changes"
+        from django.contrib.auth.models import AnonymousUser
+
+        user = models.User.objects.create_user(username="viewer", email="viewer@l.com")
+        visible = lambda u, **kwargs: self.project in auth.get_project_list(user=u, **kwargs)
+
+        self.assertTrue(visible(self.owner, include_public=False))
+        self.assertFalse(visible(user))
+
+        access = models.Access.objects.create(user=user, project=self.project, access=models.Access.READ_ACCESS)
+        self.assertTrue(visible(user, include_public=False))
+
+        access.delete()
+        self.assertFalse(visible(user))
+
+        self.project.privacy = models.Project.PUBLIC
+        self.project.save()
+        self.assertTrue(visible(user))
+        self.assertTrue(visible(AnonymousUser()))
+        self.assertFalse(visible(user, include_public=False))
+
+    @override_settings(LIST_ITEMS_PER_PAGE=2)
+    def test_recipe_pages(self):
+        "Test the recipe list is paged by cursor with sticky recipes first"
+        from biostar.engine import paging
+
+        recipes = [auth.create_analysis(project=self.project, json_text="{}", template="", name=f"Recipe {i}")
+                   for i in range(5)]
+        models.Analysis.objects.filter(pk=recipes[0].pk).update(sticky=True)
+
+        seen, cursor = [], ''
+        while True:
+            page = paging.get_page(self.project.analysis_set.all(), cursor=cursor, size=2)
+            seen.extend(recipe.pk for recipe in page)
+            if not page.has_next:
+                break
+            cursor = page.cursor
+
+        self.assertEqual(seen[0], recipes[0].pk)
+        self.assertEqual(sorted(seen), sorted(recipe.pk for recipe in recipes))
+
+        url = reverse('recipe_list', kwargs=dict(uid=self.project.uid))
+        request = util.fake_request(url=url, data={}, user=self.owner, method="GET")
+        response = views.recipe_list(request=request, uid=self.project.uid)
+        self.assertContains(response, "load-more")
+
+        # Invalid cursors start from the beginning.
+        page = paging.get_page(self.project.analysis_set.all(), cursor="invalid", size=2)
+        self.assertEqual(page.items[0].pk, recipes[0].pk)
+
+    def test_search_index(self):
+        "Test the search index follows changes and respects the visibility"
+        from biostar.engine import search
+
+        user = models.User.objects.create_user(username="finder", email="finder@l.com")
+        recipe = auth.create_analysis(project=self.project, json_text="{}", template="",
+                                      name="Variant calling", text="Align reads with <bwa> first")
+
+        find = lambda u, q: [hit.obj for hit in search.search(util.fake_request(url="/", data=dict(q=q),
+                                                                                   user=u, method="GET"))]
+
+        self.assertEqual(find(self.owner, "variant"), [recipe])
+        self.assertEqual(find(user, "variant"), [])
+
+        hit = search.search(util.fake_request(url="/", data=dict(q="bwa"), user=self.owner, method="GET"))[0]
+        self.assertIn('<span class="match">bwa</span>', hit.snippet)
+        self.assertIn("&lt;", hit.snippet)
+
+        recipe.name = "Peak calling"
+        recipe.save()
+        self.assertEqual(find(self.owner, "variant"), [])
+        self.assertEqual(find(self.owner, "peak"), [recipe])
+
+        recipe.deleted = True
+        recipe.save()
+        self.assertEqual(find(self.owner, "peak"), [])
+
+    def test_search_rebuild_postgres(self):
+        "Test the PostgreSQL rebuild fills the documents of the index"
+        from django.db import connection
+        from biostar.engine import fulltext
+
+        recipe = auth.create_analysis(project=self.project, json_text="{}", template="",
+                                      name=f"Variant {fulltext.MARK_START}calling", text="Align reads")
+
+        # The text search functions of PostgreSQL, emulated in SQLite.
+        with connection.cursor() as cursor:
+            connection.connection.create_function("to_tsvector", 2, lambda config, text: text)
+            connection.connection.create_function("setweight", 2, lambda vector, weight: f"{vector}:{weight} ")
+            cursor.execute(f"DROP TABLE {fulltext.TABLE}")
+            cursor.execute(f"""
+                CREATE TABLE {fulltext.TABLE} (
+                    id bigint PRIMARY KEY, project_id integer NOT NULL,
+                    name text NOT NULL, text text NOT NULL, owner text NOT NULL,
+                    document tsvector NOT NULL)""")
+
+        with patch.object(fulltext, "is_postgres", return_value=True):
+            fulltext.rebuild(connection)
+
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT name, document FROM {fulltext.TABLE} WHERE id = %s",
+                           [fulltext.row_id("analysis", recipe.id)])
+            name, document = cursor.fetchone()
+
+        self.assertEqual(name, "Variant calling")
+        self.assertTrue(document.startswith("Variant calling:A Align reads:B "), document)
+
     def process_response(self, response, data, save=False):
         "Check the response on POST request is redirected"
 
@@ -1,7 +1,12 @@
 import logging
+import os
+import shutil
+import tempfile
+
 import hjson
 
-from django.test import TestCase, RequestFactory
+from django.core import management
+from django.test import TestCase, LiveServerTestCase, RequestFactory
 from unittest.mock import patch, MagicMock
 from django.urls import reverse
 from django.conf import settings
@@ -127,6 +132,77 @@ class RecipeViewTest(TestCase):
 
         self.assertEqual(changed.uid, self.recipe.uid)
 
+    def test_recipe_code_search(self):
+        "Test the code search finds substrings and expressions in visible recipes"
+        from django.db import DatabaseError
+        from biostar.engine import codesearch, search
+
+        self.recipe.template = "bwa mem -t 4 {{reads.value}} > out.sam"
+        self.recipe.save()
+
+        other = models.User.objects.create_user(username="other", email="other@l.com")
+        hidden = auth.create_project(user=other, name="hidden", uid="hidden")
+        auth.create_analysis(project=hidden, json_text="{}", template="bwa mem ref.fa")
+
+        self.assertEqual(codesearch.literals(r"bwa\s+mem -t"), ["bwa", "mem -t"])
+
+        projects = auth.get_project_list(user=self.owner)
+        self.assertEqual(codesearch.query("BWA MEM", projects=projects, limit=10), [self.recipe.id])
+        self.assertEqual(codesearch.query(r"mem -t \d", projects=projects, limit=10, regex=True), [self.recipe.id])
+        self.assertEqual(codesearch.query(r"mem -t [a-z]", projects=projects, limit=10, regex=True), [])
+
+        # Expressions without an indexed literal would scan every recipe.
+        for pattern in (r"(a+)+$", r".*x"):
+            with self.assertRaises(ValueError):
+                codesearch.query(pattern, projects=projects, limit=10, regex=True)
+            form = search.CodeSearchForm(data=dict(q=pattern, regex=True))
+            self.assertFalse(form.is_valid(), pattern)
+
+        url = reverse('recipe_search')
+        request = util.fake_request(url=url, data=dict(q="out.sam"), user=self.owner, method="GET")
+        response = views.recipe_search(request=request)
+        self.assertContains(response, '<span class="match">out.sam</span>')
+
+        # Expressions the database rejects show a message.
+        request = util.fake_request(url=url, data=dict(q="mem -t", regex=True), user=self.owner, method="GET")
+        with patch.object(codesearch, "query", side_effect=DatabaseError("invalid regular expression")):
+            response = views.recipe_search(request=request)
+        self.assertEqual(response.status_code, 200)
+
+        self.recipe.template = "samtools sort"
+        self.recipe.save()
+        self.assertEqual(codesearch.query("bwa mem", projects=projects, limit=10), [])
+
+    def test_recipe_api_list(self):
+        "Test the recipe API list is paginated and answers unchanged pages with 304"
+
+        for step in range(2):
+            auth.create_analysis(project=self.project, json_text="{}", template="", name=f"recipe {step}")
+
+        url = reverse('recipe_api_list')
+        params = dict(k=settings.API_KEY)
+
+        with self.settings(API_ITEMS_PER_PAGE=2):
+            response = self.client.get(url, params)
+            first = response.json()
+            self.assertEqual(len(first["results"]), 2)
+            self.assertTrue(first["next"])
+            self.assertEqual(first["results"][self.recipe.uid]["json"],
+                             reverse('recipe_api_json', kwargs=dict(uid=self.recipe.uid)))
+
+            last = self.client.get(first["next"]).json()
+            self.assertEqual(len(last["results"]), 1)
+            self.assertIsNone(last["next"])
+
+            etag = response["ETag"]
+            response = self.client.get(url, params, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+
+            self.recipe.name = "changed"
+            self.recipe.save()
+            response = self.client.get(url, params, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+
     def process_response(self, response, data, model=models.Analysis,save=False):
         "Check the response on POST request is redirected"
 
@@ -135,3 +211,67 @@ class RecipeViewTest(TestCase):
 
         if save:
             self.assertTrue( model.save.called, "save() method not called when editing.")
+
+
+class RecipeSyncTest(LiveServerTestCase):
+
+    def setUp(self):
+        logger.setLevel(logging.WARNING)
+
+        self.owner = models.User.objects.create_user(username="test", email="test@l.com")
+        self.project = auth.create_project(user=self.owner, name="test", uid="testing")
+        self.recipe = auth.create_analysis(project=self.project, json_text="{}", template="echo hello")
+
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, True)
+
+    def test_recipe_sync(self):
+        "Test exporting and importing the recipes of a project as one archive"
+
+        # The project is private, it is only listed with the API key.
+        management.call_command("api_import", base=self.live_server_url, key=settings.API_KEY, output=self.root)
+
+        project_dir = os.path.join(self.root, self.project.uid)
+        recipe_dir = os.path.join(project_dir, self.recipe.uid)
+        self.assertEqual(open(os.path.join(recipe_dir, "template.sh")).read(), "echo hello")
+
+        # Change the recipe and add a new one.
+        open(os.path.join(recipe_dir, "template.sh"), "w").write("echo changed")
+        os.makedirs(os.path.join(project_dir, "synced"))
+        open(os.path.join(project_dir, "synced", "json.hjson"), "w").write('{settings: {name: "Synced"}}')
+        open(os.path.join(project_dir, "synced", "template.sh"), "w").write("echo synced")
+
+        management.call_command("api_export", f"--key={settings.API_KEY}", base=self.live_server_url, project=project_dir)
+
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.template, "echo changed")
+
+        synced = models.Analysis.objects.get(uid="synced")
+        self.assertEqual((synced.project, synced.name, synced.template), (self.project, "Synced", "echo synced"))
+
+        # Private archives require the key.
+        url = reverse("project_api_recipes", kwargs=dict(uid=self.project.uid))
+        self.assertIn("error", self.client.get(url).json())
+
+    def test_recipe_export_single(self):
+        "Test exporting a recipe from a directory that is not named after its project"
+
+        recipe_dir = os.path.join(self.root, self.recipe.uid)
+        os.makedirs(recipe_dir)
+        open(os.path.join(recipe_dir, "template.sh"), "w").write("echo single")
+
+        management.call_command("api_export", f"--key={settings.API_KEY}", base=self.live_server_url,
+                                recipe=recipe_dir)
+
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.template, "echo single")
+
+    def test_archive_uids(self):
+        "Test archive members with invalid uids are skipped"
+        from io import BytesIO
+        from biostar.engine import bundle
+
+        recipes = [("..", {"template.sh": b"echo escaped"}), ("valid", {"template.sh": b"echo"})]
+        archive = BytesIO(b"".join(bundle.stream_archive("testing", recipes)))
+
+        self.assertEqual(list(bundle.read_archive(archive)), ["valid"])
@@ -21,6 +21,7 @@ urlpatterns = [
     url(r'^project/list/private/$', views.project_list_private, name='project_list_private'),
     url(r'^project/list/public/$', views.project_list, name='project_list_public'),
     url(r'^project/delete/(?P<uid>[-\w]+)/$', views.project_delete, name='project_delete'),
+    url(r'^project/status/(?P<uid>[-\w]+)/$', views.job_status, name='job_status'),
 
     # Data
     url(r'^data/list/(?P<uid>[-\w]+)/$', views.data_list, name='data_list'),
@@ -30,6 +31,8 @@ urlpatterns = [
     url(r'^data/serve/(?P<uid>[-\w]+)/(?P<path>.+)$', views.data_serve, name='data_serve'),
     url(r'^data/paste/(?P<uid>[-\w]+)/$', views.data_paste, name='data_paste'),
     url(r'^data/delete/(?P<uid>[-\w]+)/$', views.data_delete, name='data_delete'),
+    url(r'^data/unpack/(?P<uid>[-\w]+)/$', views.data_unpack, name='data_unpack'),
+    url(r'^data/download/(?P<uid>[-\w]+)/$', views.data_download, name='data_download'),
 
     # Recipes
     url(r'^recipe/list/(?P<uid>[-\w]+)/$', views.recipe_list, name='recipe_list'),
@@ -47,6 +50,7 @@ urlpatterns = [
     url(r'^action/subscribe/(?P<uid>[-\w]+)/$', views.discussion_subs, name='discussion_subs'),
 
     url(r"^search/$", views.search_bar, name='search'),
+    url(r"^search/code/$", views.recipe_search, name='recipe_search'),
 
 
     # Jobs
@@ -55,12 +59,17 @@ urlpatterns = [
     url(r'^job/edit/(?P<uid>[-\w]+)/$', views.job_edit, name='job_edit'),
     url(r'^job/serve/(?P<uid>[-\w]+)/(?P<path>.+)$', views.job_serve, name='job_serve'),
     url(r'^job/delete/(?P<uid>[-\w]+)/$', views.job_delete, name='job_delete'),
+    url(r'^job/download/(?P<uid>[-\w]+)/$', views.job_download, name='job_download'),
 
     # Api calls
     url(r'^recipe/api/list/$', api.recipe_api_list, name='recipe_api_list'),
     url(r'^project/api/list/$', api.project_api_list, name='project_api_list'),
     url(r'^api/recipe/(?P<uid>[-\w]+)/json/$', api.recipe_json, name='recipe_api_json'),
     url(r'^api/recipe/(?P<uid>[-\w]+)/template/$', api.recipe_template, name='recipe_api_template'),
+    url(r'^api/project/(?P<uid>[-\w]+)/recipes/$', api.project_recipes, name='project_api_recipes'),
+    url(r'^api/recipe/(?P<uid>[-\w]+)/run/$', api.recipe_run, name='recipe_api_run'),
+    url(r'^api/job/status/$', api.job_status, name='job_api_status'),
+    url(r'^api/job/(?P<uid>[-\w]+)/files/$', api.job_files, name='job_api_files'),
 
     # Discussions
     url(r'^discussion/list/(?P<uid>[-\w]+)/$', views.discussion_list, name='discussion_list'),
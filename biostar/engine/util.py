@@ -4,8 +4,11 @@ import mimetypes
 import os
 import quopri
 import tarfile
+import time
 import uuid
+import zipfile
 from itertools import islice
+from stat import S_ISREG
 from urllib.parse import quote
 import hjson
 
@@ -42,9 +45,9 @@ def smart_preview(fname):
         mimetype, mimecode = mimetypes.guess_type(fname)
 
         if mimetype == 'application/x-tar' and mimecode == 'gzip':
-            # A Tar gzip file
-            tar = tarfile.open(fname, mode='r')
-            lines = [f'{t.name}' for t in tar]
+            # A Tar gzip file, only the first members are read.
+            with tarfile.open(fname, mode='r|gz') as tar:
+                lines = [f'{t.name}' for t in islice(tar, LINE_COUNT)]
             text = "\n".join(lines)
         elif mimetype == None and mimecode == 'gzip':
             # A GZIP file.
@@ -84,6 +87,261 @@ def write_stream(stream, dest):
     return dest
 
 
+def is_tar_gz(fname):
+    return fname.endswith(".tar.gz") or fname.endswith(".tgz")
+
+
+def stream_extract(fname, dest):
+    """
+    Extracts a tar.gz file into a destination directory in a single pass.
+    Only regular files and directories within the destination are extracted,
+    links in the destination are replaced and never written through.
+    Generates the path of each file and the number of compressed bytes read so far.
+    """
+    dest = os.path.abspath(dest)
+    real_dest = os.path.realpath(dest)
+
+    with open(fname, 'rb') as stream:
+        with tarfile.open(fileobj=stream, mode='r|gz') as tar:
+            for member in tar:
+
+                # Skip members that would land outside of the destination.
+                path = os.path.abspath(os.path.join(dest, member.name))
+                if not path.startswith(dest + os.sep):
+                    continue
+
+                # Skip members inside of linked directories.
+                parent = os.path.realpath(os.path.dirname(path))
+                if parent != real_dest and not parent.startswith(real_dest + os.sep):
+                    continue
+
+                if member.isdir():
+                    os.makedirs(path, exist_ok=True)
+                    continue
+
+                if not member.isfile():
+                    continue
+
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+
+                # A linked file is replaced rather than overwritten.
+                if os.path.islink(path):
+                    os.unlink(path)
+
+                source = tar.extractfile(member)
+                fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_NOFOLLOW", 0), 0o644)
+                with open(fd, 'wb') as fp:
+                    chunk = source.read(CHUNK)
+                    while chunk:
+                        fp.write(chunk)
+                        chunk = source.read(CHUNK)
+
+                yield path, stream.tell()
+
+
+def file_etag(stat):
+    """
+    Returns an ETag for a file stat, in the same format that nginx uses.
+    """
+    return f'"{int(stat.st_mtime):x}-{stat.st_size:x}"'
+
+
+def parse_range(header, size):
+    """
+    Parses a single byte range header into an inclusive (start, end) tuple.
+    Returns None for missing, malformed or multiple ranges.
+    Raises ValueError when the range can not be satisfied.
+    """
+    units, _, spec = header.partition("=")
+    if units.strip() != "bytes" or "," in spec:
+        return None
+
+    first, dash, last = spec.strip().partition("-")
+    valid = dash and (first or last) and all(x.isdigit() for x in (first, last) if x)
+    if not valid:
+        return None
+
+    if not first:
+        # A suffix range selects the last bytes of the file.
+        length = int(last)
+        if not length or not size:
+            raise ValueError("Empty suffix range")
+        return max(size - length, 0), size - 1
+
+    start = int(first)
+    end = int(last) if last else size - 1
+
+    if last and end < start:
+        return None
+    if start >= size:
+        raise ValueError("Range start is beyond the end of the file")
+
+    return start, min(end, size - 1)
+
+
+def read_range(fname, start, end):
+    """
+    Generates the content of a file between the inclusive start and end offsets.
+    """
+    remain = end - start + 1
+    with open(fname, 'rb') as fp:
+        fp.seek(start)
+        while remain > 0:
+            chunk = fp.read(min(CHUNK, remain))
+            if not chunk:
+                break
+            remain -= len(chunk)
+            yield chunk
+
+
+def walkfiles(location):
+    """
+    Generates the regular files in a directory, following links.
+    Dangling links and special files are skipped.
+    """
+    for dirpath, dirnames, fnames in os.walk(location, followlinks=True):
+        dirnames.sort()
+        for fname in sorted(fnames):
+            path = os.path.join(dirpath, fname)
+            if os.path.isfile(path):
+                yield path
+
+
+def dirsize(location):
+    """
+    Returns the cumulative size of the files in a directory.
+    """
+    return sum(os.path.getsize(path) for path in walkfiles(location))
+
+
+def open_regular(path):
+    """
+    Opens a regular file for reading with its stat result.
+    Returns None when the file vanished or can not be read.
+    """
+    try:
+        fp = open(path, 'rb')
+    except OSError:
+        return None
+
+    stat = os.fstat(fp.fileno())
+    if not S_ISREG(stat.st_mode):
+        fp.close()
+        return None
+
+    return fp, stat
+
+
+def read_exactly(fp, size):
+    """
+    Generates exactly size bytes from an open file, zero padded if the file shrank.
+    """
+    remain = size
+    while remain > 0:
+        try:
+            chunk = fp.read(min(CHUNK, remain))
+        except OSError:
+            break
+        if not chunk:
+            break
+        remain -= len(chunk)
+        yield chunk
+
+    while remain > 0:
+        chunk = min(CHUNK, remain)
+        remain -= chunk
+        yield bytes(chunk)
+
+
+def stream_tar(root, paths):
+    """
+    Generates a tar archive of the paths, named relative to the root.
+    Only one chunk of a file is held in memory at a time.
+    """
+    total = 0
+    for path in paths:
+        # Files that can not be read are left out before their header is sent.
+        opened = open_regular(path)
+        if not opened:
+            continue
+
+        fp, stat = opened
+        info = tarfile.TarInfo(name=os.path.relpath(path, root))
+        info.size, info.mtime, info.mode = stat.st_size, stat.st_mtime, 0o644
+
+        header = info.tobuf(format=tarfile.PAX_FORMAT)
+        yield header
+        with fp:
+            yield from read_exactly(fp, size=stat.st_size)
+
+        # Pad the content to a full block.
+        pad = -stat.st_size % tarfile.BLOCKSIZE
+        yield bytes(pad)
+        total += len(header) + stat.st_size + pad
+
+    # The end of archive marker padded to a full record.
+    end = 2 * tarfile.BLOCKSIZE
+    end += -(total + end) % tarfile.RECORDSIZE
+    yield bytes(end)
+
+
+class StreamBuffer(object):
+    """
+    A write only file object that collects the written bytes until taken.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.offset = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.offset
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def stream_zip(root, paths):
+    """
+    Generates a zip archive of the paths, named relative to the root.
+    Only one chunk of a file is held in memory at a time.
+    """
+    buffer = StreamBuffer()
+
+    def generate():
+        with zipfile.ZipFile(buffer, mode='w', compression=zipfile.ZIP_DEFLATED) as zf:
+            for path in paths:
+                # Files that can not be read are left out before their header is sent.
+                opened = open_regular(path)
+                if not opened:
+                    continue
+
+                src, stat = opened
+                info = zipfile.ZipInfo(os.path.relpath(path, root), time.localtime(stat.st_mtime)[:6])
+                info.external_attr = (stat.st_mode & 0xFFFF) << 16
+                info.compress_type = zipfile.ZIP_DEFLATED
+                with src, zf.open(info, mode='w', force_zip64=stat.st_size >= zipfile.ZIP64_LIMIT) as fp:
+                    for chunk in read_exactly(src, size=stat.st_size):
+                        fp.write(chunk)
+                        yield buffer.take()
+                yield buffer.take()
+
+        # The central directory is written on close.
+        yield buffer.take()
+
+    return filter(None, generate())
+
+
 def qiime2view_link(file_url):
     template = "https://view.qiime2.org/visualization/?type=html&src="
 
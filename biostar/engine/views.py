@@ -4,24 +4,27 @@ import os
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.decorators import user_passes_test
+from django.db import DatabaseError
 from django.db.models import Q
-from django.db.models import Sum
 from django.shortcuts import render, redirect
 from django.template import Template, Context
 from django.utils import timezone
 from django.utils.safestring import mark_safe
 from ratelimit.decorators import ratelimit
 from sendfile import sendfile
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse, JsonResponse
+from django.template.loader import render_to_string
 from django.conf import settings
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
 
 from biostar.accounts.models import User
 from biostar.forum import views as forum_views
 from biostar.forum.models import Post
 from biostar.utils.shortcuts import reverse
-from . import tasks, auth, forms, const, util, search
+from . import tasks, auth, forms, const, util, search, archive, paging
 from .decorators import read_access, write_access
-from .models import (Project, Data, Analysis, Job, Access)
+from .models import Project, Data, Analysis, Job, Access
 
 # The current directory
 __CURRENT_DIR = os.path.dirname(__file__)
@@ -117,8 +120,7 @@ def search_bar(request):
     min_length = query_lenth > settings.SEARCH_CHAR_MIN
 
     # Indicate to users that there are no results for search.
-    current_results = len([inner for outer in results.values() for inner in outer])
-    no_results = min_length and current_results == 0
+    no_results = min_length and not results
 
     context = dict(results=results, query=request.GET.get("q", "").strip(),
                    min_length=min_length, no_results=no_results)
@@ -126,14 +128,31 @@ def search_bar(request):
     return render(request, "search.html", context)
 
 
+def recipe_search(request):
+    """
+    Finds the recipes whose template or JSON specification contains the query.
+    """
+    form = search.CodeSearchForm(data=request.GET) if request.GET else search.CodeSearchForm()
+
+    try:
+        results = search.code_search(request=request, form=form) if form.is_bound and form.is_valid() else []
+    except DatabaseError as exc:
+        logger.error(f"Code search error: {exc}")
+        messages.error(request, "The database could not run this regular expression.")
+        results = []
+
+    context = dict(form=form, results=results)
+
+    return render(request, "recipe_search.html", context)
+
+
 def get_access(request, project):
-    user = request.user if request.user.is_authenticated else None
-    user_access = Access.objects.filter(project=project, user=user).first()
     # Current users access
-    user_access = user_access or Access(access=Access.NO_ACCESS)
+    level = auth.get_access_level(user=request.user, project=project, request=request)
+    user_access = Access(project=project, access=level)
 
     # Users already with access to current project
-    user_list = [a.user for a in project.access_set.all() if a.access > Access.NO_ACCESS]
+    user_list = [a.user for a in project.access_set.select_related("user") if a.access > Access.NO_ACCESS]
 
     return user_access, user_list
 
@@ -167,7 +186,7 @@ def project_users(request, uid):
     results = forms.access_forms(users=targets, project=project, exclude=[request.user])
     context = dict(current=current, project=project, results=results, form=form, activate='User Management',
                    q=q, user_access=user_access)
-    counts = get_counts(project)
+    counts = project.get_counts()
     context.update(counts)
     return render(request, "project_users.html", context=context)
 
@@ -180,10 +199,10 @@ def project_info(request, uid):
     project = Project.objects.get_all(uid=uid).first()
 
     # Show counts for the project.
-    counts = get_counts(project)
+    counts = project.get_counts()
 
     # Who has write access
-    write_access = auth.has_write_access(user=user, project=project)
+    write_access = auth.has_write_access(user=user, project=project, request=request)
 
     context = dict(project=project, active="info", write_access=write_access)
     context.update(counts)
@@ -191,6 +210,14 @@ def project_info(request, uid):
     return render(request, "project_info.html", context)
 
 
+def get_page(request, queryset):
+    """
+    Returns the page of a list selected by the cursor in the request.
+    """
+    cursor = request.GET.get("after", "")
+    return paging.get_page(queryset, cursor=cursor, size=settings.LIST_ITEMS_PER_PAGE)
+
+
 def project_list_private(request):
     """Only list private projects belonging to a user."""
 
@@ -198,12 +225,12 @@ def project_list_private(request):
 
     empty_msg = "No projects found."
     if request.user.is_anonymous:
-        projects = []
+        projects = Project.objects.none()
         empty_msg = mark_safe(f"You need to <a href={reverse('login')}> log in</a> to view your projects.")
-    else:
-        projects = projects.order_by("-date", "-lastedit_date", "-id")
 
-    context = dict(projects=projects, private="active", msg=empty_msg)
+    projects = get_page(request, projects.select_related("owner"))
+
+    context = dict(projects=projects, private="active", msg=empty_msg, next_url=paging.next_url(request, projects))
 
     return render(request, "project_list.html", context)
 
@@ -213,8 +240,9 @@ def project_list(request):
 
     # Exclude private projects
     projects = projects.exclude(privacy=Project.PRIVATE)
-    projects = projects.order_by("-date", "-lastedit_date", "-id")
-    context = dict(projects=projects, public="active")
+    projects = get_page(request, projects.select_related("owner"))
+
+    context = dict(projects=projects, public="active", next_url=paging.next_url(request, projects))
 
     return render(request, "project_list.html", context)
 
@@ -252,7 +280,7 @@ def discussion_create(request, uid):
     template = "discussion_create.html"
 
     context = dict(project=project, activate='Start a Discussion')
-    counts = get_counts(project)
+    counts = project.get_counts()
     context.update(counts)
 
     allowed_posts = [
@@ -276,7 +304,7 @@ def discussion_view(request, uid):
     next_url = reverse("discussion_view", kwargs=dict(uid=obj.uid))
 
     context = dict(project=project, activate="Discussion", sub_url=sub_url, next_url=next_url)
-    counts = get_counts(project)
+    counts = project.get_counts()
     context.update(counts)
 
     return forum_views.post_view(request=request, template=template, extra_context=context,
@@ -299,18 +327,6 @@ def job_list(request, uid):
     return project_view(request=request, uid=uid, template_name="job_list.html", active='jobs')
 
 
-def get_counts(project):
-    data_count = project.data_set.count()
-    recipe_count = project.analysis_set.count()
-    result_count = project.job_set.count()
-    discussion_count = 0
-
-    return dict(
-        data_count=data_count, recipe_count=recipe_count, result_count=result_count,
-        discussion_count=discussion_count
-    )
-
-
 @read_access(type=Project)
 def project_view(request, uid, template_name="project_info.html", active='info', show_summary=None,
                  extra_context={}):
@@ -325,9 +341,9 @@ def project_view(request, uid, template_name="project_info.html", active='info',
     project = Project.objects.get_all(uid=uid).first()
 
     # Select all the data in the project.
-    data_list = project.data_set.order_by("-sticky", "-date").all()
-    recipe_list = project.analysis_set.order_by("-sticky", "-date").all()
-    job_list = project.job_set.order_by("-sticky", "-date").all()
+    data_list = project.data_set.all()
+    recipe_list = project.analysis_set.all()
+    job_list = project.job_set.all()
 
     # Filter job results by analysis
     filter_uid = request.GET.get('filter', '')
@@ -338,17 +354,28 @@ def project_view(request, uid, template_name="project_info.html", active='info',
         job_list = job_list.filter(analysis=recipe_filter)
 
     # Add related content.
-    job_list = job_list.select_related("analysis")
+    job_list = job_list.select_related("analysis", "owner")
+    recipe_list = recipe_list.select_related("owner")
+
+    # Only the list that is shown is loaded, one page at a time.
+    lists = dict(data=data_list, recipes=recipe_list, jobs=job_list)
+    page = None
+    if active in lists:
+        page = get_page(request, lists[active])
+        lists[active] = page
+
+    next_url = paging.next_url(request, page) if page is not None else ""
 
     # Who has write access
-    write_access = auth.has_write_access(user=user, project=project)
+    write_access = auth.has_write_access(user=user, project=project, request=request)
 
     # Build the context for the project.
-    context = dict(project=project, data_list=data_list, recipe_list=recipe_list, job_list=job_list,
-                   active=active, recipe_filter=recipe_filter, write_access=write_access)
+    context = dict(project=project, data_list=lists["data"], recipe_list=lists["recipes"],
+                   job_list=lists["jobs"], next_url=next_url, active=active,
+                   recipe_filter=recipe_filter, write_access=write_access)
 
     # Compute counts for the project.
-    counts = get_counts(project)
+    counts = project.get_counts()
 
     # Update conext with the counts.
     context.update(counts)
@@ -443,6 +470,12 @@ def job_file_copy(request, uid, path):
 
     # Get the root data where the file exists
     job = Job.objects.get_all(uid=uid).first()
+
+    # Files in cold storage can not be linked into data.
+    if job.is_archived() or job.is_purged():
+        messages.error(request, "The results of archived jobs can not be copied.")
+        return redirect(reverse("job_view", kwargs=dict(uid=uid)))
+
     fullpath = os.path.join(job.get_data_dir(), path)
 
     auth.copy_file(request=request, fullpath=fullpath)
@@ -501,23 +534,32 @@ def data_paste(request, uid):
     board = request.GET.get("board")
     clipboard = request.session.get(settings.CLIPBOARD_NAME, {})
     data_clipboard = clipboard.get(board, [])
+    skipped = []
 
     for datauid in data_clipboard:
 
         if board == const.DATA_CLIPBOARD:
             obj = Data.objects.get_all(uid=datauid).first()
-            dtype = obj.type
+            dtype = obj.type if obj else None
         else:
             obj = Job.objects.get_all(uid=datauid).first()
             dtype = "DATA"
 
+            # The outputs of archived jobs are no longer on disk.
+            if obj and (obj.is_archived() or obj.is_purged()):
+                skipped.append(obj.name)
+                continue
+
         if obj:
             auth.create_data(project=project, path=obj.get_data_dir(), user=owner, name=obj.name,
                              type=dtype, text=obj.text)
 
     clipboard[board] = []
     request.session.update({settings.CLIPBOARD_NAME: clipboard})
-    messages.success(request, "Pasted data in clipboard")
+    if skipped:
+        messages.error(request, f"The results of archived jobs can not be pasted: {', '.join(skipped)}")
+    else:
+        messages.success(request, "Pasted data in clipboard")
     return redirect(reverse("data_list", kwargs=dict(uid=project.uid)))
 
 
@@ -527,10 +569,17 @@ def file_paste(request, uid):
     project = Project.objects.get_all(uid=uid).first()
     clipboard = request.session.get(settings.CLIPBOARD_NAME, {})
     file_clipboard = clipboard.get(const.FILES_CLIPBOARD, [])
+    missing = []
 
     for single_file in file_clipboard:
         if os.path.exists(single_file):
             auth.create_data(project=project, path=single_file, user=request.user)
+        else:
+            missing.append(os.path.basename(single_file))
+
+    # Files may be archived or removed after they were copied.
+    if missing:
+        messages.error(request, f"Files no longer exist: {', '.join(missing)}")
 
     clipboard[const.FILES_CLIPBOARD] = []
     request.session.update({settings.CLIPBOARD_NAME: clipboard})
@@ -545,12 +594,39 @@ def data_view(request, uid):
     project = data.project
 
     context = dict(data=data, project=project, activate='Selected Data')
-    counts = get_counts(project)
+    counts = project.get_counts()
     context.update(counts)
 
     return render(request, "data_view.html", context)
 
 
+@write_access(type=Data, fallback_view="data_view")
+def data_unpack(request, uid):
+    """
+    Extracts the tar.gz files of a data into its data directory.
+    """
+    data = Data.objects.get_all(uid=uid).first()
+
+    if data.state == Data.PENDING:
+        messages.error(request, "The data is being processed. Wait until it finishes.")
+        return redirect(data.url())
+
+    if not data.can_unpack():
+        messages.error(request, "The data does not contain a tar.gz file.")
+        return redirect(data.url())
+
+    # Spool the extraction if UWSGI exists.
+    if tasks.HAS_UWSGI:
+        Data.objects.get_all(uid=uid).update(state=Data.PENDING)
+        tasks.async_unpack_data.spool(data_id=data.id)
+        messages.info(request, "Extracting the archive. Files appear as they are unpacked.")
+    else:
+        tasks.unpack_data(data_id=data.id)
+        messages.info(request, "Extracted the archive.")
+
+    return redirect(data.url())
+
+
 @write_access(type=Data, fallback_view="data_view")
 def data_edit(request, uid):
     """
@@ -586,10 +662,8 @@ def data_upload(request, uid):
             messages.info(request, f"Uploaded: {data.name}. Edit the data to set its type.")
             return redirect(reverse("data_list", request=request, kwargs={'uid': project.uid}))
 
-    uploaded_files = Data.objects.filter(owner=owner, method=Data.UPLOAD)
-
     # The current size of the existing data
-    current_size = uploaded_files.aggregate(Sum("size"))["size__sum"] or 0
+    current_size = owner.profile.storage_used()
 
     # Maximum data that may be uploaded.
     maximum_size = owner.profile.max_upload_size * 1024 * 1024
@@ -597,7 +671,7 @@ def data_upload(request, uid):
     context = dict(project=project, form=form, activate="Add Data", maximum_size=maximum_size,
                    current_size=current_size)
 
-    counts = get_counts(project)
+    counts = project.get_counts()
 
     context.update(counts)
 
@@ -615,7 +689,7 @@ def recipe_view(request, uid):
 
     # How many results for this recipe
     rcount = Job.objects.filter(analysis=recipe).count()
-    counts = get_counts(project)
+    counts = project.get_counts()
     context.update(counts, rcount=rcount)
 
     return render(request, "recipe_view.html", context)
@@ -669,7 +743,7 @@ def recipe_code_view(request, uid):
     context = dict(recipe=recipe, project=project, activate='Recipe Code', script=script)
 
     rcount = Job.objects.filter(analysis=recipe).count()
-    counts = get_counts(project)
+    counts = project.get_counts()
     context.update(counts, rcount=rcount)
 
     return render(request, "recipe_code_view.html", context)
@@ -706,12 +780,7 @@ def recipe_run(request, uid):
                                   json_data=json_data, name=name)
 
             # Spool the job right away if UWSGI exists.
-            if tasks.HAS_UWSGI:
-                # Update the job state.
-                Job.objects.get_all(id=job.id).update(state=Job.SPOOLED)
-
-                # Spool via UWSGI.
-                tasks.execute_job.spool(job_id=job.id)
+            auth.spool_job(job)
 
             return redirect(reverse("job_list", request=request, kwargs=dict(uid=project.uid)))
     else:
@@ -720,7 +789,7 @@ def recipe_run(request, uid):
 
     context = dict(project=project, analysis=analysis, form=form, activate='Run Recipe')
 
-    context.update(get_counts(project))
+    context.update(project.get_counts())
 
     return render(request, 'recipe_run.html', context)
 
@@ -859,17 +928,47 @@ def job_view(request, uid):
 
     context = dict(job=job, project=project, activate='View Result', path=path)
 
-    counts = get_counts(project)
+    counts = project.get_counts()
     context.update(counts)
 
     return render(request, "job_view.html", context=context)
 
 
+@read_access(type=Project)
+def job_status(request, uid):
+    """
+    Returns the jobs of a project whose state changed after a version.
+    Answers at once, the page asks again after the interval in the response.
+    """
+    try:
+        since = int(request.GET.get("since", 0))
+    except ValueError:
+        since = 0
+
+    project = Project.objects.get_all(uid=uid).first()
+    version = project.job_version
+
+    changed = Job.objects.filter(project=project, version__gt=since) if version > since else []
+
+    jobs = [dict(uid=job.uid, state=job.state, finished=job.is_finished(),
+                 html=render_to_string("widgets/job_elapsed.html", dict(job=job))) for job in changed]
+
+    return JsonResponse(dict(version=version, jobs=jobs, interval=settings.JOB_STATUS_INTERVAL))
+
+
 def file_serve(request, path, obj):
     """
     Authenticates access through decorator before serving file.
     """
 
+    # Jobs in cold storage are served from their archive.
+    if isinstance(obj, Job) and obj.is_archived():
+        return archive_serve(request=request, path=path, job=obj)
+
+    if isinstance(obj, Job) and obj.is_purged():
+        messages.error(request, "The files of this job were removed by the retention policy.")
+        return redirect(obj.url())
+
     # Get the object that corresponds to the entry.
     root = obj.get_data_dir()
 
@@ -877,27 +976,180 @@ def file_serve(request, path, obj):
     file_path = join(root, path)
 
     # Ensure only files in the object root can be accessed.
-    if not file_path.startswith(root) or not os.path.isfile(file_path):
-        msg = "Invalid path." if (not file_path.startswith(root)) else f"File not found: {path}"
+    inside = file_path.startswith(root + os.sep)
+    if not inside or not os.path.isfile(file_path):
+        msg = "Invalid path." if not inside else f"File not found: {path}"
         messages.error(request, msg)
         return redirect(obj.url())
 
     # The response will be the file content.
     mimetype = auth.guess_mimetype(fname=path)
 
-    # Get the filesize in Mb
-    size = os.path.getsize(file_path) / 1024 / 1024
+    # Validators for conditional requests.
+    stat = os.stat(file_path)
+    etag = util.file_etag(stat)
+    last_modified = int(stat.st_mtime)
+
+    # Unchanged files are answered without touching the file.
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+
+    if response is None:
+        response = range_serve(request, file_path=file_path, stat=stat, etag=etag, mimetype=mimetype)
+
+    if response is None:
+        # Get the filesize in Mb
+        size = stat.st_size / 1024 / 1024
+
+        # This behavior can be further customized in front end webserver.
+        if size < 20:
+            # Return small files in the browser if possible.
+            response = sendfile(request, file_path, mimetype=mimetype)
+        else:
+            # Trigger a file download for bigger files.
+            fname = os.path.basename(file_path)
+            response = sendfile(request, file_path, attachment=True, attachment_filename=fname, mimetype=mimetype)
+
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    response['Accept-Ranges'] = 'bytes'
+
+    return response
+
+
+def archive_serve(request, path, job):
+    """
+    Streams a single file out of a job archive through the archive index.
+    """
+    fname = job.get_archive_path()
+    info = archive.member_info(fname, path)
+
+    if not info:
+        messages.error(request, f"File not found: {path}")
+        return redirect(job.url())
+
+    mimetype = auth.guess_mimetype(fname=path)
+
+    # The checksum of the member identifies its content.
+    etag = f'"{info.CRC:x}-{info.file_size:x}"'
+    last_modified = int(archive.member_mtime(info))
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+
+    if response is None:
+        stream = archive.read_member(fname, path)
+        response = StreamingHttpResponse(stream, content_type=mimetype or 'application/octet-stream')
+        response['Content-Length'] = info.file_size
 
-    # This behavior can be further customized in front end webserver.
-    if size < 20:
-        # Return small files in the browser if possible.
-        data = sendfile(request, file_path, mimetype=mimetype)
-    else:
         # Trigger a file download for bigger files.
-        fname = os.path.basename(file_path)
-        data = sendfile(request, file_path, attachment=True, attachment_filename=fname, mimetype=mimetype)
+        if info.file_size > 20 * 1024 * 1024:
+            response['Content-Disposition'] = f'attachment; filename={os.path.basename(path)}'
+
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+
+    return response
+
+
+def range_serve(request, file_path, stat, etag, mimetype):
+    """
+    Serves byte range requests when the sendfile backend streams from python.
+    Front end webservers handle ranges on their own for X-Accel-Redirect.
+    """
+    header = request.META.get('HTTP_RANGE', '')
+
+    if not header or settings.SENDFILE_BACKEND != "sendfile.backends.development":
+        return None
+
+    # A range for a changed file returns the full file instead.
+    if_range = request.META.get('HTTP_IF_RANGE', '')
+    if if_range and if_range not in (etag, http_date(stat.st_mtime)):
+        return None
+
+    try:
+        selected = util.parse_range(header=header, size=stat.st_size)
+    except ValueError:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{stat.st_size}'
+        return response
+
+    if selected is None:
+        return None
+
+    start, end = selected
+    stream = util.read_range(fname=file_path, start=start, end=end)
+    response = StreamingHttpResponse(stream, status=206, content_type=mimetype or 'application/octet-stream')
+    response['Content-Range'] = f'bytes {start}-{end}/{stat.st_size}'
+    response['Content-Length'] = end - start + 1
+
+    return response
 
-    return data
+
+# Maps the archive format to the generator and the content type.
+ARCHIVE_FORMATS = dict(
+    zip=(util.stream_zip, "application/zip"),
+    tar=(util.stream_tar, "application/x-tar"),
+)
+
+
+def file_download(request, obj):
+    """
+    Streams the files of an object directory as a single zip or tar archive.
+    The archive is generated on the fly and never stored on disk.
+    """
+    root = obj.get_data_dir()
+
+    # An optional subdirectory to download.
+    path = request.GET.get("path", "")
+
+    # Archived jobs are downloaded as the stored archive.
+    if isinstance(obj, Job) and obj.is_archived():
+        if path:
+            messages.error(request, "Archived results can only be downloaded as a whole.")
+            return redirect(obj.url())
+        return sendfile(request, obj.get_archive_path(), attachment=True,
+                        attachment_filename=f"{obj.uid}.zip", mimetype='application/zip')
+
+    target = join(root, path)
+
+    # The target has to be the root or a directory below it.
+    inside = target == root or target.startswith(root + os.sep)
+    if not inside or not os.path.isdir(target):
+        messages.error(request, f"Directory not found: {path}")
+        return redirect(obj.url())
+
+    # Archive format chosen by the user.
+    fmt = request.GET.get("format", "zip")
+    if fmt not in ARCHIVE_FORMATS:
+        messages.error(request, f"Invalid archive format: {fmt}")
+        return redirect(obj.url())
+
+    paths = util.walkfiles(target)
+    stream_func, content_type = ARCHIVE_FORMATS[fmt]
+    stream = stream_func(root=root, paths=paths)
+
+    name = "_".join(os.path.relpath(target, os.path.dirname(root)).split(os.sep))
+    response = StreamingHttpResponse(stream, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename={name}.{fmt}'
+
+    return response
+
+
+@read_access(type=Data)
+def data_download(request, uid):
+    """
+    Downloads the data directory as an archive.
+    """
+    obj = Data.objects.get_all(uid=uid).first()
+    return file_download(request=request, obj=obj)
+
+
+@read_access(type=Job)
+def job_download(request, uid):
+    """
+    Downloads the job directory as an archive.
+    """
+    obj = Job.objects.get_all(uid=uid).first()
+    return file_download(request=request, obj=obj)
 
 
 @read_access(type=Data)
@@ -2,8 +2,6 @@
 import bleach
 import datetime
 import logging
-import re
-import mistune
 from itertools import chain
 
 from django.contrib import messages
@@ -15,8 +13,8 @@ from django.db import transaction
 
 from biostar.message import tasks
 from biostar.accounts.models import Profile
-from biostar.utils.shortcuts import reverse
-from .models import Post, Vote, Subscription, PostView
+from biostar.utils import markup
+from .models import Post, Vote, Subscription, PostView, update_discussion_count
 from . import util
 from .const import *
 
@@ -288,29 +286,23 @@ def create_post_from_json(json_dict):
 def parse_mentioned_users(content):
 
     # Any word preceded by a @ is considered a user handler.
-    handler_pattern = "\@[^\s]+"
-    # Drop leading @
-    users_list = set(x[1:] for x in re.findall(handler_pattern, content))
+    users_list = markup.mentioned([content])
 
     return User.objects.filter(username__in=users_list)
 
 
-def parse_html(text):
-    "Sanitize text and expand links to match content"
+def parse_html(text, links=None):
+    """
+    Sanitize text and expand links to match content.
+    Pages rendering many texts pass the links from markup.resolve_mentions
+    to resolve the mentioned users of all texts at once.
+    """
+    links = markup.resolve_mentions([text]) if links is None else links
 
-    # This will collect the objects that could be embedded
-    mentioned_users = parse_mentioned_users(content=text)
-
-    html = mistune.markdown(text)
+    html = markup.render(text)
 
     # embed the objects
-    for user in mentioned_users:
-        url = reverse("user_profile", kwargs=dict(uid=user.profile.uid))
-        handler = f"@{user.username}"
-        emb_patt = f'<a href="{url}">{handler}</a>'
-        html = html.replace(handler, emb_patt)
-
-    return html
+    return markup.link_mentions(html, links)
 
 
 def delete_post(post, request):
@@ -416,6 +408,9 @@ def moderate_post(request, action, post, comment=None, dupes=[]):
             content = util.render(name=extra_content, user=post.author, comment=comment, posts=output or post)
             # Create a comment to the post
             Post.objects.create(content=content, type=Post.COMMENT, html=content, parent=post, author=user)
+
+        # Moderation changes the status with bulk updates.
+        update_discussion_count(post.project_id)
     else:
         messages.error(request, "Invalid moderation action given")
 
@@ -1,7 +1,6 @@
 import bleach
 import logging
 import datetime
-import mistune
 
 from django.utils import timezone
 from django.db import models
@@ -9,9 +8,10 @@ from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.sites.models import Site
 from django.dispatch import receiver
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.db.models import F, Q
 from biostar.utils.shortcuts import reverse
+from biostar.utils import markup
 from taggit.managers import TaggableManager
 from biostar.engine.models import Project
 from . import util
@@ -40,7 +40,7 @@ class PostManager(models.Manager):
 
         # Prefetch tags and thread user info
         query = query.prefetch_related("tags", "thread_users__profile", "thread_users")
-        query = query.select_related("root", "author", "author__profile", "lastedit_user", "lastedit_user__profile")
+        query = query.select_related("root", "root__author", "author", "author__profile", "lastedit_user", "lastedit_user__profile")
         return query
 
     def get_queryset(self):
@@ -291,7 +291,7 @@ class Post(models.Model):
         self.lastedit_user = self.lastedit_user or self.author
 
         # Sanitize the post body.
-        self.html = self.html or mistune.markdown(self.content)
+        self.html = self.html or markup.render(self.content)
 
         # Must add tags with instance method. This is just for safety.
         self.tag_val = util.strip_tags(self.tag_val)
@@ -400,6 +400,26 @@ class Subscription(models.Model):
         return None if user.is_anonymous else sub
 
 
+def update_discussion_count(project_id):
+    """
+    Recounts the open discussions of a project.
+    Posts change status with bulk updates, so the count is rebuilt on each change.
+    """
+    if not project_id:
+        return
+
+    query = Post.objects.get_discussions(project_id=project_id, type__in=Post.TOP_LEVEL)
+    count = query.exclude(status=Post.DELETED).count()
+    Project.objects.get_all(pk=project_id).update(discussion_count=count)
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def update_discussions(sender, instance, *args, **kwargs):
+    if instance.project_id and instance.is_toplevel:
+        update_discussion_count(instance.project_id)
+
+
 @receiver(post_save, sender=Post)
 def set_post(sender, instance, created, *args, **kwargs ):
 
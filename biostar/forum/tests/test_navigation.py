@@ -1,11 +1,14 @@
 import logging, os
 from django.test import TestCase
 from django.test import Client
+from django.conf import settings
 from biostar.forum import auth, models
 from biostar.accounts.models import User
 
 from django.urls import reverse
 
+from biostar.utils.queries import QueryBudgetMixin
+
 
 logger = logging.getLogger('engine')
 
@@ -62,4 +65,46 @@ class ForumNavigation(TestCase):
         self.visit_urls(urls, [302])
 
 
+class ForumQueryBudget(QueryBudgetMixin, TestCase):
+
+    def setUp(self):
+        logger.setLevel(logging.WARNING)
+
+        self.owner = User.objects.create(username="test", email="test@test.com")
+        self.owner.set_password("testing")
+        self.owner.save()
+
+        self.post = auth.create_post(title="Test", author=self.owner, content="Test",
+                                     post_type=models.Post.QUESTION)
+        self.client.login(username="test", password="testing")
+
+    def add_posts(self, count):
+        "Adds questions and answers to the test post"
+        for step in range(count):
+            auth.create_post(title=f"Question {step}", author=self.owner, content=f"Question {step}",
+                             post_type=models.Post.QUESTION, tag_val="test")
+            auth.create_post(title=f"Answer {step}", author=self.owner, content=f"Answer @test {step}",
+                             post_type=models.Post.ANSWER, parent=self.post, root=self.post)
+
+    def page_queries(self, url):
+        with self.assertMaxQueries(settings.QUERY_BUDGET, label=url) as recorder:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, f"{url} returned {response.status_code}")
+        return recorder.count
+
+    def test_page_budgets(self):
+        "Checking that the queries of the forum pages do not grow with the posts"
 
+        urls = [
+            reverse('post_list'),
+            reverse('post_view', kwargs=dict(uid=self.post.uid)),
+        ]
+
+        self.add_posts(1)
+        before = {url: self.page_queries(url) for url in urls}
+
+        self.add_posts(5)
+        after = {url: self.page_queries(url) for url in urls}
+
+        for url in urls:
+            self.assertLessEqual(after[url], before[url], f"{url} runs {after[url] - before[url]} more queries")
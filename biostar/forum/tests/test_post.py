@@ -79,6 +79,28 @@ class PostTest(TestCase):
 
         return
 
+    def test_parse_html(self):
+        "Test markdown rendering is cached and mentions are linked"
+        from unittest.mock import patch
+        from biostar.utils import markup
+
+        User.objects.create(username="bob", email="bob@test.com")
+        User.objects.create(username="bobby", email="bobby@test.com")
+
+        text = "Thanks @bobby and @bob, see **this**"
+        links = markup.resolve_mentions([text, "@nobody"])
+        self.assertEqual(set(links), {"bob", "bobby"})
+
+        html = auth.parse_html(text, links=links)
+        self.assertIn(f'<a href="{links["bobby"]}">@bobby</a>', html)
+        self.assertIn(f'<a href="{links["bob"]}">@bob</a>', html)
+        self.assertIn("<strong>this</strong>", html)
+
+        # Identical text is rendered once.
+        with patch("mistune.markdown") as render:
+            self.assertEqual(markup.render(text), markup.render(text))
+            self.assertFalse(render.called)
+
     def test_moderate(self):
 
         # Test every moderation action
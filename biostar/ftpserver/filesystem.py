@@ -1,40 +1,23 @@
 import logging
 import time
 import os
+import stat
+from collections import Counter
 
 from pyftpdlib.filesystems import AbstractedFS
+from django.conf import settings
 from django.contrib.auth.models import AnonymousUser
 from biostar.engine.models import Data, Job, Access
-from biostar.engine import auth
+from biostar.engine import auth, archive
 from biostar.accounts.models import Profile
 
-from .util import parse_virtual_path, query_tab, index
+from .util import parse_virtual_path, query_tab, query_names, index, TTLCache, PathPrefixes
 
 
 logger = logging.getLogger("engine")
 logger.setLevel(logging.INFO)
 
 
-def fetch_file_info(fname, project, tab=None, tail=[], name=None):
-    """
-    Fetch the actual file path and filetype of a given instance.
-    """
-
-    # Get the Job or Data instance from the name and tab
-    instance = query_tab(tab=tab, name=name or fname, show_instance=True, project=project)
-    assert instance, "Does not exist"
-
-    # Patch together the absolute path to the Job or Data file
-    suffix = fname if not tail else os.path.join(*tail, fname)
-    full_path = os.path.join(instance.get_data_dir(), suffix)
-
-    # Return an actual filename with a type.
-    rfname = full_path if name else instance.get_data_dir()
-    filetype = 'dir' if (os.path.isdir(rfname)) else 'file'
-
-    return rfname, filetype
-
-
 def dir_list(base_dir, tail=[]):
     "Return contents of a given base dir ( and a tail)."
     try:
@@ -87,9 +70,36 @@ class BiostarFileSystem(AbstractedFS):
         # Get authorizer to set write permission on directories.
         self.authorizer = self.cmd_channel.authorizer
 
+        # Resolved projects and instances, reused for a short while.
+        self.cache = TTLCache(ttl=settings.FTP_CACHE_TTL)
+
+        # Stat results of the directory being listed.
+        self.listed = {}
+
         super(BiostarFileSystem, self).__init__(root, cmd_channel)
 
 
+    def get_project(self, name):
+        """
+        Returns the project visible to the user with a name.
+        """
+        key = ("project", name)
+        return self.cache.get_or_set(key, lambda: self.projects.filter(name=name).first())
+
+    def get_instance(self, tab, project, name):
+        """
+        Returns the Data or Job instance at a virtual path.
+        """
+        key = (tab, project, name)
+        lookup = lambda: query_tab(tab=tab, name=name, show_instance=True, project=project)
+        return self.cache.get_or_set(key, lookup)
+
+    def forget(self):
+        """
+        Drops the resolved paths after uploads and new directories.
+        """
+        self.cache.clear()
+
     def ftp2fs(self, ftppath):
         """
         :param ftppath: relative virtual path requested by client
@@ -107,7 +117,7 @@ class BiostarFileSystem(AbstractedFS):
             return abs_ftppath
 
         assert tab in ('data', 'results'), tab
-        instance = query_tab(tab=tab, name=name, show_instance=True, project=root_project)
+        instance = self.get_instance(tab=tab, name=name, project=root_project)
 
         if not instance:
             # We let self.valid_path handle invalid paths
@@ -115,7 +125,7 @@ class BiostarFileSystem(AbstractedFS):
 
         try:
             fullname = os.path.join(instance.get_data_dir(), *tail)
-            is_file = os.path.exists(fullname) and os.path.isfile(fullname)
+            is_file = self.isfile(fullname)
             fname = fullname if is_file else abs_ftppath
         except Exception as exc:
             fname = abs_ftppath
@@ -160,8 +170,9 @@ class BiostarFileSystem(AbstractedFS):
             return is_dir
         try:
             if tail:
-                path = os.path.join(query_tab(tab=tab, name=name, project=root_project), *tail)
-                is_dir = not (os.path.exists(path) and os.path.isfile(path))
+                instance = self.get_instance(tab=tab, name=name, project=root_project)
+                path = os.path.join(instance.get_data_dir(), *tail)
+                is_dir = not self.isfile(path)
         except Exception as exc:
             logger.error(f"{exc}")
 
@@ -181,19 +192,26 @@ class BiostarFileSystem(AbstractedFS):
             return [x.name for x in self.projects ]
 
         # Browse /data or /results inside of a project.
-        if self.projects.filter(name=root_project) and not tab:
+        if self.get_project(root_project) and not tab:
             return ['data', 'results']
 
         # List files in /data or /results
         is_tab = tab and (not name)
-        if self.projects.filter(name=root_project) and is_tab:
+        if self.get_project(root_project) and is_tab:
             jobs = self.jobs.filter(project__name=root_project)
             queryset = self.data.filter(project__name=root_project) if tab == 'data' else jobs
             return [x.name for x in queryset ] or []
 
         # Take a look at specific instance in /data or /results
         is_instance = name and (not tail)
-        base_dir = query_tab(tab=tab, name=name, project=root_project)
+        instance = self.get_instance(tab=tab, name=name, project=root_project) if name else None
+        base_dir = instance.get_data_dir() if instance else None
+
+        # Jobs in cold storage are listed from the archive index.
+        found = base_dir and self.stored_job(os.path.join(base_dir, *tail))
+        if found:
+            job, member = found
+            return archive.listdir(job.get_archive_path(), member)
         # List the files inside of /data and /results tabs
         if base_dir and is_instance:
 
@@ -214,32 +232,82 @@ class BiostarFileSystem(AbstractedFS):
         self._cwd = self.fs2ftp(path)
 
 
-    def format_mlsx(self, basedir, listing, perms, facts, ignore_err=True):
-        logger.info(f"basedir={basedir} listing={listing} facts={facts} perms={perms}")
-
-        lines = []
+    def listing_paths(self, basedir, listing):
+        """
+        Returns the real path of each name listed in a virtual directory.
+        Projects, data and results are looked up with one query per directory.
+        """
         root_project, tab, name, tail = parse_virtual_path(ftppath=basedir)
 
-        is_project = root_project and (not tab)
-        perm = self.set_permissions(basedir=basedir)
+        # Projects at the root.
+        if basedir == self.root:
+            projects = {}
+            for project in self.projects.filter(name__in=set(listing)).order_by("pk"):
+                projects.setdefault(project.name, project)
+            return {fname: project.get_project_dir() for fname, project in projects.items()}
+
+        # The /data and /results tabs of a project.
+        if not tab:
+            project = self.get_project(root_project)
+            return {fname: project.get_project_dir() for fname in listing} if project else {}
+
+        # Data or results in a tab.
+        if not name:
+            instances = query_names(tab=tab, project=root_project, names=listing)
+            return {fname: instance.get_data_dir() for fname, instance in instances.items()}
+
+        # Files inside of a data or a result.
+        instance = self.get_instance(tab=tab, name=name, project=root_project)
+        if not instance:
+            return {}
+        base_dir = os.path.join(instance.get_data_dir(), *tail)
+        return {fname: os.path.join(base_dir, fname) for fname in listing}
+
+    def listing_stats(self, basedir, listing, ignore_err=True):
+        """
+        Generates the name, real path and stat result of each listed name.
+        """
+        paths = self.listing_paths(basedir=basedir, listing=listing)
 
         for fname in listing:
+            path = paths.get(fname)
+            try:
+                if path is None:
+                    raise OSError(f"{fname} not found in {basedir}")
+                st = self.stat(path)
+            except OSError:
+                if ignore_err:
+                    continue
+                raise
+            yield fname, path, st
+
+    def format_list(self, basedir, listing, ignore_err=True):
+        # The names are resolved to real paths before the parent formats them.
+        listed = {os.path.join(basedir, fname): st for fname, path, st in
+                  self.listing_stats(basedir=basedir, listing=listing, ignore_err=ignore_err)}
+
+        names = [fname for fname in listing if os.path.join(basedir, fname) in listed]
+        self.listed = listed
+        try:
+            yield from super(BiostarFileSystem, self).format_list(basedir, names, ignore_err=ignore_err)
+        finally:
+            self.listed = {}
+
+
+    def format_mlsx(self, basedir, listing, perms, facts, ignore_err=True):
+        logger.info(f"basedir={basedir} listing={len(listing)} facts={facts} perms={perms}")
 
-            # Check if listing has multiple names
-            # Let user know that both names point to same thing.
-            if listing.count(fname) > 1:
+        lines = []
+        perm = self.set_permissions(basedir=basedir)
+
+        # Let user know when several names point to the same location.
+        for fname, count in Counter(listing).items():
+            if count > 1:
                 msg = f'"{fname}" occurs twice. Both point to the same location.'
                 self.cmd_channel.respond(f'350  {msg}')
 
-            if basedir == self.root or is_project:
-                name = root_project if is_project else fname
-                project = self.projects.filter(name=name).first()
-                filetype, rfname = 'dir', project.get_project_dir()
-            else:
-                rfname, filetype = fetch_file_info(fname=fname, tab=tab,
-                                                   name=name, tail=tail,
-                                                   project=root_project)
-            st = self.stat(rfname)
+        for fname, path, st in self.listing_stats(basedir=basedir, listing=listing, ignore_err=ignore_err):
+            filetype = 'dir' if stat.S_ISDIR(st.st_mode) else 'file'
             unique = "%xg%x" % (st.st_dev, st.st_ino)
             modify = time.strftime("%Y%m%d%H%M%S", self.timefunc(st.st_mtime))
 
@@ -269,28 +337,139 @@ class BiostarFileSystem(AbstractedFS):
             logger.info(f"is_valid={False}, tab not in data or resutls")
             return False
 
-        if name and not self.projects.filter(name=root_project):
+        if name and not self.get_project(root_project):
             logger.info(f"is_valid={False}, project does not exist")
             return False
 
         return True
 
+    def allowed_roots(self):
+        """
+        The directories the user may access, built from the visible projects.
+        Job directories are added when they are first requested.
+        """
+        def build():
+            uids = self.projects.values_list("uid", flat=True)
+            return PathPrefixes(os.path.join(settings.MEDIA_ROOT, "projects", uid) for uid in uids)
+
+        return self.cache.get_or_set("roots", build)
+
+    def authorized_root(self, path):
+        """
+        Returns the allowed directory that contains a real path or None.
+        """
+        roots = self.allowed_roots()
+        root = roots.find(path)
+        if root:
+            return root
+
+        # Paths in the job directories are checked one job at a time.
+        jobs_dir = os.path.join(settings.MEDIA_ROOT, "jobs")
+        rel = os.path.relpath(os.path.normpath(path), jobs_dir)
+        if rel == os.curdir or rel.startswith(os.pardir):
+            return None
+
+        uid = rel.split(os.sep)[0]
+        if not self.jobs.filter(uid=uid).exists():
+            return None
+
+        root = os.path.join(jobs_dir, uid)
+        roots.add(root)
+        return root
 
     def validate_actual_path(self, path):
         "Make sure user has access to real path requested."
 
-        valid_project_dirs = [p.get_project_dir() for p in self.projects]
-        valid_job_dirs = [job.get_data_dir() for job in self.jobs]
-
-        for basedir in valid_project_dirs + valid_job_dirs:
-            if path.startswith(basedir):
-                logger.info(f"path={path}, basedir={basedir}, is_valid={True and os.path.exists(path=path)}")
-                return os.path.exists(path=path)
+        basedir = self.authorized_root(path)
+        if basedir:
+            is_valid = os.path.exists(path=path) or self.stored_stat(path) is not None
+            logger.info(f"path={path}, basedir={basedir}, is_valid={is_valid}")
+            return is_valid
 
         logger.info(f"is_valid={False}")
         return False
 
 
+    def stored_job(self, path):
+        """
+        Returns the (job, member name) for a path of a job that is no longer
+        in primary storage, or None for all other paths.
+        """
+        if os.path.exists(path):
+            return None
+
+        rel = os.path.relpath(path, os.path.join(settings.MEDIA_ROOT, "jobs"))
+        if rel == os.curdir or rel.startswith(os.pardir):
+            return None
+
+        uid, _, member = rel.partition(os.sep)
+        key = ("stored", uid)
+        job = self.cache.get_or_set(key, lambda: self.jobs.filter(uid=uid).exclude(storage=Job.PRIMARY).first())
+
+        return (job, member.replace(os.sep, "/")) if job else None
+
+
+    def stored_stat(self, path):
+        "Stat results for files and directories of archived or purged jobs."
+
+        found = self.stored_job(path)
+        if not found:
+            return None
+
+        job, member = found
+        fname = job.get_archive_path()
+        info = archive.member_info(fname, member)
+
+        if info:
+            return archive.member_stat(info)
+
+        if archive.is_dir(fname, member):
+            return archive.dir_stat(fname)
+
+        # Purged jobs are shown as empty directories.
+        if job.is_purged() and not member:
+            return os.stat_result((stat.S_IFDIR | 0o555, 0, 0, 1, 0, 0, 0, 0, 0, 0))
+
+        return None
+
+
+    def open(self, filename, mode):
+        found = self.stored_job(filename)
+        if found and 'r' in mode:
+            job, member = found
+            fname = job.get_archive_path()
+            if archive.member_info(fname, member):
+                return archive.open_member(fname, member)
+
+        return super(BiostarFileSystem, self).open(filename, mode)
+
+
+    def stat(self, path):
+        st = self.stored_stat(path)
+        return st if st else super(BiostarFileSystem, self).stat(path)
+
+
+    def lstat(self, path):
+        # Entries being listed were already looked at.
+        st = self.listed.get(path)
+        return st if st else self.stat(path)
+
+
+    def isfile(self, path):
+        if os.path.isfile(path):
+            return True
+        st = self.stored_stat(path)
+        return bool(st and stat.S_ISREG(st.st_mode))
+
+
+    def getsize(self, path):
+        return self.stat(path).st_size
+
+
+    def getmtime(self, path):
+        return self.stat(path).st_mtime
+
+
     def access_to_perm(self, access):
 
         """
@@ -331,11 +510,14 @@ class BiostarFileSystem(AbstractedFS):
 
         root_project, tab, name, tail = parse_virtual_path(ftppath=basedir)
 
-        project = self.projects.filter(name=root_project).first()
+        project = self.get_project(root_project)
         user = self.user["user"]
 
-        access = None if not project else Access.objects.filter(user=user, project=project).first()
-        access = access or Access(access=Access.NO_ACCESS)
+        def lookup():
+            access = None if not project else Access.objects.filter(user=user, project=project).first()
+            return access or Access(access=Access.NO_ACCESS)
+
+        access = self.cache.get_or_set(("access", root_project), lookup)
 
         perm = self.access_to_perm(access=access.access)
 
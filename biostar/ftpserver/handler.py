@@ -1,11 +1,13 @@
 
 import logging
 import os
-from pyftpdlib.handlers import FTPHandler, TLS_FTPHandler
+import time
+from pyftpdlib.handlers import FTPHandler
+from django.conf import settings
 from biostar.engine import auth, models
 
 
-from .util import parse_virtual_path, query_tab
+from .util import parse_virtual_path
 
 
 logger = logging.getLogger("engine")
@@ -14,12 +16,23 @@ logger.setLevel(logging.INFO)
 
 class BiostarFTPHandler(FTPHandler):
 
+    def __init__(self, conn, server, ioloop=None):
+        super(BiostarFTPHandler, self).__init__(conn, server, ioloop=ioloop)
+
+        # The (path, previous size) of the files received by each data since the last toc update.
+        self.received = {}
+        # The size of each file before it is stored, None for new files.
+        self.prior_sizes = {}
+
+        self.toc_task = None
+        self.toc_deadline = 0
+
     def on_connect(self):
         print("%s:%s connected" % (self.remote_ip, self.remote_port))
 
     def on_disconnect(self):
-        # do something when client disconnects
-        pass
+        # Uploads that are still pending are applied when the client leaves.
+        self.update_tocs()
 
     def on_login(self, username):
         # do something when user login
@@ -31,9 +44,8 @@ class BiostarFTPHandler(FTPHandler):
         self.fs = self.abstracted_fs(root="/", cmd_channel=self, current_user=username)
 
     def on_logout(self, username):
-        # do something when user logs out
-
-        pass
+        # Uploads that are still pending are applied when the user logs out.
+        self.update_tocs()
 
     def on_file_sent(self, file):
         # do something after a file has been sent
@@ -44,25 +56,85 @@ class BiostarFTPHandler(FTPHandler):
     def on_file_received(self, file):
         """Only recieve files in data tabs"""
 
-        #TODO: hardcoded "store-"
-        datauid = [s.split("-")[1] for s in file.split(os.sep) if "store-" in s][0]
+        # Data files are stored in projects/<project uid>/<data uid>/
+        rel = os.path.relpath(file, os.path.join(settings.MEDIA_ROOT, "projects"))
+        parts = rel.split(os.sep)
+        datauid = parts[1] if len(parts) > 2 and parts[0] != os.pardir else None
 
-        data = models.Data.objects.filter(uid=datauid).first()
-        if data:
-            # Update the toc
-            data.make_toc()
-            # Trigger another save
-            data.save()
+        # The upload changes the directory contents.
+        self.fs.forget()
+
+        if not datauid:
+            return
+
+        prior = self.prior_sizes.pop(file, None)
+        self.received.setdefault(datauid, []).append((file, prior))
+
+        self.schedule_tocs()
 
         return
 
+    def schedule_tocs(self):
+        """
+        Updates the tocs once the uploads pause for a moment. Each upload
+        pushes the update back, but never past the longest wait.
+        """
+        now = time.monotonic()
+
+        if self.toc_task is None or self.toc_task.cancelled:
+            self.toc_deadline = now + settings.FTP_TOC_MAX_DELAY
+            self.toc_task = self.call_later(settings.FTP_TOC_DELAY, self.update_tocs)
+        elif now + settings.FTP_TOC_DELAY <= self.toc_deadline:
+            self.toc_task.reset()
+
+    def remember_size(self, file):
+        "Keeps the size of a file that is about to be stored."
+        self.prior_sizes[file] = os.path.getsize(file) if os.path.isfile(file) else None
+
+    def update_tocs(self):
+        """
+        Adds the received files to the table of contents and their size to the data.
+        The directories are not walked again.
+        """
+        if self.toc_task is not None and not self.toc_task.cancelled:
+            self.toc_task.cancel()
+        self.toc_task = None
+
+        received, self.received = self.received, {}
+        if not received:
+            return
+
+        for data in models.Data.objects.filter(uid__in=received).select_related("project"):
+
+            # The size before the first upload of each path in this window.
+            first = {}
+            for path, prior in received[data.uid]:
+                first.setdefault(path, prior)
+
+            added = sorted(path for path, prior in first.items() if prior is None)
+            sizes = [(os.path.getsize(path), prior or 0) for path, prior in first.items() if os.path.isfile(path)]
+            delta = sum(size - prior for size, prior in sizes)
+
+            # Append the new files to the toc.
+            toc = data.get_path()
+            if added:
+                separator = "\n" if os.path.isfile(toc) and os.path.getsize(toc) else ""
+                with open(toc, 'at') as fp:
+                    fp.write(separator + "\n".join(added))
+
+            # Saving the new size also updates the storage counters.
+            data.size += delta
+            data.save()
+
+        logger.info(f"updated tocs={len(received)}")
+
     def on_incomplete_file_sent(self, file):
         # do something when a file is partially sent
         pass
 
     def on_incomplete_file_received(self, file):
         # remove partially uploaded files
-        pass
+        self.prior_sizes.pop(file, None)
 
     def make_project_dir(self, root_project, path):
         """
@@ -79,6 +151,7 @@ class BiostarFTPHandler(FTPHandler):
 
         # Refresh projects tab
         self.fs.projects = auth.get_project_list(user=user)
+        self.fs.forget()
 
         line = self.fs.fs2ftp(path)
         self.respond('257 "%s" directory created.' % line.replace('"', '""'))
@@ -95,6 +168,7 @@ class BiostarFTPHandler(FTPHandler):
         # Refresh /data tab.
         self.fs.data = models.Data.objects.filter(project=project,
                                                   state__in=(models.Data.READY, models.Data.PENDING))
+        self.fs.forget()
         line = self.fs.fs2ftp(path)
         self.respond('257 "%s" directory created.' % line.replace('"', '""'))
         logger.info(f"path={path}")
@@ -117,7 +191,7 @@ class BiostarFTPHandler(FTPHandler):
         # Create a directory inside of the /results or /data tab
         if name:
 
-            instance = query_tab(tab=tab, project=root_project, name=name, show_instance=True)
+            instance = self.fs.get_instance(tab=tab, project=root_project, name=name)
             if instance and not tail:
                 self.respond('550 Directory already exists.')
                 return
@@ -194,8 +268,8 @@ class BiostarFTPHandler(FTPHandler):
 
         if name:
 
-            project = self.fs.projects.filter(name=root_project).first()
-            instance = query_tab(tab=tab, project=root_project, name=name, show_instance=True)
+            project = self.fs.get_project(root_project)
+            instance = self.fs.get_instance(tab=tab, project=root_project, name=name)
 
             if instance and not tail:
                 self.respond('550 File already exists.')
@@ -221,11 +295,15 @@ class BiostarFTPHandler(FTPHandler):
                 # Refresh the data tab
                 self.fs.data = models.Data.objects.filter(project=project,
                                                           state__in=(models.Data.READY, models.Data.PENDING))
+                self.fs.forget()
 
             #if self.is_linked_dir(file=file, data_dir=instance.get_data_dir()):
             #    self.respond('550 Can not write to a linked directory.')
             #    return
 
+            # The size before the upload is needed to update the data size.
+            self.remember_size(file)
+
             # Load the stream into the DTP Data Transfer Protocol
             fd = self.run_as_current_user(self.fs.open, file, mode + 'b')
             self.load_dtp(file_object=fd)
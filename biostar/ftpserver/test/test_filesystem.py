@@ -0,0 +1,152 @@
+import logging
+import os
+from io import BytesIO
+
+from django.test import TestCase
+
+from biostar.engine import auth, models
+from biostar.ftpserver.authorizer import BiostarAuthorizer
+from biostar.ftpserver.filesystem import BiostarFileSystem
+from biostar.utils.queries import record_queries
+
+logger = logging.getLogger('engine')
+
+
+class Channel(object):
+    """
+    The parts of the FTP command channel used by the filesystem.
+    """
+    use_gmt_times = True
+    unicode_errors = "replace"
+    encoding = "utf8"
+
+    def __init__(self, user):
+        self.authorizer = BiostarAuthorizer()
+        self.authorizer.add_user(username=user.email, user=user)
+        self.responses = []
+
+    def respond(self, line):
+        self.responses.append(line)
+
+
+class FileSystemTest(TestCase):
+
+    def setUp(self):
+        logger.setLevel(logging.WARNING)
+
+        self.owner = models.User.objects.create(username="test", email="test@l.com")
+        self.project = auth.create_project(user=self.owner, name="Project")
+
+        stream = BytesIO(b"reads")
+        stream.name = "reads.fq"
+        self.data = auth.create_data(project=self.project, user=self.owner, stream=stream, name="Reads")
+
+        self.channel = Channel(user=self.owner)
+        self.fs = BiostarFileSystem(root="/", cmd_channel=self.channel, current_user=self.owner.email)
+
+    def test_path_cache(self):
+        "Test resolved paths are reused until they expire or an upload happens"
+
+        path = "/Project/data/Reads/Reads"
+        real = os.path.join(self.data.get_data_dir(), "Reads")
+
+        resolve = lambda: (self.fs.ftp2fs(path), self.fs.validate_virtual_path(path), self.fs.isdir(path))
+
+        self.assertEqual(resolve(), (real, True, False))
+        with self.assertNumQueries(0):
+            self.assertEqual(resolve(), (real, True, False))
+
+        self.fs.forget()
+        with self.assertNumQueries(1):
+            self.fs.ftp2fs(path)
+
+        # Entries expire after the time to live.
+        self.fs.cache.ttl = -1
+        self.fs.cache.set("key", "value")
+        self.assertNotIn("key", self.fs.cache)
+
+    def test_cache_size(self):
+        "Test expired entries are dropped and the cache does not grow past its size"
+        from biostar.ftpserver.util import TTLCache
+
+        now = [0]
+        cache = TTLCache(ttl=10, maxsize=3, clock=lambda: now[0])
+
+        for key in range(3):
+            cache.set(key, key)
+        cache.set(3, 3)
+        self.assertEqual(len(cache), 3)
+        self.assertNotIn(0, cache)
+
+        # Expired entries are looked up again, the others are dropped.
+        now[0] = 11
+        self.assertEqual(cache.get_or_set(1, lambda: "new"), "new")
+        self.assertEqual(len(cache), 1)
+
+    def test_actual_path(self):
+        "Test real paths are only valid inside the directories of the user"
+
+        project_dir = self.project.get_project_dir()
+        self.assertTrue(self.fs.validate_actual_path(self.data.get_data_dir()))
+
+        # A directory that only shares the prefix of the project is not valid.
+        sibling = project_dir + "x"
+        os.makedirs(sibling, exist_ok=True)
+        self.addCleanup(os.rmdir, sibling)
+        self.assertFalse(self.fs.validate_actual_path(sibling))
+
+        # Job directories are looked up once.
+        recipe = auth.create_analysis(project=self.project, json_text="{}", template="")
+        job = auth.create_job(analysis=recipe)
+        os.makedirs(job.get_data_dir(), exist_ok=True)
+
+        self.assertTrue(self.fs.validate_actual_path(job.get_data_dir()))
+        with self.assertNumQueries(0):
+            self.assertTrue(self.fs.validate_actual_path(job.get_data_dir()))
+
+        other = models.User.objects.create(username="other", email="other@l.com")
+        project = auth.create_project(user=other, name="Other")
+        self.assertFalse(self.fs.validate_actual_path(project.get_project_dir()))
+
+    def add_data(self, name):
+        stream = BytesIO(name.encode())
+        stream.name = f"{name}.txt"
+        return auth.create_data(project=self.project, user=self.owner, stream=stream, name=name)
+
+    def listing(self, path, command="MLSD"):
+        "Returns the listed lines and the number of queries it took"
+        self.fs.forget()
+        names = self.fs.listdir(path)
+        with record_queries() as recorder:
+            if command == "MLSD":
+                lines = b"".join(self.fs.format_mlsx(path, names, perms="elr", facts=[])).splitlines()
+            else:
+                lines = b"".join(self.fs.format_list(path, names)).splitlines()
+        return lines, recorder.count
+
+    def test_listing(self):
+        "Test listings take the same queries regardless of the number of entries"
+
+        for command in ("MLSD", "LIST"):
+            for path in ("/", "/Project", "/Project/data", "/Project/data/Reads"):
+                lines, count = self.listing(path, command=command)
+                self.assertEqual(len(lines), len(self.fs.listdir(path)), f"{command} {path}")
+
+        lines, count = self.listing("/Project/data")
+        self.assertTrue(lines[0].startswith(b"type=dir;"))
+        self.assertTrue(lines[0].endswith(b" Reads"))
+
+        for step in range(5):
+            self.add_data(f"Sample{step}")
+
+        more_lines, more_count = self.listing("/Project/data")
+        self.assertEqual(len(more_lines), 6)
+        self.assertEqual(more_count, count)
+
+        # Names listed twice are reported once.
+        self.add_data("Reads")
+        self.channel.responses = []
+        lines, count = self.listing("/Project/data")
+        self.assertEqual(len(lines), 7)
+        self.assertEqual(len(self.channel.responses), 1)
+
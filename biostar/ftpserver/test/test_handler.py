@@ -0,0 +1,104 @@
+import logging
+import os
+import socket
+from io import BytesIO
+from unittest.mock import patch
+
+from django.test import TestCase
+from pyftpdlib.servers import FTPServer
+
+from biostar.engine import auth, models, util
+from biostar.ftpserver.authorizer import BiostarAuthorizer
+from biostar.ftpserver.filesystem import BiostarFileSystem
+from biostar.ftpserver.handler import BiostarFTPHandler
+
+logger = logging.getLogger('engine')
+
+
+class Handler(BiostarFTPHandler):
+    authorizer = BiostarAuthorizer()
+    abstracted_fs = BiostarFileSystem
+
+
+class HandlerTest(TestCase):
+
+    def setUp(self):
+        logger.setLevel(logging.WARNING)
+
+        self.owner = models.User.objects.create(username="test", email="test@l.com")
+        self.project = auth.create_project(user=self.owner, name="Project")
+
+        stream = BytesIO(b"reads")
+        stream.name = "reads.fq"
+        self.data = auth.create_data(project=self.project, user=self.owner, stream=stream, name="Reads")
+
+        # A handler connected to a server that is not serving.
+        Handler.authorizer.add_user(username=self.owner.email, user=self.owner)
+        self.server = FTPServer(("127.0.0.1", 0), Handler)
+        self.addCleanup(self.server.close_all)
+
+        client = socket.create_connection(self.server.address)
+        self.addCleanup(client.close)
+        conn, addr = self.server.socket.accept()
+
+        self.handler = Handler(conn, self.server, ioloop=self.server.ioloop)
+        self.handler.on_login(self.owner.email)
+
+    def upload(self, name, content):
+        path = os.path.join(self.data.get_data_dir(), name)
+        self.handler.remember_size(path)
+        with open(path, "wb") as stream:
+            stream.write(content)
+        self.handler.on_file_received(path)
+        return path
+
+    def test_toc_updates(self):
+        "Test uploads are added to the table of contents once per burst"
+
+        for step in range(10):
+            self.upload(f"sample{step}.fq", b"ACGT")
+
+        # The update waits for the burst to end, each upload pushes it back.
+        task = self.handler.toc_task
+        self.assertFalse(task.cancelled)
+        self.assertTrue(task._repush)
+        self.assertEqual(models.Data.objects.get(pk=self.data.pk).size, self.data.size)
+
+        # Without walking the directory again.
+        with patch.object(models.Data, "make_toc") as make_toc:
+            self.handler.update_tocs()
+        self.assertFalse(make_toc.called)
+        self.assertTrue(task.cancelled)
+
+        data = models.Data.objects.get(pk=self.data.pk)
+        self.assertEqual(data.size, self.data.size + 40)
+        self.assertEqual(len(data.get_files()), 11)
+
+        # Replaced files only change the size.
+        self.upload("sample0.fq", b"ACGTACGT")
+        self.upload("extra.fq", b"ACGT")
+
+        # Pending updates are applied when the user leaves.
+        self.handler.on_logout(self.owner.email)
+        self.assertIsNone(self.handler.toc_task)
+
+        data = models.Data.objects.get(pk=self.data.pk)
+        self.assertEqual(data.size, self.data.size + 48)
+        self.assertEqual(sorted(data.get_files()), sorted(util.findfiles(data.get_data_dir(), collect=[])))
+
+        # A file uploaded twice in one window counts once.
+        toc = open(data.get_path()).read()
+        self.upload("sample1.fq", b"ACGTACGTACGT")
+        self.upload("sample1.fq", b"ACGTACGT")
+        self.handler.update_tocs()
+
+        data = models.Data.objects.get(pk=self.data.pk)
+        self.assertEqual(data.size, self.data.size + 52)
+        self.assertEqual(open(data.get_path()).read(), toc)
+
+        # Continuous uploads are not held back past the longest wait.
+        self.upload("late.fq", b"ACGT")
+        task = self.handler.toc_task
+        self.handler.toc_deadline = 0
+        self.upload("later.fq", b"ACGT")
+        self.assertFalse(task._repush)
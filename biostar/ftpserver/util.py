@@ -1,4 +1,5 @@
 import logging
+import time
 
 import os
 
@@ -7,6 +8,9 @@ from biostar.engine.models import Data, Job
 logger = logging.getLogger("engine")
 logger.setLevel(logging.INFO)
 
+# Marks the keys that are not in a cache.
+MISSING = object()
+
 
 
 def index(list, idx):
@@ -20,13 +24,27 @@ def query_tab(tab, project, name=None, show_instance=False):
     "Return actual path for a path name in /data or /results tab"
 
     klass_map = {'data': Data, 'results':Job }
-    instance = klass_map[tab].objects.filter(deleted=False, name=name, project__name=project).first()
+    query = klass_map[tab].objects.filter(deleted=False, name=name, project__name=project)
+    instance = query.select_related("project").first()
     if show_instance:
         return instance
 
     return None if not instance else instance.get_data_dir()
 
 
+def query_names(tab, project, names):
+    "Return the instances in /data or /results of a project keyed by name."
+
+    klass_map = {'data': Data, 'results': Job}
+    query = klass_map[tab].objects.filter(deleted=False, name__in=set(names), project__name=project)
+    instances = {}
+    # The first instance of a name is the one query_tab finds.
+    for instance in query.select_related("project").order_by("pk"):
+        instances.setdefault(instance.name, instance)
+
+    return instances
+
+
 def parse_virtual_path(ftppath):
     "Parse ftp file path into constituting root_project, tab, pk, and tail. "
 
@@ -48,3 +66,91 @@ def parse_virtual_path(ftppath):
     tail = [] if not len(path_list) >= 3 else path_list[3:]
 
     return root_project, tab, instance, tail
+
+
+class TTLCache(object):
+    """
+    A mapping whose entries expire a number of seconds after they were stored.
+    Expired entries are dropped when new ones are stored, the oldest entries
+    make room when the cache is full.
+    """
+
+    def __init__(self, ttl, maxsize=10000, clock=time.monotonic):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.clock = clock
+        # Entries are kept in the order they expire.
+        self.data = {}
+
+    def get(self, key, default=None):
+        value, expires = self.data.get(key, (default, None))
+        if expires is not None and expires < self.clock():
+            del self.data[key]
+            return default
+        return value
+
+    def set(self, key, value):
+        self.data.pop(key, None)
+        self.purge()
+        while len(self.data) >= self.maxsize:
+            del self.data[next(iter(self.data))]
+        self.data[key] = (value, self.clock() + self.ttl)
+        return value
+
+    def get_or_set(self, key, func):
+        """
+        Returns the value of a key, stores the result of the function when it is missing.
+        """
+        value = self.get(key, MISSING)
+        if value is MISSING:
+            value = self.set(key, func())
+        return value
+
+    def purge(self):
+        # The expired entries are at the front.
+        now, expired = self.clock(), []
+        for key, (value, expires) in self.data.items():
+            if expires >= now:
+                break
+            expired.append(key)
+        for key in expired:
+            del self.data[key]
+
+    def __contains__(self, key):
+        return self.get(key, MISSING) is not MISSING
+
+    def __len__(self):
+        return len(self.data)
+
+    def clear(self):
+        self.data.clear()
+
+
+class PathPrefixes(object):
+    """
+    A set of directories. A path is inside the set when it or one of its
+    parent directories is a member, so a lookup costs the depth of the path.
+    """
+
+    def __init__(self, roots=()):
+        self.roots = {os.path.normpath(root) for root in roots}
+
+    def add(self, root):
+        self.roots.add(os.path.normpath(root))
+
+    def discard(self, root):
+        self.roots.discard(os.path.normpath(root))
+
+    def find(self, path):
+        """
+        Returns the member that contains a path or None.
+        """
+        path = os.path.normpath(path)
+        while True:
+            if path in self.roots:
+                return path
+            parent = os.path.dirname(path)
+            if parent == path:
+                return None
+            path = parent
+
@@ -1,6 +1,6 @@
 from django.contrib import messages
 from django.shortcuts import render, redirect
-import mistune
+from biostar.utils import markup
 
 import os
 import glob
@@ -27,7 +27,7 @@ def docs(request, name, docs_dir):
 
     # Render markdown into HTML.
     if target.endswith(".md"):
-        content = mistune.markdown(content)
+        content = markup.render(content)
 
     title = name.replace("-", " ").replace("_", " ").title()
     context = dict(content=content, title=title)
@@ -42,6 +42,21 @@ REPLIES_FEED_COUNT = 15
 
 SEARCH_CHAR_MIN = 2
 
+# The maximum number of search results.
+SEARCH_LIMIT = 50
+
+# Seconds between the job status requests of pages that show unfinished jobs.
+JOB_STATUS_INTERVAL = 5
+
+# The number of rendered markdown texts kept in memory by each process.
+MARKDOWN_CACHE_SIZE = 2000
+
+# Report the SQL queries of each request in the response headers.
+QUERY_BUDGET_REPORT = DEBUG
+
+# Requests running more queries than this are logged.
+QUERY_BUDGET = 50
+
 
 ENGINE_AS_ROOT = True
 
@@ -78,6 +93,9 @@ DEFAULT_FROM_EMAIL = f"{ADMINS[0][0]} <{ADMINS[0][1]}>"
 # Maximum amount of cumulative uploaded files a user is allowed, in mega-bytes.
 MAX_UPLOAD_SIZE = 10
 
+# Count the size of job outputs towards the upload limit.
+UPLOAD_LIMIT_INCLUDES_JOBS = False
+
 # These must be set remote hosts.
 SITE_ID = 1
 SITE_DOMAIN = "localhost"
@@ -90,6 +108,14 @@ HTTP_PORT = ':8000'
 FTP_HOST = "localhost"
 FTP_PORT = 8021
 
+# Seconds an FTP session reuses resolved paths before querying them again.
+FTP_CACHE_TTL = 10
+
+# Seconds without uploads before the FTP server updates the table of contents,
+# and the longest time an update waits during continuous uploads.
+FTP_TOC_DELAY = 2
+FTP_TOC_MAX_DELAY = 30
+
 # Should the site allow signup.
 ALLOW_SIGNUP = True
 
@@ -99,6 +125,33 @@ ALLOW_SELF_MODERATE = False
 # Maximum size of each file upload in MB
 MAX_FILE_SIZE_MB = 300
 
+# Maximum data size in MB for computing file statistics
+# during the request when the spooler is not available.
+STATS_SYNC_MAX_MB = 10
+
+# Seconds that the access rights of a user are kept in the session.
+# Changes invalidate the copies right away when the cache backend is shared
+# by all processes, otherwise a copy may be stale for this long. 0 disables it.
+ACCESS_CACHE_SECONDS = 0
+
+# Completed jobs older than this many days are packed into archives.
+# Set to 0 to keep all job directories unpacked.
+JOB_ARCHIVE_DAYS = 90
+
+# The outputs of jobs older than this many days are removed,
+# the job metadata is kept. Set to 0 to keep outputs forever.
+JOB_PURGE_DAYS = 0
+
+# The number of projects, data, recipes or results shown on a page.
+# Further pages are loaded as the user scrolls down.
+LIST_ITEMS_PER_PAGE = 50
+
+# The number of projects or recipes returned by a page of the API lists.
+API_ITEMS_PER_PAGE = 100
+
+# The largest number of jobs in one API status request.
+API_JOB_STATUS_LIMIT = 1000
+
 LOGIN_REDIRECT_URL = "/project/list/private"
 ACCOUNT_AUTHENTICATED_LOGIN_REDIRECTS = True
 
@@ -153,6 +206,7 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'biostar.engine.middleware.engine_middleware',
+    'biostar.utils.queries.query_budget_middleware',
     'debug_toolbar.middleware.DebugToolbarMiddleware'
 
 ]
@@ -242,6 +296,9 @@ LOCAL_ROOT = join(BASE_DIR, '..', 'export', 'local')
 # The location for the table of contents.
 TOC_ROOT = join(MEDIA_ROOT, 'tocs')
 
+# The archives of jobs in cold storage.
+JOB_ARCHIVE_ROOT = join(MEDIA_ROOT, 'archive')
+
 # Directory to store API data.
 API_DUMP = join(MEDIA_ROOT, "api")
 os.makedirs(API_DUMP, exist_ok=True)
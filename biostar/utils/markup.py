@@ -0,0 +1,109 @@
+"""
+Markdown rendering shared by all apps.
+
+Rendered HTML is kept in a bounded in-memory cache keyed by a hash of the
+text and the renderer version, so identical text is only rendered once per
+process. User mentions are resolved with one query for any number of texts.
+"""
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+
+import mistune
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.urls import reverse
+
+# Changing the version invalidates the cached renders.
+VERSION = f"mistune-{mistune.__version__}-1"
+
+# A valid username preceded by a @ is considered a user handle,
+# trailing dots belong to the sentence and email addresses are skipped.
+MENTION_PATTERN = re.compile(r"(?<![\w@])@([\w.@+-]*[\w@+-])")
+
+
+class LRUCache(object):
+    """
+    A thread safe mapping that keeps the most recently used entries.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.data.get(key)
+            if value is not None:
+                self.data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.data[key] = value
+            self.data.move_to_end(key)
+            while len(self.data) > self.size:
+                self.data.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+
+cache = LRUCache(size=settings.MARKDOWN_CACHE_SIZE)
+
+
+def cache_key(text, escape):
+    digest = hashlib.sha1(text.encode("utf-8", "surrogatepass")).hexdigest()
+    return f"{VERSION}:{int(escape)}:{digest}"
+
+
+def render(text, escape=True):
+    """
+    Renders markdown text into HTML.
+    """
+    text = text or ""
+    key = cache_key(text, escape=escape)
+
+    html = cache.get(key)
+    if html is None:
+        html = mistune.markdown(text, escape=escape)
+        cache.set(key, html)
+
+    return html
+
+
+def mentioned(texts):
+    """
+    Returns the user handles mentioned in the texts.
+    """
+    return {name for text in texts for name in MENTION_PATTERN.findall(text or "")}
+
+
+def resolve_mentions(texts):
+    """
+    Maps the handles mentioned in the texts to profile urls, with one query.
+    """
+    names = mentioned(texts)
+    if not names:
+        return {}
+
+    rows = User.objects.filter(username__in=names).values_list("username", "profile__uid")
+
+    return {name: reverse("user_profile", kwargs=dict(uid=uid)) for name, uid in rows if uid}
+
+
+def link_mentions(html, links):
+    """
+    Turns the resolved handles in the HTML into profile links.
+    """
+    if not links:
+        return html
+
+    # Longer handles first so that the longest handle matches.
+    names = sorted(links, key=len, reverse=True)
+    pattern = re.compile(r"(?<![\w@])@(" + "|".join(map(re.escape, names)) + r")(?![\w@+-])")
+
+    return pattern.sub(lambda m: f'<a href="{links[m.group(1)]}">{m.group(0)}</a>', html)
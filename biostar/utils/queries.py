@@ -0,0 +1,104 @@
+"""
+SQL query instrumentation.
+
+Records the number of queries, the total SQL time and the repeated queries
+of a block of code. The middleware reports them for every request when
+enabled, the test helpers assert upper bounds for views.
+"""
+import logging
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger("engine")
+
+
+class QueryRecorder(object):
+    """
+    Collects the statements executed on the default connection.
+    """
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((sql, time.perf_counter() - start))
+
+    @property
+    def count(self):
+        return len(self.queries)
+
+    @property
+    def duration(self):
+        return sum(elapsed for sql, elapsed in self.queries)
+
+    def duplicates(self):
+        """
+        Returns the statements executed more than once with their counts.
+        The same statement with different parameters is a typical N+1 pattern.
+        """
+        counts = Counter(sql for sql, elapsed in self.queries)
+        return [(sql, count) for sql, count in counts.most_common() if count > 1]
+
+
+@contextmanager
+def record_queries():
+    """
+    Records the queries executed in the block.
+    """
+    recorder = QueryRecorder()
+    with connection.execute_wrapper(recorder):
+        yield recorder
+
+
+def query_budget_middleware(get_response):
+    """
+    Reports the queries of each request in response headers and warns
+    in the log when a request runs more queries than the budget.
+    """
+
+    def middleware(request):
+
+        if not settings.QUERY_BUDGET_REPORT:
+            return get_response(request)
+
+        with record_queries() as recorder:
+            response = get_response(request)
+
+        duplicates = recorder.duplicates()
+
+        response["X-Query-Count"] = recorder.count
+        response["X-Query-Time"] = f"{recorder.duration * 1000:.1f}"
+        response["X-Query-Duplicates"] = sum(count - 1 for sql, count in duplicates)
+
+        if recorder.count > settings.QUERY_BUDGET:
+            logger.warning(f"{request.path} ran {recorder.count} queries "
+                           f"in {recorder.duration * 1000:.1f} ms, budget is {settings.QUERY_BUDGET}")
+            for sql, count in duplicates[:3]:
+                logger.warning(f"repeated {count} times: {sql[:200]}")
+
+        return response
+
+    return middleware
+
+
+class QueryBudgetMixin(object):
+    """
+    Test case helpers that fail when code runs more queries than allowed.
+    """
+
+    @contextmanager
+    def assertMaxQueries(self, budget, label=""):
+        with record_queries() as recorder:
+            yield recorder
+
+        if recorder.count > budget:
+            repeated = "\n".join(f"{count}x {sql}" for sql, count in recorder.duplicates()[:5])
+            self.fail(f"{label} ran {recorder.count} queries, the budget is {budget}.\n{repeated}")